@@ -58,7 +58,7 @@ class BuildResult(object):
     REMOTE_IMAGE = object()
 
     def __init__(self, logs=None, fail_reason=None, image_id=None,
-                 annotations=None, labels=None):
+                 annotations=None, labels=None, logs_path=None):
         """
         :param logs: iterable of log lines (without newlines)
         :param fail_reason: str, description of failure or None if successful
@@ -67,6 +67,8 @@ class BuildResult(object):
                             should be annotated to OpenShift build
         :param labels: dict, data captured during build step which
                        should be set as labels on OpenShift build
+        :param logs_path: str, file with the whole build log, when logs
+                          holds only its last lines
         """
         assert fail_reason is None or bool(fail_reason), \
             "If fail_reason provided, can't be falsy"
@@ -78,6 +80,7 @@ class BuildResult(object):
         self._image_id = image_id
         self._annotations = annotations
         self._labels = labels
+        self._logs_path = logs_path
 
     @staticmethod
     def make_remote_image_result(annotations=None, labels=None):
@@ -89,6 +92,10 @@ class BuildResult(object):
     def logs(self):
         return self._logs
 
+    @property
+    def logs_path(self):
+        return self._logs_path
+
     @property
     def fail_reason(self):
         return self._fail_reason
@@ -14,6 +14,8 @@ FLATPAK_FILENAME = 'flatpak.json'
 BUILD_JSON = 'build.json'
 BUILD_JSON_ENV = 'BUILD_JSON'
 RESULTS_JSON = 'results.json'
+# path to file where the index of available plugins is cached between runs
+PLUGINS_INDEX_CACHE_ENV = 'ATOMIC_REACTOR_PLUGINS_INDEX'
 
 CONTAINER_SHARE_PATH = '/run/share/'
 CONTAINER_SHARE_SOURCE_SUBDIR = 'source'
@@ -26,6 +28,8 @@ HOST_SECRET_PATH = ''
 
 EXPORTED_SQUASHED_IMAGE_NAME = 'image.tar'
 EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE = 'compressed.tar.{0}'
+# size of the independently compressed blocks when compressing in parallel
+COMPRESS_BLOCK_SIZE = 16 * 1024 * 1024
 
 YUM_REPOS_DIR = '/etc/yum.repos.d/'
 RELATIVE_REPOS_PATH = "atomic-reactor-repos/"
@@ -87,6 +91,8 @@ PLUGIN_KOJI_PARENT_KEY = 'koji_parent'
 PLUGIN_COMPARE_COMPONENTS_KEY = 'compare_components'
 PLUGIN_REMOVE_WORKER_METADATA_KEY = 'remove_worker_metadata'
 PLUGIN_RESOLVE_COMPOSES_KEY = 'resolve_composes'
+PLUGIN_CHECK_BUILD_INPUTS_KEY = 'check_build_inputs'
+PLUGIN_FETCH_MAVEN_KEY = 'fetch_maven_artifacts'
 
 # max retries for docker requests
 DOCKER_MAX_RETRIES = 3
@@ -94,6 +100,10 @@ DOCKER_MAX_RETRIES = 3
 DOCKER_BACKOFF_FACTOR = 5
 # docker retries statuses
 DOCKER_CLIENT_STATUS_RETRY = (408, 500, 502, 503, 504)
+# seconds after which failed pulls and pushes are not retried any more
+DOCKER_RETRY_DEADLINE = 60 * 60
+# threads making docker requests concurrently for one tasker
+DOCKER_WORKERS = 8
 # max retries for http requests
 HTTP_MAX_RETRIES = 3
 # how many seconds should wait before another try of http request
@@ -106,6 +116,35 @@ HTTP_REQUEST_TIMEOUT = 600
 GIT_MAX_RETRIES = 3
 # how many seconds should wait before another try of git clone
 GIT_BACKOFF_FACTOR = 5
+# seconds after which a failed git clone is not retried any more
+GIT_RETRY_DEADLINE = 10 * 60
+# consecutive failures talking to a remote host which stop further attempts for a while
+RETRY_BREAKER_THRESHOLD = 5
+# seconds before a host is tried again once its circuit breaker opened
+RETRY_BREAKER_RESET = 30
+# poll intervals are randomly changed by up to this fraction
+RETRY_POLL_JITTER = 0.2
+# seconds after which a lease on a base image is considered abandoned
+IMAGE_LEASE_EXPIRY = 24 * 60 * 60
+# log lines kept in memory for commands whose log is written to a file
+COMMAND_LOG_TAIL_LINES = 1000
+# name of the file in workdir with the full 'docker build' log
+BUILD_LOG_FILENAME = 'docker-build.log'
+# registry content addressed by digest kept in memory, number of entries
+REGISTRY_CACHE_ENTRIES = 256
+# registry content larger than this (in bytes) is never cached
+REGISTRY_CACHE_MAX_SIZE = 4 * 1024 * 1024
+# name of the directory in workdir where registry content is cached
+REGISTRY_CACHE_DIRNAME = 'registry-cache'
+# bytes read at once when computing checksums of files
+CHECKSUM_BLOCKSIZE = 1024 * 1024
+# files whose checksums are remembered
+CHECKSUM_CACHE_ENTRIES = 1024
+# chunks of an exported image read ahead of the consumer
+EXPORT_READ_AHEAD_CHUNKS = 4
+# Dockerfiles modified more recently than this are compared by content,
+# modification time alone may not show the change
+DOCKERFILE_RACY_SECONDS = 2
 
 
 # Media types
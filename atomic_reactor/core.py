@@ -22,21 +22,25 @@ I've tried to be as much consistent (man pages were source) with docker as possi
 
 
 """
+import copy
 import os
+import re
 import shutil
 import logging
 import tempfile
 import json
 import requests
-import time
+import threading
 import docker
 import atomic_reactor.util
 from docker.errors import APIError
 from functools import wraps
+from multiprocessing.pool import ThreadPool
 
 from atomic_reactor.constants import CONTAINER_SHARE_PATH, CONTAINER_SHARE_SOURCE_SUBDIR,\
         BUILD_JSON, DOCKER_SOCKET_PATH, DOCKER_MAX_RETRIES, DOCKER_BACKOFF_FACTOR,\
-        DOCKER_CLIENT_STATUS_RETRY
+        DOCKER_CLIENT_STATUS_RETRY, DOCKER_WORKERS, DOCKER_RETRY_DEADLINE
+from atomic_reactor.retries import CircuitOpenError, RetryPolicy
 from atomic_reactor.source import get_source_instance_for
 from atomic_reactor.util import (
     ImageName, clone_git_repo, figure_out_build_file, Dockercfg)
@@ -217,20 +221,19 @@ class BuildContainerFactory(object):
         return container_id
 
 
+def is_transient_docker_error(exc):
+    """
+    :return: bool, whether exc is an API error worth retrying
+    """
+    return (isinstance(exc, APIError) and
+            exc.response.status_code in DOCKER_CLIENT_STATUS_RETRY)
+
+
 def retry(function, *args, **kwargs):
     retry_times = int(kwargs.pop('retry', 0))
-    retry_delay = DOCKER_BACKOFF_FACTOR
-    retry_client_statuses = DOCKER_CLIENT_STATUS_RETRY
-
-    for counter in range(retry_times + 1):
-        try:
-            return function(*args, **kwargs)
-        except APIError as e:
-            if (e.response.status_code in retry_client_statuses and counter != retry_times):
-                logger.info("retrying %s on %s", function, e.response.status_code)
-                time.sleep(retry_delay * (2 ** counter))
-            else:
-                raise
+    policy = RetryPolicy('docker', retry_times, DOCKER_BACKOFF_FACTOR,
+                         is_transient=is_transient_docker_error)
+    return policy.call(function, args, kwargs)
 
 
 class RetryGeneratorException(Exception):
@@ -257,22 +260,125 @@ class WrappedDocker(object):
         if callable(orig_attr):
             @wraps(orig_attr)
             def hooked(*args, **kwargs):
+                atomic_reactor.util.count_call('docker_api_calls')
                 return retry(orig_attr, *args, retry=self.retry_times, **kwargs)
             return hooked
         else:
             return orig_attr
 
 
+class ImageInspectCache(object):
+    """
+    Image inspections and `docker images` listings done by a DockerTasker
+
+    Inspections are keyed by image ID, names and IDs they were asked for
+    resolve to the ID. Anything changing images has to forget() the
+    names and IDs involved; removing images may remove their parents too,
+    so it clears the whole cache.
+
+    Other builds using the same docker daemon may remove images at any
+    time, so the cache must not be used to find out whether an image exists.
+    """
+
+    ID_RE = re.compile(r'^(sha256:[0-9a-f]+|[0-9a-f]{12,64})$')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._inspections = {}
+        self._references = {}
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _reference(cls, image):
+        """
+        normalize name of image, so e.g. 'fedora' and 'fedora:latest' are the same
+        """
+        if not isinstance(image, ImageName):
+            if cls.ID_RE.match(image):
+                return image
+            image = ImageName.parse(image)
+        return image.to_str(explicit_tag=True)
+
+    def _count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def get(self, image):
+        """
+        :param image: str or ImageName, id or name of the image
+        :return: dict, inspection of the image, or None when not cached
+        """
+        with self._lock:
+            image_id = self._references.get(self._reference(image))
+            return self._count(self._inspections.get(image_id))
+
+    def set(self, image, inspection):
+        if not isinstance(inspection, dict) or 'Id' not in inspection:
+            return
+        with self._lock:
+            image_id = inspection['Id']
+            self._inspections[image_id] = copy.deepcopy(inspection)
+            self._references[image_id] = image_id
+            self._references[self._reference(image)] = image_id
+
+    def get_listing(self, name):
+        """
+        :param name: str, repository name
+        :return: list, `docker images` output for name, or None when not cached
+        """
+        with self._lock:
+            return self._count(self._listings.get(name))
+
+    def set_listing(self, name, images):
+        with self._lock:
+            self._listings[name] = copy.deepcopy(images)
+
+    def forget(self, *images):
+        """
+        forget images which changed; for names, also forget the image they
+        pointed to, which lost the name
+
+        :param images: str or ImageName, ids or names of the images
+        """
+        with self._lock:
+            self._listings.clear()
+            for image in images:
+                image_id = self._references.get(self._reference(image))
+                if image_id is None:
+                    continue
+                self._inspections.pop(image_id, None)
+                for reference, referenced_id in list(self._references.items()):
+                    if referenced_id == image_id:
+                        del self._references[reference]
+
+    def clear(self):
+        with self._lock:
+            self._inspections.clear()
+            self._references.clear()
+            self._listings.clear()
+
+
 class DockerTasker(LastLogger):
     def __init__(self, base_url=None, retry_times=DOCKER_MAX_RETRIES,
-                 timeout=120, **kwargs):
+                 timeout=120, workers=DOCKER_WORKERS, **kwargs):
         """
         Constructor
 
         :param base_url: str, docker connection URL
         :param timeout: int, timeout for docker client
+        :param workers: int, number of threads running calls passed to submit()
         """
         super(DockerTasker, self).__init__(**kwargs)
+        self.workers = workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # inspections of images, forgotten by methods changing images
+        self.image_cache = ImageInspectCache()
 
         client_kwargs = {'timeout': timeout}
         if base_url:
@@ -287,41 +393,97 @@ class DockerTasker(LastLogger):
 
         self.d = WrappedDocker(**client_kwargs)
 
-    def retry_generator(self, function, *args, **kwargs):
-        retry_times = int(kwargs.pop('retry_times', self.retry_times))
-        retry_delay = DOCKER_BACKOFF_FACTOR
-        retry_client_statuses = DOCKER_CLIENT_STATUS_RETRY
+    def submit(self, function, *args, **kwargs):
+        """
+        call function (usually a method of this tasker) on a shared pool of
+        worker threads, so calls to the docker daemon can overlap; methods of
+        the tasker itself stay synchronous
 
-        for counter in range(retry_times + 1):
-            exc = None
-            context = None
-            try:
-                logs_gen = function(*args, **kwargs)
-                cmd_result = atomic_reactor.util.wait_for_command(logs_gen)
-            except ProtocolError as e:
-                exc = e
-                context = e.args
-            except APIError as e:
-                exc = e
-                context = e.response.content
-            else:
-                if cmd_result.is_failed():
-                    exc = cmd_result.error_detail
-                    context = cmd_result.error
+        Functions submitted this way must not wait for other submitted calls,
+        the pool is bounded.
 
-            if exc:
-                if counter == retry_times or \
-                    (isinstance(exc, APIError) and
-                     exc.response.status_code not in retry_client_statuses):
-                    raise RetryGeneratorException("Failed to %s image %s: %r" %
-                                                  (function.__name__, args, context),
-                                                  exc)
+        :param function: callable
+        :return: multiprocessing.pool.AsyncResult, get() returns the result of the call
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            pool = self._pool
+        return pool.apply_async(function, args, kwargs)
 
-                logger.info("retrying %s - %s on %r", function.__name__, args, context)
-                time.sleep(retry_delay * (2 ** counter))
-                continue
+    def map_concurrently(self, function, items):
+        """
+        call function for each of items on the pool of worker threads
 
-            return cmd_result
+        :param function: callable, taking one item
+        :param items: iterable
+        :return: list, results in order of items; the first exception raised
+                 by any of the calls is re-raised
+        """
+        results = [self.submit(function, item) for item in items]
+        return [result.get() for result in results]
+
+    def close(self):
+        """
+        wait for submitted calls and stop the worker threads
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def retry_generator(self, function, *args, **kwargs):
+        """
+        call function returning a generator of logs and wait for the command,
+        retrying failures
+
+        :param retry_times: int, number of retries, by default the one of the tasker
+        :param retry_deadline: float, seconds after which no more attempts start
+        :param remote: str, registry the function talks to, for circuit breaking
+        :return: CommandResult
+        """
+        retry_times = int(kwargs.pop('retry_times', self.retry_times))
+        retry_deadline = kwargs.pop('retry_deadline', DOCKER_RETRY_DEADLINE)
+        remote = kwargs.pop('remote', None)
+
+        def is_transient(exc):
+            # failed commands and broken connections are worth another try
+            return not isinstance(exc, APIError) or is_transient_docker_error(exc)
+
+        policy = RetryPolicy('docker', retry_times, DOCKER_BACKOFF_FACTOR,
+                             deadline=retry_deadline, is_transient=is_transient)
+        attempts = policy.attempts(remote)
+        try:
+            for _ in attempts:
+                exc = None
+                context = None
+                try:
+                    logs_gen = function(*args, **kwargs)
+                    cmd_result = atomic_reactor.util.wait_for_command(logs_gen)
+                except ProtocolError as e:
+                    exc = e
+                    context = e.args
+                except APIError as e:
+                    exc = e
+                    context = e.response.content
+                else:
+                    if cmd_result.is_failed():
+                        exc = cmd_result.error_detail
+                        context = cmd_result.error
+
+                if exc:
+                    if not attempts.retry(exc):
+                        raise RetryGeneratorException("Failed to %s image %s: %r" %
+                                                      (function.__name__, args, context),
+                                                      exc)
+                    continue
+
+                attempts.succeeded()
+                return cmd_result
+        except CircuitOpenError as ex:
+            raise RetryGeneratorException("Failed to %s image %s: %s" %
+                                          (function.__name__, args, ex), ex)
 
     def build_image_from_path(self, path, image, stream=False, use_cache=False, remove_im=True):
         """
@@ -338,6 +500,7 @@ class DockerTasker(LastLogger):
         :return: generator
         """
         logger.info("building image '%s' from path '%s'", image, path)
+        self.image_cache.forget(image)
         try:
             response = self.d.build(path=path, tag=image.to_str(), stream=stream,
                                     nocache=not use_cache, decode=True,
@@ -442,6 +605,8 @@ class DockerTasker(LastLogger):
         if image:
             tag = image.tag
             image = image.to_str(tag=False)
+        if image:
+            self.image_cache.forget('{0}:{1}'.format(image, tag or 'latest'))
         response = self.d.commit(container_id, repository=image, tag=tag, message=message)
         logger.debug("response = '%s'", response)
         try:
@@ -494,7 +659,11 @@ class DockerTasker(LastLogger):
         #  u'RepoTags': [u'buildroot-fedora:latest'],
         #  u'Size': 0,
         #  u'VirtualSize': 856564160}
-        images = self.d.images(name=image.to_str(tag=False))
+        name = image.to_str(tag=False)
+        images = self.image_cache.get_listing(name)
+        if images is None:
+            images = self.d.images(name=name)
+            self.image_cache.set_listing(name, images)
         if exact_tag:
             # tag is specified, we are looking for the exact image
             for found_image in images:
@@ -516,16 +685,19 @@ class DockerTasker(LastLogger):
         """
         logger.info("pulling image '%s' from registry", image)
         logger.debug("image = '%s', insecure = '%s'", image, insecure)
+        self.image_cache.forget(image)
         try:
             command_result = self.retry_generator(self.d.pull,
                                                   image.to_str(tag=False),
                                                   tag=image.tag, insecure_registry=insecure,
-                                                  decode=True, stream=True)
+                                                  decode=True, stream=True,
+                                                  remote=image.registry)
         except TypeError:
             # because changing api is fun
             command_result = self.retry_generator(self.d.pull,
                                                   image.to_str(tag=False),
-                                                  tag=image.tag, decode=True, stream=True)
+                                                  tag=image.tag, decode=True, stream=True,
+                                                  remote=image.registry)
 
         self.last_logs = command_result.logs
         return image.to_str()
@@ -545,6 +717,7 @@ class DockerTasker(LastLogger):
             image = ImageName.parse(image)
 
         if image != target_image:
+            self.image_cache.forget(image, target_image)
             response = self.d.tag(
                 image.to_str(),
                 target_image.to_str(tag=False),
@@ -599,12 +772,14 @@ class DockerTasker(LastLogger):
             command_result = self.retry_generator(self.d.push,
                                                   image.to_str(tag=False),
                                                   tag=image.tag, insecure_registry=insecure,
-                                                  decode=True, stream=True)
+                                                  decode=True, stream=True,
+                                                  remote=image.registry)
         except TypeError:
             # because changing api is fun
             command_result = self.retry_generator(self.d.push,
                                                   image.to_str(tag=False),
-                                                  tag=image.tag, decode=True, stream=True)
+                                                  tag=image.tag, decode=True, stream=True,
+                                                  remote=image.registry)
 
         self.last_logs = command_result.logs
         return command_result.parsed_logs
@@ -639,7 +814,26 @@ class DockerTasker(LastLogger):
         logger.debug("image_id = '%s'", image_id)
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
-        image_metadata = self.d.inspect_image(image_id)
+        image_metadata = self.image_cache.get(image_id)
+        if image_metadata is None:
+            image_metadata = self._inspect_image(image_id)
+        else:
+            logger.debug("using cached inspection of '%s'", image_id)
+        return image_metadata
+
+    def _inspect_image(self, image_id):
+        """
+        inspect image without looking into the cache, but cache the result
+
+        :param image_id: str, id or name of the image
+        :return: dict
+        """
+        try:
+            image_metadata = self.d.inspect_image(image_id)
+        except Exception:
+            self.image_cache.forget(image_id)
+            raise
+        self.image_cache.set(image_id, image_metadata)
         return image_metadata
 
     def remove_image(self, image_id, force=False, noprune=False):
@@ -655,6 +849,8 @@ class DockerTasker(LastLogger):
         logger.debug("image_id = '%s'", image_id)
         if isinstance(image_id, ImageName):
             image_id = image_id.to_str()
+        # parents may be removed too
+        self.image_cache.clear()
         self.d.remove_image(image_id, force=force, noprune=noprune)  # returns None
 
     def remove_container(self, container_id, force=False):
@@ -710,8 +906,11 @@ class DockerTasker(LastLogger):
         """
         logger.info("checking whether image '%s' exists", image_id)
         logger.debug("image_id = '%s'", image_id)
+        if isinstance(image_id, ImageName):
+            image_id = image_id.to_str()
         try:
-            response = self.d.inspect_image(image_id)
+            # other builds may have removed the image, don't trust the cache
+            response = self._inspect_image(image_id)
         except APIError as ex:
             logger.warning(repr(ex))
             response = False
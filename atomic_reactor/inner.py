@@ -11,6 +11,8 @@ Script for building docker image. This is expected to run inside container.
 
 import json
 import logging
+import os
+import pickle
 import tempfile
 import signal
 import docker
@@ -23,19 +25,74 @@ from atomic_reactor.plugin import (
     ExitPluginsRunner,
     InputPluginsRunner,
     PluginFailedException,
+    PluginsRunner,
+    PrefetchPluginsRunner,
     PostBuildPluginsRunner,
     PreBuildPluginsRunner,
     PrePublishPluginsRunner,
+    plugin_registry,
 )
 from atomic_reactor.source import get_source_instance_for
-from atomic_reactor.constants import INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS
-from atomic_reactor.util import ImageName
+from atomic_reactor.constants import (INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS,
+                                      REGISTRY_CACHE_DIRNAME)
+from atomic_reactor.util import ImageName, RegistryContentCache
 from atomic_reactor.build import BuildResult
 from atomic_reactor import get_logging_encoding
 
 
 logger = logging.getLogger(__name__)
 
+# phases of DockerBuildWorkflow.build_docker_image, in order
+BUILD_PHASES = ('prebuild', 'buildstep', 'prepublish', 'postbuild')
+CHECKPOINT_VERSION = 2
+# workflow attributes stored in a checkpoint; everything pre-build plugins
+# leave for later phases must be here, they don't run again on resume
+CHECKPOINT_ATTRS = (
+    'prebuild_results',
+    'buildstep_result',
+    'build_result',
+    'prepub_results',
+    'postbuild_results',
+    'exported_image_sequence',
+    'tag_conf',
+    'push_conf',
+    'files',
+    'pulled_base_images',
+    'built_image_inspect',
+    'layer_sizes',
+    'image_components',
+    '_base_image_inspect',
+    'plugins_timestamps',
+    'plugins_durations',
+    'plugins_resource_usage',
+)
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+    """
+    Unpickler which finds classes from plugin modules
+
+    Plugin modules are loaded from files and named after them, so they can't
+    be imported by name in a new process.
+    """
+
+    def __init__(self, f, plugin_files=None):
+        pickle.Unpickler.__init__(self, f)
+        self.plugin_files = plugin_files or []
+        # path -> module, so objects of the same plugin class share it
+        self.modules = {}
+
+    def find_class(self, module, name):
+        try:
+            return pickle.Unpickler.find_class(self, module, name)
+        except ImportError:
+            plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
+            for path in [os.path.join(plugins_dir, module + '.py')] + self.plugin_files:
+                if (os.path.basename(path).rsplit('.', 1)[0] == module and
+                        os.path.exists(path)):
+                    return getattr(plugin_registry.load_module(path, self.modules), name)
+            raise
+
 
 class BuildResults(object):
     build_logs = None
@@ -271,7 +328,9 @@ class DockerBuildWorkflow(object):
     def __init__(self, source, image, prebuild_plugins=None, prepublish_plugins=None,
                  postbuild_plugins=None, exit_plugins=None, plugin_files=None,
                  openshift_build_selflink=None, client_version=None,
-                 buildstep_plugins=None, **kwargs):
+                 buildstep_plugins=None, plugin_workers=None, checkpoint_path=None,
+                 prefetch=False, exit_plugin_workers=None, registry_disk_cache=False,
+                 **kwargs):
         """
         :param source: dict, where/how to get source code to put in image
         :param image: str, tag for built image ([registry/]image_name[:tag])
@@ -283,6 +342,17 @@ class DockerBuildWorkflow(object):
             on openshift) without the actual hostname/IP address
         :param client_version: str, osbs-client version used to render build json
         :param buildstep_plugins: dict, arguments for build-step plugins
+        :param plugin_workers: int, run independent pre-build, pre-publish and
+            post-build plugins concurrently on up to this many threads
+        :param checkpoint_path: str, file where the state of the build is saved after
+            each phase once the image is built; when it exists, the build resumes
+            from the last saved phase
+        :param prefetch: bool, start I/O-bound work of pre-build plugins which
+            support it in the background when the build starts
+        :param exit_plugin_workers: int, run independent exit plugins concurrently
+            on up to this many threads
+        :param registry_disk_cache: bool, store manifests and config blobs fetched
+            from registries by digest in the workdir, not only in memory
         """
         self.source = get_source_instance_for(source, tmpdir=tempfile.mkdtemp())
         self.image = image
@@ -301,11 +371,21 @@ class DockerBuildWorkflow(object):
         self.plugin_workspace = {}
         self.plugins_timestamps = {}
         self.plugins_durations = {}
+        # plugin key -> resources used while running the plugin,
+        # see util.get_resource_usage_delta
+        self.plugins_resource_usage = {}
         self.plugins_errors = {}
         self.autorebuild_canceled = False
         self.build_canceled = False
         self.plugin_failed = False
         self.plugin_files = plugin_files
+        self.plugin_workers = plugin_workers
+        self.exit_plugin_workers = exit_plugin_workers
+        self.checkpoint_path = checkpoint_path
+        self.resumed_phase = None
+        self.prefetch = prefetch
+        # pre-build plugin key -> AsyncResult of its prefetch()
+        self.prefetch_results = {}
 
         self.kwargs = kwargs
 
@@ -326,6 +406,13 @@ class DockerBuildWorkflow(object):
 
         self.tag_conf = TagConf()
         self.push_conf = PushConf()
+        # registry content fetched by digest during this build
+        cache_path = None
+        if registry_disk_cache:
+            cache_path = os.path.join(self.source.workdir, REGISTRY_CACHE_DIRNAME)
+        self.registry_content_cache = RegistryContentCache(path=cache_path)
+        # Dockerfile parsers shared by plugins, see util.df_parser
+        self.dockerfile_parsers = {}
 
         # mapping of downloaded files; DON'T PUT ANYTHING BIG HERE!
         # "path/to/file" -> "content"
@@ -362,10 +449,214 @@ class DockerBuildWorkflow(object):
                 raise KeyError("Unprocessed base image Dockerfile cannot be inspected")
         return self._base_image_inspect
 
+    def _get_checkpointed_workspace(self):
+        plugin_classes = PluginsRunner('BuildPlugin', None,
+                                       plugin_files=self.plugin_files).plugin_classes
+        workspace = {}
+        for key, value in self.plugin_workspace.items():
+            try:
+                plugin_class = plugin_classes[key]
+            except KeyError:
+                continue
+            if getattr(plugin_class, 'checkpoint_workspace', False):
+                workspace[key] = value
+        return workspace
+
+    def save_checkpoint(self, phase):
+        """
+        save state of the workflow after phase, so the build can be resumed
+
+        Only builds with the built image available locally are checkpointed.
+        Failure to save the checkpoint doesn't fail the build.
+
+        :param phase: str, name of the finished phase, see BUILD_PHASES
+        """
+        if not self.checkpoint_path or not self.build_result.is_image_available():
+            return
+
+        checkpoint = dict((attr, getattr(self, attr)) for attr in CHECKPOINT_ATTRS)
+        checkpoint.update({
+            'version': CHECKPOINT_VERSION,
+            'image': self.image,
+            'phase': phase,
+            'image_id': self.builder.image_id,
+            'base_image': self.builder.base_image,
+            'plugin_workspace': self._get_checkpointed_workspace(),
+            'dockerfile': None,
+        })
+
+        tmp_path = None
+        try:
+            try:
+                df_path = self.builder.df_path
+            except AttributeError:
+                pass
+            else:
+                with open(df_path, 'rb') as f:
+                    checkpoint['dockerfile'] = (os.path.relpath(df_path, self.source.path),
+                                                f.read())
+
+            checkpoint_dir = os.path.dirname(self.checkpoint_path) or '.'
+            fd, tmp_path = tempfile.mkstemp(dir=checkpoint_dir)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(checkpoint, f, protocol=2)
+            os.rename(tmp_path, self.checkpoint_path)
+            logger.info("saved checkpoint after %s phase to %s", phase, self.checkpoint_path)
+        except Exception as ex:
+            logger.warning("failed to save checkpoint after %s phase: %r", phase, ex)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load_checkpoint(self):
+        """
+        load checkpoint saved by a previous run of this build
+
+        :return: dict, or None when there is no usable checkpoint
+        """
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+
+        try:
+            with open(self.checkpoint_path, 'rb') as f:
+                checkpoint = CheckpointUnpickler(f, self.plugin_files).load()
+        except Exception as ex:
+            logger.warning("failed to load checkpoint %s: %r", self.checkpoint_path, ex)
+            return None
+
+        if (not isinstance(checkpoint, dict) or
+                checkpoint.get('version') != CHECKPOINT_VERSION or
+                checkpoint.get('image') != self.image):
+            logger.warning("checkpoint %s doesn't belong to this build, ignoring it",
+                           self.checkpoint_path)
+            return None
+
+        if not self.builder.tasker.image_exists(checkpoint['image_id']):
+            logger.warning("image %s from checkpoint no longer exists, ignoring checkpoint",
+                           checkpoint['image_id'])
+            return None
+
+        missing = [exported_image['path']
+                   for exported_image in checkpoint['exported_image_sequence']
+                   if not os.path.exists(exported_image['path'])]
+        if missing:
+            logger.warning("exported images %s from checkpoint no longer exist, "
+                           "ignoring checkpoint", missing)
+            return None
+
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        restore state of the workflow from checkpoint
+
+        :param checkpoint: dict, as returned by load_checkpoint()
+        """
+        for attr in CHECKPOINT_ATTRS:
+            setattr(self, attr, checkpoint[attr])
+        self.plugin_workspace.update(checkpoint['plugin_workspace'])
+
+        if checkpoint['dockerfile']:
+            relative_path, content = checkpoint['dockerfile']
+            df_path = os.path.join(self.source.path, relative_path)
+            with open(df_path, 'wb') as f:
+                f.write(content)
+            self.builder.set_df_path(df_path)
+
+        self.builder.base_image = checkpoint['base_image']
+        self.builder.image_id = checkpoint['image_id']
+        self.builder.is_built = True
+        self.resumed_phase = checkpoint['phase']
+        logger.info("resuming build after %s phase", self.resumed_phase)
+
+    def remove_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            logger.debug("removing checkpoint %s", self.checkpoint_path)
+            os.remove(self.checkpoint_path)
+
+    def phase_completed(self, phase):
+        """
+        was phase completed by a previous run of this build?
+
+        :param phase: str, see BUILD_PHASES
+        :return: bool
+        """
+        if self.resumed_phase is None:
+            return False
+        return BUILD_PHASES.index(phase) <= BUILD_PHASES.index(self.resumed_phase)
+
     def throw_canceled_build_exception(self, *args, **kwargs):
         self.build_canceled = True
         raise BuildCanceledException("Build was canceled")
 
+    def _run_prebuild_plugins(self):
+        # time to run pre-build plugins, so they can access cloned repo
+        logger.info("running pre-build plugins")
+        prebuild_runner = PreBuildPluginsRunner(self.builder.tasker, self,
+                                                self.prebuild_plugins_conf,
+                                                plugin_files=self.plugin_files,
+                                                max_workers=self.plugin_workers)
+        try:
+            prebuild_runner.run()
+        except PluginFailedException as ex:
+            logger.error("one or more prebuild plugins failed: %s", ex)
+            raise
+        except AutoRebuildCanceledException as ex:
+            logger.info(str(ex))
+            self.autorebuild_canceled = True
+            raise
+
+    def _run_buildstep_plugins(self):
+        logger.info("running buildstep plugins")
+        buildstep_runner = BuildStepPluginsRunner(self.builder.tasker, self,
+                                                  self.buildstep_plugins_conf,
+                                                  plugin_files=self.plugin_files)
+        try:
+            self.build_result = buildstep_runner.run()
+
+            if self.build_result.is_failed():
+                raise PluginFailedException(self.build_result.fail_reason)
+        except PluginFailedException as ex:
+            self.builder.is_built = False
+            logger.error('buildstep plugin failed: %s', ex)
+            raise
+
+        self.builder.is_built = True
+        if self.build_result.is_image_available():
+            self.builder.image_id = self.build_result.image_id
+
+    def _run_prepublish_plugins(self):
+        prepublish_runner = PrePublishPluginsRunner(self.builder.tasker, self,
+                                                    self.prepublish_plugins_conf,
+                                                    plugin_files=self.plugin_files,
+                                                    max_workers=self.plugin_workers)
+        try:
+            prepublish_runner.run()
+        except PluginFailedException as ex:
+            logger.error("one or more prepublish plugins failed: %s", ex)
+            raise
+
+        if self.build_result.is_image_available():
+            self.built_image_inspect = self.builder.inspect_built_image()
+            history = self.builder.tasker.d.history(self.builder.image_id)
+            diff_ids = self.built_image_inspect[INSPECT_ROOTFS][INSPECT_ROOTFS_LAYERS]
+
+            # diff_ids is ordered oldest first
+            # history is ordered newest first
+            # We want layer_sizes to be ordered oldest first
+            self.layer_sizes = [{"diff_id": diff_id, "size": layer['Size']}
+                                for (diff_id, layer) in zip(diff_ids, reversed(history))]
+
+    def _run_postbuild_plugins(self):
+        postbuild_runner = PostBuildPluginsRunner(self.builder.tasker, self,
+                                                  self.postbuild_plugins_conf,
+                                                  plugin_files=self.plugin_files,
+                                                  max_workers=self.plugin_workers)
+        try:
+            postbuild_runner.run()
+        except PluginFailedException as ex:
+            logger.error("one or more postbuild plugins failed: %s", ex)
+            raise
+
     def build_docker_image(self):
         """
         build docker image
@@ -373,71 +664,31 @@ class DockerBuildWorkflow(object):
         :return: BuildResult
         """
         self.builder = InsideBuilder(self.source, self.image)
+        checkpoint = self.load_checkpoint()
+        if checkpoint:
+            self.restore_checkpoint(checkpoint)
+        build_succeeded = False
+        prefetch_runner = None
         try:
             signal.signal(signal.SIGTERM, self.throw_canceled_build_exception)
-            # time to run pre-build plugins, so they can access cloned repo
-            logger.info("running pre-build plugins")
-            prebuild_runner = PreBuildPluginsRunner(self.builder.tasker, self,
-                                                    self.prebuild_plugins_conf,
-                                                    plugin_files=self.plugin_files)
-            try:
-                prebuild_runner.run()
-            except PluginFailedException as ex:
-                logger.error("one or more prebuild plugins failed: %s", ex)
-                raise
-            except AutoRebuildCanceledException as ex:
-                logger.info(str(ex))
-                self.autorebuild_canceled = True
-                raise
-
-            logger.info("running buildstep plugins")
-            buildstep_runner = BuildStepPluginsRunner(self.builder.tasker, self,
-                                                      self.buildstep_plugins_conf,
-                                                      plugin_files=self.plugin_files)
-            try:
-                self.build_result = buildstep_runner.run()
-
-                if self.build_result.is_failed():
-                    raise PluginFailedException(self.build_result.fail_reason)
-            except PluginFailedException as ex:
-                self.builder.is_built = False
-                logger.error('buildstep plugin failed: %s', ex)
-                raise
-
-            self.builder.is_built = True
-            if self.build_result.is_image_available():
-                self.builder.image_id = self.build_result.image_id
-
-            # run prepublish plugins
-            prepublish_runner = PrePublishPluginsRunner(self.builder.tasker, self,
-                                                        self.prepublish_plugins_conf,
+            if self.prefetch and not self.phase_completed('prebuild'):
+                prefetch_runner = PrefetchPluginsRunner(self.builder.tasker, self,
+                                                        self.prebuild_plugins_conf,
                                                         plugin_files=self.plugin_files)
-            try:
-                prepublish_runner.run()
-            except PluginFailedException as ex:
-                logger.error("one or more prepublish plugins failed: %s", ex)
-                raise
-
-            if self.build_result.is_image_available():
-                self.built_image_inspect = self.builder.inspect_built_image()
-                history = self.builder.tasker.d.history(self.builder.image_id)
-                diff_ids = self.built_image_inspect[INSPECT_ROOTFS][INSPECT_ROOTFS_LAYERS]
-
-                # diff_ids is ordered oldest first
-                # history is ordered newest first
-                # We want layer_sizes to be ordered oldest first
-                self.layer_sizes = [{"diff_id": diff_id, "size": layer['Size']}
-                                    for (diff_id, layer) in zip(diff_ids, reversed(history))]
-
-            postbuild_runner = PostBuildPluginsRunner(self.builder.tasker, self,
-                                                      self.postbuild_plugins_conf,
-                                                      plugin_files=self.plugin_files)
-            try:
-                postbuild_runner.run()
-            except PluginFailedException as ex:
-                logger.error("one or more postbuild plugins failed: %s", ex)
-                raise
-
+                prefetch_runner.run()
+            if not self.phase_completed('prebuild'):
+                self._run_prebuild_plugins()
+            if not self.phase_completed('buildstep'):
+                self._run_buildstep_plugins()
+                self.save_checkpoint('buildstep')
+            if not self.phase_completed('prepublish'):
+                self._run_prepublish_plugins()
+                self.save_checkpoint('prepublish')
+            if not self.phase_completed('postbuild'):
+                self._run_postbuild_plugins()
+                self.save_checkpoint('postbuild')
+
+            build_succeeded = True
             return self.build_result
         except Exception as ex:
             logger.debug("caught exception (%r) so running exit plugins", ex)
@@ -445,11 +696,17 @@ class DockerBuildWorkflow(object):
         finally:
             # We need to make sure all exit plugins are executed
             signal.signal(signal.SIGTERM, lambda *args: None)
+            if prefetch_runner:
+                # exit plugins clean up after prefetching too
+                prefetch_runner.wait()
             exit_runner = ExitPluginsRunner(self.builder.tasker, self,
                                             self.exit_plugins_conf,
-                                            plugin_files=self.plugin_files)
+                                            plugin_files=self.plugin_files,
+                                            max_workers=self.exit_plugin_workers)
             try:
                 exit_runner.run(keep_going=True)
+                if build_succeeded:
+                    self.remove_checkpoint()
             except PluginFailedException as ex:
                 logger.error("one or more exit plugins failed: %s", ex)
                 raise
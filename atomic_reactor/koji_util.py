@@ -16,6 +16,7 @@ import os
 import time
 
 from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE
+from atomic_reactor.retries import jitter
 
 
 logger = logging.getLogger(__name__)
@@ -124,7 +125,7 @@ class TaskWatcher(object):
     def wait(self):
         logger.debug("waiting for koji task %r to finish", self.task_id)
         while not self.session.taskFinished(self.task_id):
-            time.sleep(self.poll_interval)
+            time.sleep(jitter(self.poll_interval))
 
         logger.debug("koji task is finished, getting info")
         task_info = self.session.getTaskInfo(self.task_id, request=True)
@@ -0,0 +1,150 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Leases on base images shared by builds running on the same docker host.
+
+Builds take a lease before using a base image and release it when they
+finish. The first build pulls the image, later ones share it while any
+lease is held, and the build releasing the last lease removes it. Leases
+are kept in a directory shared by all the builds, each image guarded by
+its own file lock.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+from atomic_reactor.constants import IMAGE_LEASE_EXPIRY
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageLeases(object):
+    """
+    Reference counted leases on images, held by builds
+    """
+
+    def __init__(self, directory, holder, expiry=IMAGE_LEASE_EXPIRY):
+        """
+        :param directory: str, directory shared by builds on the docker host
+        :param holder: str, unique name of the build taking leases
+        :param expiry: int, seconds after which leases of builds which never
+                       released them are dropped
+        """
+        self.directory = directory
+        self.holder = holder
+        self.expiry = expiry
+
+    def _path(self, image, extension):
+        name = hashlib.sha256(image.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{0}.{1}'.format(name, extension))
+
+    @contextmanager
+    def _locked(self, image):
+        try:
+            os.makedirs(self.directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+        with open(self._path(image, 'lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, image):
+        """
+        :return: dict, 'image': name of the pulled image, 'holders': holder -> time
+                 the lease was taken, 'owned': whether a lease holder pulled it
+        """
+        state = {'image': None, 'holders': {}, 'owned': False}
+        try:
+            with open(self._path(image, 'json')) as f:
+                state.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+
+        now = time.time()
+        for holder, taken in list(state['holders'].items()):
+            if now - taken > self.expiry:
+                logger.warning("dropping lease on %s abandoned by %s", image, holder)
+                del state['holders'][holder]
+        return state
+
+    def _write(self, image, state):
+        path = self._path(image, 'json')
+        if state is None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return
+
+        tmp_path = '{0}.{1}'.format(path, self.holder)
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_path, path)
+
+    def acquire(self, image, pull, exists):
+        """
+        take a lease on image, pulling it unless another build holding a
+        lease already did, or unless it is referenced by digest and present
+
+        :param image: str, name of the image as requested
+        :param pull: callable, pulls the image and returns the name it was pulled as
+        :param exists: callable taking an image name, returns whether it is present
+        :return: str, name of the image to use
+        """
+        with self._locked(image):
+            state = self._read(image)
+            others = [holder for holder in state['holders'] if holder != self.holder]
+            if others and state['image'] and exists(state['image']):
+                logger.info("sharing %s with %d other builds", state['image'], len(others))
+            elif '@' in image and exists(image):
+                logger.info("%s is already present", image)
+                state['image'] = image
+            else:
+                state['image'] = pull()
+                state['owned'] = True
+
+            state['holders'][self.holder] = time.time()
+            self._write(image, state)
+            return state['image']
+
+    def release(self, image, remove):
+        """
+        release the lease on image; when it was the last one and a lease
+        holder pulled the image, remove it
+
+        :param image: str, name of the image as passed to acquire()
+        :param remove: callable taking the name of the image to remove
+        :return: bool, whether the image was removed
+        """
+        with self._locked(image):
+            state = self._read(image)
+            state['holders'].pop(self.holder, None)
+            if state['holders']:
+                logger.info("%s is still used by %d other builds",
+                            state['image'], len(state['holders']))
+                self._write(image, state)
+                return False
+
+            self._write(image, None)
+            if not (state['owned'] and state['image']):
+                return False
+            remove(state['image'])
+            return True
@@ -6,6 +6,7 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+from atomic_reactor.retries import jitter
 from atomic_reactor.util import get_retrying_requests_session
 
 import logging
@@ -142,6 +143,6 @@ class ODCSClient(object):
                              .format(compose_id, elapsed))
 
                 if elapsed > burst_length:
-                    time.sleep(slow_retry)
+                    time.sleep(jitter(slow_retry))
                 else:
-                    time.sleep(burst_retry)
+                    time.sleep(jitter(burst_retry))
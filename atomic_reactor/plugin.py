@@ -10,17 +10,32 @@ definition of plugin system
 
 plugins are supposed to be run when image is built and we need to extract some information
 """
+import ast
 import copy
+import json
 import logging
 import os
 import traceback
 import imp
 import datetime
 import inspect
+import tempfile
 import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
+from six.moves import queue
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from atomic_reactor import constants
 from atomic_reactor.build import BuildResult
-from atomic_reactor.util import process_substitutions
+from atomic_reactor.constants import PLUGINS_INDEX_CACHE_ENV
+from atomic_reactor.util import (process_substitutions, get_resource_usage,
+                                 get_resource_usage_delta)
 from dockerfile_parse import DockerfileParser
 
 MODULE_EXTENSIONS = ('.py', '.pyc', '.pyo')
@@ -58,6 +73,19 @@ class Plugin(object):
     key = None
     # by default, if plugin fails (raises exc), execution continues
     is_allowed_to_fail = True
+    # names of workflow state (plugin results and workspaces by plugin key,
+    # workflow attributes like 'tag_conf' or 'dockerfile') this plugin reads
+    # and writes; plugins with no conflicting access may run concurrently,
+    # None means the plugin may access anything; plugins checking
+    # build_process_failed read 'plugin_failed', which every plugin writes
+    reads = None
+    writes = None
+
+    # whether the workspace of this plugin is saved in build checkpoints,
+    # it has to be picklable
+    checkpoint_workspace = False
+    # whether the build plugin implements prefetch()
+    can_prefetch = False
 
     def __init__(self, *args, **kwargs):
         """
@@ -105,41 +133,266 @@ class BuildPlugin(Plugin):
         self.workflow = workflow
         super(BuildPlugin, self).__init__(*args, **kwargs)
 
+    def prefetch(self):
+        """
+        plugins with can_prefetch set implement this method -- it is run in
+        the background when the build starts, before any pre-build plugin
 
-class PluginsRunner(object):
+        it should do I/O-bound work which doesn't depend on other plugins,
+        run() gets its return value from get_prefetched()
+        """
+        raise NotImplementedError()
 
-    def __init__(self, plugin_class_name, plugins_conf, *args, **kwargs):
+    def get_prefetched(self):
         """
-        constructor
+        wait for prefetch() started for this plugin to finish
 
-        :param plugin_class_name: str, name of plugin class to filter (e.g. 'PreBuildPlugin')
-        :param plugins_conf: dict, configuration for plugins
+        :return: return value of prefetch(), None when the plugin wasn't
+                 prefetched or prefetch() failed
         """
-        self.plugins_results = getattr(self, "plugins_results", {})
-        self.plugins_conf = plugins_conf or []
-        self.plugin_files = kwargs.get("plugin_files", [])
-        self.plugin_classes = self.load_plugins(plugin_class_name)
+        async_result = self.workflow.prefetch_results.pop(self.key, None)
+        if async_result is None:
+            return None
 
-    def load_plugins(self, plugin_class_name):
+        # wait with timeout so signals (build cancellation) are not blocked
+        while not async_result.ready():
+            async_result.wait(1)
+
+        try:
+            return async_result.get()
+        except Exception as ex:
+            self.log.warning("prefetching failed, continuing without it: %r", ex)
+            return None
+
+
+class PluginClasses(Mapping):
+    """
+    mapping of plugin keys to plugin classes
+
+    Plugin modules are imported only when a plugin class is looked up, and
+    at most once for each mapping; the next runner imports them again, so
+    it sees changes to modules they import from.
+    """
+
+    def __init__(self, registry, index, plugin_classes=None, modules=None):
         """
-        load all available plugins
+        :param registry: PluginRegistry instance
+        :param index: OrderedDict, plugin key -> (path to module, class name)
+        :param plugin_classes: dict, plugin key -> already loaded plugin class
+        :param modules: dict, path to module -> already imported module
         """
-        # imp.findmodule('atomic_reactor') doesn't work
-        plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
-        logger.debug("loading plugins from dir '%s'", plugins_dir)
-        files = [os.path.join(plugins_dir, f)
-                 for f in os.listdir(plugins_dir)
-                 if f.endswith(".py")]
-        if self.plugin_files:
-            logger.debug("loading additional plugins from files '%s'", self.plugin_files)
-            files += self.plugin_files
-        plugin_class = globals()[plugin_class_name]
+        self.registry = registry
+        self.index = index
+        self._plugin_classes = plugin_classes or {}
+        self._modules = modules if modules is not None else {}
+
+    def __getitem__(self, key):
+        if key not in self._plugin_classes:
+            path, class_name = self.index[key]
+            try:
+                module = self.registry.load_module(path, self._modules)
+            except (IOError, OSError, ImportError, SyntaxError) as ex:
+                logger.warning("can't load module '%s': %r", path, ex)
+                raise KeyError(key)
+            plugin_class = getattr(module, class_name, None)
+            if plugin_class is None:
+                raise KeyError(key)
+            self._plugin_classes[key] = plugin_class
+        return self._plugin_classes[key]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class PluginRegistry(object):
+    """
+    process-wide index of available plugins
+
+    Plugin files are parsed, not imported, to find the plugin classes they
+    define, their keys and phases. Files which can't be indexed this way
+    (e.g. their plugin key is computed or inherited from another module)
+    are imported. The index can be
+    persisted to a cache file; entries are reused as long as modification
+    time and size of the plugin file don't change.
+    """
+
+    PHASE_CLASS_NAMES = ('Plugin', 'BuildPlugin', 'PreBuildPlugin', 'BuildStepPlugin',
+                         'PrePublishPlugin', 'PostBuildPlugin', 'ExitPlugin', 'InputPlugin')
+
+    def __init__(self, cache_path=None):
+        """
+        :param cache_path: str, path to file where the index is persisted
+        """
+        self.cache_path = cache_path
+        # path -> {'mtime': float, 'size': int, 'plugins': list of dicts or None}
+        self._index = {}
+        if cache_path:
+            self._read_cache()
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                self._index = json.load(f)
+        except (IOError, OSError, ValueError) as ex:
+            logger.debug("can't read plugins index cache '%s': %r", self.cache_path, ex)
+            self._index = {}
+
+    def _write_cache(self):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path) or '.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._index, f)
+            os.rename(tmp_path, self.cache_path)
+        except (IOError, OSError) as ex:
+            logger.warning("can't write plugins index cache '%s': %r", self.cache_path, ex)
+
+    def load_module(self, path, modules):
+        """
+        import plugin module unless it's already in modules
+
+        :param path: str, path to plugin file
+        :param modules: dict, path to module -> imported module, updated
+        :return: module object
+        """
+        if path not in modules:
+            logger.debug("load file '%s'", path)
+            module_name = os.path.basename(path).rsplit('.', 1)[0]
+            modules[path] = imp.load_source(module_name, path)
+        return modules[path]
+
+    @staticmethod
+    def _literal(node):
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            return None
+
+    def scan_file(self, path):
+        """
+        find plugin classes defined in plugin file without importing it
+
+        :param path: str, path to plugin file
+        :return: list of dicts with 'key', 'class' and 'phases' of each plugin
+                 class, or None when the file has to be imported
+        """
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+
+        names = {}
+        classes = OrderedDict()
+        for node in tree.body:
+            if isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        names[target.id] = self._literal(node.value)
+            elif isinstance(node, ast.ImportFrom) and node.module == constants.__name__:
+                for alias in node.names:
+                    names[alias.asname or alias.name] = getattr(constants, alias.name, None)
+            elif isinstance(node, ast.ClassDef):
+                bases = []
+                for base in node.bases:
+                    if isinstance(base, ast.Name):
+                        bases.append(base.id)
+                    elif isinstance(base, ast.Attribute):
+                        bases.append(base.attr)
+                    else:
+                        bases.append(None)
+                key_node = None
+                for item in node.body:
+                    if (isinstance(item, ast.Assign) and
+                            any(isinstance(t, ast.Name) and t.id == 'key'
+                                for t in item.targets)):
+                        key_node = item.value
+                classes[node.name] = (bases, key_node)
+
+        def get_phases(class_name, seen=()):
+            phases = set()
+            for base in classes[class_name][0]:
+                if base in self.PHASE_CLASS_NAMES:
+                    phases.add(base)
+                elif base in classes and base not in seen:
+                    phases |= get_phases(base, seen + (class_name,))
+                elif base not in ('object', 'Exception'):
+                    raise LookupError(base)
+            return phases
+
+        def get_key(class_name, seen=()):
+            bases, key_node = classes[class_name]
+            if key_node is None:
+                # inherited from a class in this file, if at all
+                for base in bases:
+                    if base in classes and base not in seen:
+                        key = get_key(base, seen + (class_name,))
+                        if key is not None:
+                            return key
+                return None
+            if isinstance(key_node, ast.Name):
+                return names.get(key_node.id)
+            if (isinstance(key_node, ast.Attribute) and key_node.attr == 'key' and
+                    isinstance(key_node.value, ast.Name) and key_node.value.id in classes):
+                return get_key(key_node.value.id)
+            return self._literal(key_node)
+
+        plugins = []
+        for class_name in classes:
+            try:
+                phases = get_phases(class_name)
+            except LookupError:
+                logger.debug("can't index '%s': unknown base class of %s", path, class_name)
+                return None
+            if not phases:
+                continue
+            key = get_key(class_name)
+            if key is None:
+                # e.g. inherited from a class in another module
+                logger.debug("can't index '%s': unknown key of %s", path, class_name)
+                return None
+            plugins.append({'key': key, 'class': class_name, 'phases': sorted(phases)})
+        return plugins
+
+    def get_plugin_classes(self, files, plugin_class):
+        """
+        get plugins of given type available in files
+
+        :param files: list of str, paths to plugin files
+        :param plugin_class: class, plugin type to filter (e.g. PreBuildPlugin)
+        :return: PluginClasses instance
+        """
+        index = OrderedDict()
         plugin_classes = {}
+        modules = {}
+        index_changed = False
         for f in files:
-            logger.debug("load file '%s'", f)
-            module_name = os.path.basename(f).rsplit('.', 1)[0]
             try:
-                f_module = imp.load_source(module_name, f)
+                stat = os.stat(f)
+                entry = self._index.get(f)
+                if (entry is None or entry['mtime'] != stat.st_mtime or
+                        entry['size'] != stat.st_size):
+                    entry = {
+                        'mtime': stat.st_mtime,
+                        'size': stat.st_size,
+                        'plugins': self.scan_file(f),
+                    }
+                    self._index[f] = entry
+                    index_changed = True
+            except (IOError, OSError, SyntaxError) as ex:
+                logger.warning("can't load module '%s': %r", f, ex)
+                continue
+
+            if entry['plugins'] is not None:
+                for plugin in entry['plugins']:
+                    if any(issubclass(globals()[phase], plugin_class)
+                           for phase in plugin['phases']):
+                        index[plugin['key']] = (f, plugin['class'])
+                        plugin_classes.pop(plugin['key'], None)
+                continue
+
+            # file couldn't be indexed statically, inspect the module itself
+            try:
+                f_module = self.load_module(f, modules)
             except (IOError, OSError, ImportError, SyntaxError) as ex:
                 logger.warning("can't load module '%s': %r", f, ex)
                 continue
@@ -157,8 +410,53 @@ class PluginsRunner(object):
                 except TypeError:
                     is_sub = False
                 if binding and is_sub and plugin_class.__name__ != binding.__name__:
+                    index[binding.key] = (f, name)
                     plugin_classes[binding.key] = binding
-        return plugin_classes
+
+        if index_changed and self.cache_path:
+            self._write_cache()
+
+        return PluginClasses(self, index, plugin_classes, modules)
+
+
+plugin_registry = PluginRegistry(cache_path=os.environ.get(PLUGINS_INDEX_CACHE_ENV))
+
+
+class PluginsRunner(object):
+
+    def __init__(self, plugin_class_name, plugins_conf, *args, **kwargs):
+        """
+        constructor
+
+        :param plugin_class_name: str, name of plugin class to filter (e.g. 'PreBuildPlugin')
+        :param plugins_conf: dict, configuration for plugins
+        :param max_workers: int, run independent plugins concurrently
+                            on up to this many threads
+        """
+        self.plugins_results = getattr(self, "plugins_results", {})
+        self.plugins_conf = plugins_conf or []
+        self.plugin_files = kwargs.get("plugin_files", [])
+        # when set, independent plugins are run on this many threads
+        self.max_workers = kwargs.get("max_workers")
+        self.plugin_classes = self.load_plugins(plugin_class_name)
+
+    def load_plugins(self, plugin_class_name):
+        """
+        load index of all available plugins
+
+        modules of plugins are only imported when the plugin is requested
+        """
+        # imp.findmodule('atomic_reactor') doesn't work
+        plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
+        logger.debug("loading plugins from dir '%s'", plugins_dir)
+        files = [os.path.join(plugins_dir, f)
+                 for f in sorted(os.listdir(plugins_dir))
+                 if f.endswith(".py")]
+        if self.plugin_files:
+            logger.debug("loading additional plugins from files '%s'", self.plugin_files)
+            files += self.plugin_files
+        plugin_class = globals()[plugin_class_name]
+        return plugin_registry.get_plugin_classes(files, plugin_class)
 
     def create_instance_from_plugin(self, plugin_class, plugin_conf):
         """
@@ -180,126 +478,308 @@ class PluginsRunner(object):
     def save_plugin_duration(self, plugin, duration):
         pass
 
-    def run(self, keep_going=False, buildstep_phase=False):
+    def save_plugin_resource_usage(self, plugin, usage):
+        pass
+
+    def _get_plugin(self, plugin_request, keep_going=False):
         """
-        run all requested plugins
+        look up plugin class and configuration for a plugin request
 
-        :param keep_going: bool, whether to keep going after unexpected
-                                 failure (only used for exit plugins)
-        :param buildstep_phase: bool, when True remaining plugins will
-                                not be executed after a plugin completes
-                                (only used for build-step plugins)
+        :param plugin_request: dict, plugin request from plugins configuration
+        :param keep_going: bool, whether to keep going after unexpected failure
+        :return: tuple (plugin class, plugin configuration, is_allowed_to_fail)
+                 or None when the plugin should be skipped
         """
-        failed_msgs = []
-        plugin_successful = False
-        plugin_response = None
-        for plugin_request in self.plugins_conf:
-            plugin_successful = False
-            try:
-                plugin_name = plugin_request['name']
-            except (TypeError, KeyError):
-                msg = "invalid plugin request, no key 'name': %s" % plugin_request
+        try:
+            plugin_name = plugin_request['name']
+        except (TypeError, KeyError):
+            msg = "invalid plugin request, no key 'name': %s" % plugin_request
+            exc = None if keep_going else PluginFailedException(msg)
+            self.on_plugin_failed('?', exc)
+            logger.error(msg)
+            if keep_going:
+                return None
+
+            raise exc
+
+        plugin_conf = plugin_request.get("args", {})
+        try:
+            plugin_class = self.plugin_classes[plugin_name]
+        except KeyError:
+            if plugin_request.get('required', True):
+                msg = ("no such plugin: '%s', did you set "
+                       "the correct plugin type?") % plugin_name
                 exc = None if keep_going else PluginFailedException(msg)
-                self.on_plugin_failed('?', exc)
+                self.on_plugin_failed(plugin_name, exc)
                 logger.error(msg)
                 if keep_going:
-                    continue
+                    return None
 
                 raise exc
+            else:
+                # This plugin is marked as not being required
+                logger.warning("plugin '%s' requested but not available",
+                               plugin_name)
+                return None
+        try:
+            plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
+        except (TypeError, KeyError):
+            plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+
+        return plugin_class, plugin_conf, plugin_is_allowed_to_fail
+
+    def _run_plugin(self, plugin_class, plugin_conf, plugin_is_allowed_to_fail,
+                    failed_msgs, keep_going=False, buildstep_phase=False):
+        """
+        run a single plugin and record its result, timestamp and duration
 
-            plugin_conf = plugin_request.get("args", {})
-            try:
-                plugin_class = self.plugin_classes[plugin_name]
-            except KeyError:
-                if plugin_request.get('required', True):
-                    msg = ("no such plugin: '%s', did you set "
-                           "the correct plugin type?") % plugin_name
-                    exc = None if keep_going else PluginFailedException(msg)
-                    self.on_plugin_failed(plugin_name, exc)
-                    logger.error(msg)
-                    if keep_going:
-                        continue
-
-                    raise exc
-                else:
-                    # This plugin is marked as not being required
-                    logger.warning("plugin '%s' requested but not available",
-                                   plugin_name)
-                    continue
+        :param plugin_class: plugin class
+        :param plugin_conf: dict, configuration for plugin
+        :param plugin_is_allowed_to_fail: bool, whether failure of the plugin is fatal
+        :param failed_msgs: list, messages of non-fatal failures are appended here
+        :param keep_going: bool, whether to keep going after unexpected failure
+        :param buildstep_phase: bool, whether this is a build-step plugin
+        :return: tuple (plugin_successful, plugin_response, stop), where stop
+                 says no more plugins should be run
+        """
+        logger.debug("running plugin '%s'", plugin_class.key)
+        start_time = datetime.datetime.now()
+        start_usage = get_resource_usage()
+
+        plugin_successful = False
+        plugin_response = None
+        skip_response = False
+        try:
+            plugin_instance = self.create_instance_from_plugin(plugin_class, plugin_conf)
+            self.save_plugin_timestamp(plugin_class.key, start_time)
+            plugin_response = plugin_instance.run()
+            plugin_successful = True
+            if buildstep_phase:
+                assert isinstance(plugin_response, BuildResult)
+                if plugin_response.is_failed():
+                    logger.error("Build step plugin %s failed: %s",
+                                 plugin_class.key,
+                                 plugin_response.fail_reason)
+                    self.on_plugin_failed(plugin_class.key,
+                                          plugin_response.fail_reason)
+                    plugin_successful = False
+                    self.plugins_results[plugin_class.key] = plugin_response
+                    return plugin_successful, plugin_response, True
+
+        except AutoRebuildCanceledException:
+            # if auto rebuild is canceled, then just reraise
+            # NOTE: We need to catch and reraise explicitly, so that the below except clause
+            #   doesn't catch this and make PluginFailedException out of it in the end
+            #   (calling methods would then need to parse exception message to see if
+            #   AutoRebuildCanceledException was raised here)
+            raise
+        except InappropriateBuildStepError:
+            logger.debug('Build step %s is not appropriate', plugin_class.key)
+            # don't put None, in results for InappropriateBuildStepError
+            skip_response = True
+            if not buildstep_phase:
+                raise
+        except Exception as ex:
+            msg = "plugin '%s' raised an exception: %r" % (plugin_class.key, ex)
+            logger.debug(traceback.format_exc())
+            if not plugin_is_allowed_to_fail:
+                self.on_plugin_failed(plugin_class.key, ex)
+
+            if plugin_is_allowed_to_fail or keep_going:
+                logger.warning(msg)
+                logger.info("error is not fatal, continuing...")
+                if not plugin_is_allowed_to_fail:
+                    failed_msgs.append(msg)
+            else:
+                logger.error(msg)
+                raise PluginFailedException(msg)
+
+            plugin_response = ex
+
+        try:
+            if start_time:
+                finish_time = datetime.datetime.now()
+                duration = finish_time - start_time
+                seconds = duration.total_seconds()
+                logger.debug("plugin '%s' finished in %ds", plugin_class.key, seconds)
+                self.save_plugin_duration(plugin_class.key, seconds)
+        except Exception:
+            logger.exception("failed to save plugin duration")
+
+        try:
+            usage = get_resource_usage_delta(start_usage, get_resource_usage())
+            logger.debug("plugin '%s' used resources: %s", plugin_class.key, usage)
+            self.save_plugin_resource_usage(plugin_class.key, usage)
+        except Exception:
+            logger.exception("failed to save plugin resource usage")
+
+        if not skip_response:
+            self.plugins_results[plugin_class.key] = plugin_response
+
+        if plugin_successful and buildstep_phase:
+            logger.debug('stopping further execution of plugins '
+                         'after first successful plugin')
+            return plugin_successful, plugin_response, True
+
+        return plugin_successful, plugin_response, False
+
+    @staticmethod
+    def _plugins_conflict(first, second):
+        """
+        can plugin classes first and second not run at the same time?
+
+        Plugins which don't declare what they read and write are assumed
+        to conflict with every other plugin. Each plugin implicitly writes
+        the key it stores its result under, and 'plugin_failed' as any
+        plugin may fail.
+        """
+        first_reads = getattr(first, 'reads', None)
+        first_writes = getattr(first, 'writes', None)
+        second_reads = getattr(second, 'reads', None)
+        second_writes = getattr(second, 'writes', None)
+        if None in (first_reads, first_writes, second_reads, second_writes):
+            return True
+        if 'plugin_failed' in set(first_reads) | set(second_reads):
+            return True
+
+        first_writes = set(first_writes) | set([first.key])
+        second_writes = set(second_writes) | set([second.key])
+        return bool(first_writes & (set(second_reads) | second_writes) or
+                    second_writes & set(first_reads))
+
+    def get_plugin_dependencies(self, plugins):
+        """
+        build the dependency graph of plugins
+
+        A plugin depends on every plugin configured before it which it
+        conflicts with, so the configured order is kept wherever it matters.
+
+        :param plugins: list of plugin classes, in configured order
+        :return: list of sets, indexes of plugins each plugin depends on
+        """
+        dependencies = []
+        for index, plugin_class in enumerate(plugins):
+            dependencies.append(set(
+                previous for previous in range(index)
+                if self._plugins_conflict(plugins[previous], plugin_class)))
+        return dependencies
+
+    def _run_concurrently(self, keep_going=False):
+        """
+        run requested plugins on a thread pool, respecting their dependencies
+
+        Each plugin is looked up when it is scheduled. Plugins which can't be
+        found conflict with every other plugin, so the lookup fails once all
+        plugins before them finished and no plugin after them started, as
+        when plugins are run one by one.
+
+        Fatal failures stop scheduling of further plugins; plugins already
+        running are allowed to finish before the exception is re-raised.
+        """
+        plugin_requests = list(self.plugins_conf)
+
+        def get_plugin_class(plugin_request):
             try:
-                plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
+                return self.plugin_classes[plugin_request['name']]
             except (TypeError, KeyError):
-                plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+                return None
 
-            logger.debug("running plugin '%s'", plugin_name)
-            start_time = datetime.datetime.now()
+        dependencies = self.get_plugin_dependencies(
+            [get_plugin_class(plugin_request) for plugin_request in plugin_requests])
+        failed_msgs = []
+        finished_queue = queue.Queue()
 
-            plugin_response = None
-            skip_response = False
+        def run_plugin(index, plugin):
+            plugin_class, plugin_conf, plugin_is_allowed_to_fail = plugin
             try:
-                plugin_instance = self.create_instance_from_plugin(plugin_class, plugin_conf)
-                self.save_plugin_timestamp(plugin_class.key, start_time)
-                plugin_response = plugin_instance.run()
-                plugin_successful = True
-                if buildstep_phase:
-                    assert isinstance(plugin_response, BuildResult)
-                    if plugin_response.is_failed():
-                        logger.error("Build step plugin %s failed: %s",
-                                     plugin_class.key,
-                                     plugin_response.fail_reason)
-                        self.on_plugin_failed(plugin_class.key,
-                                              plugin_response.fail_reason)
-                        plugin_successful = False
-                        self.plugins_results[plugin_class.key] = plugin_response
-                        break
-
-            except AutoRebuildCanceledException as ex:
-                # if auto rebuild is canceled, then just reraise
-                # NOTE: We need to catch and reraise explicitly, so that the below except clause
-                #   doesn't catch this and make PluginFailedException out of it in the end
-                #   (calling methods would then need to parse exception message to see if
-                #   AutoRebuildCanceledException was raised here)
-                raise
-            except InappropriateBuildStepError:
-                logger.debug('Build step %s is not appropriate', plugin_class.key)
-                # don't put None, in results for InappropriateBuildStepError
-                skip_response = True
-                if not buildstep_phase:
-                    raise
+                self._run_plugin(plugin_class, plugin_conf, plugin_is_allowed_to_fail,
+                                 failed_msgs, keep_going=keep_going)
             except Exception as ex:
-                msg = "plugin '%s' raised an exception: %r" % (plugin_class.key, ex)
-                logger.debug(traceback.format_exc())
-                if not plugin_is_allowed_to_fail:
-                    self.on_plugin_failed(plugin_class.key, ex)
+                finished_queue.put((index, ex))
+            else:
+                finished_queue.put((index, None))
+
+        logger.debug("running %d plugins on up to %d threads",
+                     len(plugin_requests), self.max_workers)
+        pending = list(range(len(plugin_requests)))
+        running = set()
+        finished = set()
+        fatal_exc = None
+        thread_pool = ThreadPool(self.max_workers)
+        try:
+            while pending or running:
+                # skipped plugins finish right away and may unblock others
+                skipped = True
+                while skipped and fatal_exc is None:
+                    skipped = False
+                    for index in [i for i in pending if dependencies[i] <= finished]:
+                        pending.remove(index)
+                        try:
+                            plugin = self._get_plugin(plugin_requests[index],
+                                                      keep_going=keep_going)
+                        except Exception as ex:
+                            fatal_exc = ex
+                            break
+                        if plugin is None:
+                            finished.add(index)
+                            skipped = True
+                        else:
+                            running.add(index)
+                            thread_pool.apply_async(run_plugin, (index, plugin))
+
+                if not running:
+                    break
+
+                # wait with timeout so signals (build cancellation) are not blocked
+                try:
+                    index, exc = finished_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
 
-                if plugin_is_allowed_to_fail or keep_going:
-                    logger.warning(msg)
-                    logger.info("error is not fatal, continuing...")
-                    if not plugin_is_allowed_to_fail:
-                        failed_msgs.append(msg)
-                else:
-                    logger.error(msg)
-                    raise PluginFailedException(msg)
+                running.remove(index)
+                finished.add(index)
+                if exc is not None and fatal_exc is None:
+                    fatal_exc = exc
+        except Exception:
+            thread_pool.terminate()
+            raise
+        else:
+            thread_pool.close()
+            thread_pool.join()
 
-                plugin_response = ex
+        if fatal_exc is not None:
+            raise fatal_exc
 
-            try:
-                if start_time:
-                    finish_time = datetime.datetime.now()
-                    duration = finish_time - start_time
-                    seconds = duration.total_seconds()
-                    logger.debug("plugin '%s' finished in %ds", plugin_name, seconds)
-                    self.save_plugin_duration(plugin_class.key, seconds)
-            except Exception:
-                logger.exception("failed to save plugin duration")
-
-            if not skip_response:
-                self.plugins_results[plugin_class.key] = plugin_response
-
-            if plugin_successful and buildstep_phase:
-                logger.debug('stopping further execution of plugins '
-                             'after first successful plugin')
-                break
+        return failed_msgs
+
+    def run(self, keep_going=False, buildstep_phase=False):
+        """
+        run all requested plugins
+
+        :param keep_going: bool, whether to keep going after unexpected
+                                 failure (only used for exit plugins)
+        :param buildstep_phase: bool, when True remaining plugins will
+                                not be executed after a plugin completes
+                                (only used for build-step plugins)
+        """
+        failed_msgs = []
+        plugin_successful = False
+        plugin_response = None
+        if self.max_workers and not buildstep_phase:
+            failed_msgs = self._run_concurrently(keep_going=keep_going)
+        else:
+            for plugin_request in self.plugins_conf:
+                plugin_successful = False
+                plugin = self._get_plugin(plugin_request, keep_going=keep_going)
+                if plugin is None:
+                    continue
+
+                plugin_class, plugin_conf, plugin_is_allowed_to_fail = plugin
+                plugin_successful, plugin_response, stop = self._run_plugin(
+                    plugin_class, plugin_conf, plugin_is_allowed_to_fail, failed_msgs,
+                    keep_going=keep_going, buildstep_phase=buildstep_phase)
+                if stop:
+                    break
 
         if len(failed_msgs) == 1:
             raise PluginFailedException(failed_msgs[0])
@@ -339,6 +819,9 @@ class BuildPluginsRunner(PluginsRunner):
     def save_plugin_duration(self, plugin, duration):
         self.workflow.plugins_durations[plugin] = duration
 
+    def save_plugin_resource_usage(self, plugin, usage):
+        self.workflow.plugins_resource_usage[plugin] = usage
+
     def _translate_special_values(self, obj_to_translate):
         """
         you may want to write plugins for values which are not known before build:
@@ -408,6 +891,59 @@ class PreBuildPluginsRunner(BuildPluginsRunner):
                                                     *args, **kwargs)
 
 
+class PrefetchPluginsRunner(PreBuildPluginsRunner):
+    """
+    start prefetch() of pre-build plugins in background threads
+
+    results are stored in workflow.prefetch_results for the plugins
+    to pick up when they are run by PreBuildPluginsRunner
+    """
+
+    def __init__(self, dt, workflow, plugins_conf, *args, **kwargs):
+        super(PrefetchPluginsRunner, self).__init__(dt, workflow, plugins_conf,
+                                                    *args, **kwargs)
+        self.pool = None
+
+    def run(self, keep_going=False, buildstep_phase=False):
+        plugins = []
+        for plugin_request in self.plugins_conf:
+            try:
+                plugin_class = self.plugin_classes[plugin_request['name']]
+            except (TypeError, KeyError):
+                # PreBuildPluginsRunner reports invalid requests
+                continue
+
+            if not plugin_class.can_prefetch:
+                continue
+
+            try:
+                plugin = self.create_instance_from_plugin(plugin_class,
+                                                          plugin_request.get('args', {}))
+            except Exception as ex:
+                logger.warning("not prefetching plugin '%s': %r", plugin_class.key, ex)
+                continue
+
+            plugins.append(plugin)
+
+        if not plugins:
+            return self.workflow.prefetch_results
+
+        self.pool = ThreadPool(len(plugins))
+        for plugin in plugins:
+            logger.info("prefetching plugin '%s'", plugin.key)
+            self.workflow.prefetch_results[plugin.key] = self.pool.apply_async(plugin.prefetch)
+        self.pool.close()
+
+        return self.workflow.prefetch_results
+
+    def wait(self):
+        """
+        wait for all prefetching to finish
+        """
+        if self.pool is not None:
+            self.pool.join()
+
+
 class BuildStepPlugin(BuildPlugin):
     pass
 
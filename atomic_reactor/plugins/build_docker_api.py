@@ -7,7 +7,10 @@ of the BSD license. See the LICENSE file for details.
 """
 from __future__ import print_function, unicode_literals
 
+import os
+
 import docker
+from atomic_reactor.constants import BUILD_LOG_FILENAME
 from atomic_reactor.plugin import BuildStepPlugin
 from atomic_reactor.util import wait_for_command
 from atomic_reactor.build import BuildResult
@@ -41,19 +44,24 @@ class DockerApiPlugin(BuildStepPlugin):
         logs_gen = self.tasker.build_image_from_path(builder.df_dir,
                                                      builder.image)
 
+        # keep only the end of the log in memory, chatty builds would not fit
+        logs_path = os.path.join(self.workflow.source.workdir, BUILD_LOG_FILENAME)
+
         self.log.debug('build is submitted, waiting for it to finish')
         try:
-            command_result = wait_for_command(logs_gen)
+            command_result = wait_for_command(logs_gen, logs_path=logs_path)
         except docker.errors.APIError as ex:
-            return BuildResult(logs=[], fail_reason=ex.explanation)
+            return BuildResult(logs=[], fail_reason=ex.explanation, logs_path=logs_path)
 
         if command_result.is_failed():
             return BuildResult(logs=command_result.logs,
-                               fail_reason=command_result.error)
+                               fail_reason=command_result.error,
+                               logs_path=logs_path)
         else:
             image_id = builder.get_built_image_info()['Id']
             if ':' not in image_id:
                 # Older versions of the daemon do not include the prefix
                 image_id = 'sha256:{}'.format(image_id)
 
-            return BuildResult(logs=command_result.logs, image_id=image_id)
+            return BuildResult(logs=command_result.logs, image_id=image_id,
+                               logs_path=logs_path)
@@ -24,6 +24,8 @@ class DeleteFromRegistryPlugin(ExitPlugin):
 
     key = "delete_from_registry"
     is_allowed_to_fail = False
+    reads = ()
+    writes = ()
 
     def __init__(self, tasker, workflow, registries):
         """
@@ -132,6 +134,19 @@ class DeleteFromRegistryPlugin(ExitPlugin):
 
         return worker_digests
 
+    def get_repositories(self, push_conf_registry, worker_digests):
+        """
+        Repositories manifests will be deleted from
+        """
+        repositories = set(digest['repository'] for digest in worker_digests)
+        if worker_digests:
+            manifest_list_digests = \
+                self.workflow.postbuild_results.get(PLUGIN_GROUP_MANIFESTS_KEY) or {}
+            repositories.update(manifest_list_digests)
+        if push_conf_registry:
+            repositories.update(tag.split(':')[0] for tag in push_conf_registry.digests)
+        return sorted(repositories)
+
     def handle_worker_digests(self, session, worker_digests, deleted_digests):
         registry_noschema = registry_hostname(session.registry)
 
@@ -182,7 +197,10 @@ class DeleteFromRegistryPlugin(ExitPlugin):
 
             secret_path = registry_conf.get('secret')
 
-            session = RegistrySession(registry, insecure=insecure, dockercfg_path=secret_path)
+            repositories = self.get_repositories(push_conf_registry,
+                                                 worker_digests.get(registry_noschema, []))
+            session = RegistrySession(registry, insecure=insecure, dockercfg_path=secret_path,
+                                      repositories=repositories, actions=('delete',))
 
             # orchestrator builds use worker_digests
             orchestrator_delete = self.handle_worker_digests(session, worker_digests,
@@ -16,6 +16,7 @@ from tempfile import NamedTemporaryFile
 from atomic_reactor import start_time as atomic_reactor_start_time
 from atomic_reactor.plugin import ExitPlugin
 from atomic_reactor.source import GitSource
+from atomic_reactor.timeline import Timeline
 from atomic_reactor.plugins.build_orchestrate_build import (get_worker_build_info,
                                                             get_koji_upload_dir)
 from atomic_reactor.plugins.pre_add_filesystem import AddFilesystemPlugin
@@ -77,6 +78,8 @@ class KojiImportPlugin(ExitPlugin):
 
     key = PLUGIN_KOJI_IMPORT_PLUGIN_KEY
     is_allowed_to_fail = False
+    reads = (PLUGIN_PULP_PULL_KEY, 'plugin_failed')
+    writes = ()
 
     def __init__(self, tasker, workflow, kojihub, url,
                  verify_ssl=True, use_auth=True,
@@ -222,6 +225,24 @@ class KojiImportPlugin(ExitPlugin):
 
         return output
 
+    def get_timeline(self):
+        """
+        Build list with the plugin timeline of orchestrator and worker builds,
+        in Chrome trace event format
+
+        :return: list, of log files
+        """
+        timeline = Timeline.from_workflow(self.workflow)
+        if not timeline.workers:
+            return []
+
+        trace = NamedTemporaryFile(prefix="%s-timeline" % self.build_id, suffix=".json",
+                                   mode='wb')
+        trace.write(json.dumps(timeline.get_trace()).encode('utf-8'))
+        trace.flush()
+        metadata = self.get_output_metadata(trace.name, "timeline.json")
+        return [Output(file=trace, metadata=metadata)]
+
     def set_help(self, extra, worker_metadatas):
         all_annotations = [get_worker_build_info(self.workflow, platform).build.get_annotations()
                            for platform in worker_metadatas]
@@ -481,7 +502,7 @@ class KojiImportPlugin(ExitPlugin):
         buildroot_id = buildroot[0]['id']
         output = self.get_output(worker_metadatas)
         output_files = [add_log_type(add_buildroot_id(md, buildroot_id))
-                        for md in self.get_logs()]
+                        for md in self.get_logs() + self.get_timeline()]
         output.extend([of.metadata for of in output_files])
 
         koji_metadata = {
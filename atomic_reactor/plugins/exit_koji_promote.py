@@ -87,6 +87,8 @@ class KojiPromotePlugin(ExitPlugin):
 
     key = PLUGIN_KOJI_PROMOTE_PLUGIN_KEY
     is_allowed_to_fail = False
+    reads = (PLUGIN_PULP_PULL_KEY, 'plugin_failed')
+    writes = ()
 
     def __init__(self, tasker, workflow, kojihub, url,
                  verify_ssl=True, use_auth=True,
@@ -291,11 +293,17 @@ class KojiPromotePlugin(ExitPlugin):
                                                 "openshift-final.log")
             output.append(Output(file=logfile, metadata=metadata))
 
-        docker_logs = NamedTemporaryFile(prefix="docker-%s" % self.build_id,
-                                         suffix=".log",
-                                         mode='wb')
-        docker_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
-        docker_logs.flush()
+        logs_path = self.workflow.build_result.logs_path
+        if logs_path and os.path.exists(logs_path):
+            # upload the whole log as written during the build
+            docker_logs = open(logs_path, 'rb')
+        else:
+            docker_logs = NamedTemporaryFile(prefix="docker-%s" % self.build_id,
+                                             suffix=".log",
+                                             mode='wb')
+            docker_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
+            docker_logs.flush()
+
         output.append(Output(file=docker_logs,
                              metadata=self.get_output_metadata(docker_logs.name,
                                                                "build.log")))
@@ -33,6 +33,8 @@ class KojiTagBuildPlugin(ExitPlugin):
 
     key = PLUGIN_KOJI_TAG_BUILD_KEY
     is_allowed_to_fail = False
+    reads = (KojiImportPlugin.key, KojiPromotePlugin.key, 'plugin_failed')
+    writes = ()
 
     def __init__(self, tasker, workflow, kojihub, target,
                  koji_ssl_certs=None, koji_proxy_user=None,
@@ -50,6 +50,8 @@ from atomic_reactor.pulp_util import PulpHandler
 class PulpPublishPlugin(ExitPlugin):
     key = PLUGIN_PULP_PUBLISH_KEY
     is_allowed_to_fail = False
+    reads = ('plugin_failed',)
+    writes = ()
 
     def __init__(self, tasker, workflow, pulp_registry_name,
                  pulp_secret_path=None, username=None, password=None,
@@ -8,9 +8,12 @@ of the BSD license. See the LICENSE file for details.
 
 Remove built image (this only makes sense if you store the image in some registry first)
 """
+import threading
+
+from atomic_reactor.leases import ImageLeases
 from atomic_reactor.plugin import ExitPlugin
 
-from docker.errors import APIError
+from docker.errors import APIError, NotFound
 
 __all__ = ('GarbageCollectionPlugin', )
 
@@ -23,36 +26,146 @@ def defer_removal(workflow, image):
     workspace['images_to_remove'].add(image)
 
 
+def defer_lease_release(workflow, leases_dir, holder, image):
+    """
+    release a lease on image at the end of the build, see leases.ImageLeases
+
+    :param leases_dir: str, directory with the leases
+    :param holder: str, holder of the lease
+    :param image: str, image the lease was taken on
+    """
+    key = GarbageCollectionPlugin.key
+    workflow.plugin_workspace.setdefault(key, {})
+    workspace = workflow.plugin_workspace[key]
+    workspace.setdefault('leases_to_release', set())
+    workspace['leases_to_release'].add((leases_dir, holder, image))
+
+
 class GarbageCollectionPlugin(ExitPlugin):
     key = "remove_built_image"
+    checkpoint_workspace = True
 
-    def __init__(self, tasker, workflow, remove_pulled_base_image=True):
+    def __init__(self, tasker, workflow, remove_pulled_base_image=True, background=False):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param remove_pulled_base_image: bool, remove also base image? default=True
+        :param background: bool, remove images on a separate thread and let the
+                           remaining exit plugins run meanwhile
         """
         # call parent constructor
         super(GarbageCollectionPlugin, self).__init__(tasker, workflow)
         self.remove_base_image = remove_pulled_base_image
+        self.background = background
+        self.reaper = None
 
     def run(self):
+        # (image, force) in the order they were requested
+        candidates = []
         image = self.workflow.builder.image_id
         if image:
-            self.remove_image(image, force=True)
+            candidates.append((image, True))
 
         if self.remove_base_image and self.workflow.pulled_base_images:
             # FIXME: we may need to add force here, let's try it like this for now
             # FIXME: when ID of pulled img matches an ID of an image already present, don't remove
             for base_image_tag in self.workflow.pulled_base_images:
-                self.remove_image(base_image_tag, force=False)
+                candidates.append((base_image_tag, False))
 
         workspace = self.workflow.plugin_workspace.get(self.key, {})
         images_to_remove = workspace.get('images_to_remove', [])
         for image in images_to_remove:
-            self.remove_image(image, force=True)
+            candidates.append((image, True))
+
+        # leased images are removed while releasing the lease, under its lock,
+        # and only after the images built from them
+        leases = list(workspace.get('leases_to_release', []))
+        leased = set(leased_image for _, _, leased_image in leases)
+        candidates = [(image, force) for image, force in candidates if image not in leased]
+
+        phases = self.plan_removals(candidates)
+        if self.background:
+            self.reaper = threading.Thread(target=self.reap, args=(phases, leases),
+                                           name='remove_built_image')
+            self.reaper.start()
+            self.log.info("removing images in the background")
+        else:
+            self.remove_images(phases)
+            self.release_leases(leases)
+
+    def resolve_image(self, image):
+        """
+        :param image: str, name or ID of image
+        :return: str, ID of image; '' if it doesn't exist, None if unknown
+        """
+        try:
+            return self.tasker.inspect_image(image)['Id']
+        except NotFound:
+            return ''
+        except Exception as ex:
+            self.log.debug("failed to inspect image %s: %r", image, ex)
+            return None
+
+    @staticmethod
+    def is_image_id(image, image_id):
+        if image.startswith('sha256:'):
+            image = image[len('sha256:'):]
+        if ':' in image or '/' in image:
+            return False
+        return image_id.split(':')[-1].startswith(image)
+
+    def plan_removals(self, candidates):
+        """
+        resolve images to their IDs and decide how to remove them
+
+        Built images, removed by ID with force, go first: docker refuses to
+        remove the last tag of an image another image was built from, so base
+        images can't be removed before them. Tags go next, removing them is
+        what deletes the image when it is not removed by ID. Other IDs go
+        last since docker refuses to remove an image with several tags by ID
+        without force. Tags of images removed by ID with force are skipped,
+        forced removal deletes all of them.
+
+        :param candidates: list of (image, force)
+        :return: list of phases, each a list of (image, force) which may be
+                 removed concurrently
+        """
+        names = list(set(image for image, _ in candidates))
+        image_ids = dict(zip(names, self.tasker.map_concurrently(self.resolve_image, names)))
+
+        tags = {}
+        ids = {}
+        for image, force in candidates:
+            image_id = image_ids[image]
+            if image_id == '':
+                self.log.debug("image %s doesn't exist, not removing it", image)
+            elif image_id and self.is_image_id(image, image_id):
+                ids[image_id] = ids.get(image_id, False) or force
+            else:
+                forced, _ = tags.get(image, (False, image_id))
+                tags[image] = (forced or force, image_id)
+
+        forced_ids = set(image_id for image_id, force in ids.items() if force)
+        phases = [
+            [(image_id, True) for image_id in forced_ids],
+            [(image, force) for image, (force, image_id) in tags.items()
+             if image_id not in forced_ids],
+            [(image_id, False) for image_id, force in ids.items() if not force],
+        ]
+        return [phase for phase in phases if phase]
+
+    def remove_images(self, phases):
+        for phase in phases:
+            self.tasker.map_concurrently(lambda removal: self.remove_image(*removal), phase)
+
+    def reap(self, phases, leases):
+        try:
+            self.remove_images(phases)
+            self.release_leases(leases)
+        except Exception:
+            self.log.exception("failed to remove images")
 
     def remove_image(self, image, force=False):
         try:
@@ -66,3 +179,17 @@ class GarbageCollectionPlugin(ExitPlugin):
         except Exception as ex:
             self.log.warning("exception while removing image %s: %r, ignoring",
                              image, ex)
+
+    def release_leases(self, leases):
+        for leases_dir, holder, image in leases:
+            self.release_lease(leases_dir, holder, image)
+
+    def release_lease(self, leases_dir, holder, image):
+        def remove(name):
+            if self.remove_base_image:
+                self.remove_image(name, force=False)
+
+        try:
+            ImageLeases(leases_dir, holder).release(image, remove)
+        except (IOError, OSError) as ex:
+            self.log.warning("failed to release lease on image %s: %r, ignoring", image, ex)
@@ -23,6 +23,8 @@ class RemoveWorkerMetadataPlugin(ExitPlugin):
     """
 
     key = PLUGIN_REMOVE_WORKER_METADATA_KEY
+    reads = ()
+    writes = ()
 
     def run(self):
         """
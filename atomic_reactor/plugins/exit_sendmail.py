@@ -42,6 +42,8 @@ class SendMailPlugin(ExitPlugin):
         }]
     """
     key = "sendmail"
+    reads = (KojiImportPlugin.key, KojiPromotePlugin.key, 'plugin_failed')
+    writes = ()
 
     # symbolic constants for states
     MANUAL_SUCCESS = 'manual_success'
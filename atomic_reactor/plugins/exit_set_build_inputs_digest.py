@@ -0,0 +1,88 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+from osbs.api import OSBS
+from osbs.conf import Configuration
+
+from atomic_reactor.constants import PLUGIN_CHECK_BUILD_INPUTS_KEY
+from atomic_reactor.plugin import ExitPlugin
+from atomic_reactor.plugins.pre_check_build_inputs import DEFAULT_LABEL_KEY
+from atomic_reactor.util import get_build_json
+
+
+class SetBuildInputsDigestPlugin(ExitPlugin):
+    """
+    Store digest of build inputs of a successful build on the BuildConfig
+
+    The digest computed by the check_build_inputs pre-build plugin is set
+    as a label on the BuildConfig, so the next autorebuild can find out
+    whether anything changed.
+
+    Example configuration:
+
+    {
+      "name": "set_build_inputs_digest",
+      "args": {
+        "label_key": "build-inputs-digest",
+        "url": "https://localhost:8443/"
+      }
+    }
+    """
+
+    key = 'set_build_inputs_digest'
+    is_allowed_to_fail = True
+    reads = ('plugin_failed',)
+    writes = ()
+
+    def __init__(self, tasker, workflow, url, label_key=DEFAULT_LABEL_KEY,
+                 verify_ssl=True, use_auth=True):
+        """
+        constructor
+
+        :param tasker: DockerTasker instance
+        :param workflow: DockerBuildWorkflow instance
+        :param url: str, URL to OSv3 instance
+        :param label_key: str, key of label holding digest of build inputs
+        :param verify_ssl: bool, verify SSL certificate?
+        :param use_auth: bool, initiate authentication with OSv3?
+        """
+        # call parent constructor
+        super(SetBuildInputsDigestPlugin, self).__init__(tasker, workflow)
+        self.url = url
+        self.label_key = label_key
+        self.verify_ssl = verify_ssl
+        self.use_auth = use_auth
+
+    def run(self):
+        """
+        run the plugin
+
+        :return: str, digest which was stored, or None
+        """
+        if self.workflow.build_process_failed:
+            self.log.info("build failed, not storing digest of build inputs")
+            return None
+
+        digest = self.workflow.prebuild_results.get(PLUGIN_CHECK_BUILD_INPUTS_KEY)
+        if not digest:
+            self.log.info("no digest of build inputs")
+            return None
+
+        metadata = get_build_json().get("metadata", {})
+        buildconfig = metadata["labels"]["buildconfig"]
+
+        osbs_conf = Configuration(conf_file=None, openshift_uri=self.url, openshift_url=self.url,
+                                  use_auth=self.use_auth, verify_ssl=self.verify_ssl,
+                                  namespace=metadata.get('namespace', None))
+        osbs = OSBS(osbs_conf, osbs_conf)
+        self.log.info("setting label %s=%s on build config %s",
+                      self.label_key, digest, buildconfig)
+        osbs.set_labels_on_build_config(buildconfig, {self.label_key: digest})
+        return digest
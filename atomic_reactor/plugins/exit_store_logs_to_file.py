@@ -7,6 +7,9 @@ of the BSD license. See the LICENSE file for details.
 """
 
 import json
+import os
+import shutil
+
 from atomic_reactor.constants import CONTAINER_RESULTS_JSON_PATH
 from atomic_reactor.inner import BuildResultsEncoder
 from atomic_reactor.plugin import ExitPlugin
@@ -18,24 +21,35 @@ __all__ = ('StoreLogsToFilePlugin', )
 class StoreLogsToFilePlugin(ExitPlugin):
     key = "store_logs_to_file"
 
-    def __init__(self, tasker, workflow, file_path):
+    def __init__(self, tasker, workflow, file_path, build_logs_path=None):
         """
         constructor
 
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param file_path: str, path to file where logs should be stored
+        :param build_logs_path: str, path to file where the whole build log
+                                should be copied
         """
         # call parent constructor
         super(StoreLogsToFilePlugin, self).__init__(tasker, workflow)
         self.file_path = file_path
+        self.build_logs_path = build_logs_path
 
     def run(self):
         file_path = self.file_path or CONTAINER_RESULTS_JSON_PATH
         results = {
             'prebuild_plugins': self.workflow.prebuild_results,
             'postbuild_plugins': self.workflow.postbuild_results,
+            'plugins_metadata': {
+                'durations': self.workflow.plugins_durations,
+                'resource_usage': self.workflow.plugins_resource_usage,
+            },
         }
 
         with open(file_path, 'w') as results_json_fd:
             json.dump(results, results_json_fd, cls=BuildResultsEncoder)
+
+        logs_path = self.workflow.build_result.logs_path
+        if self.build_logs_path and logs_path and os.path.exists(logs_path):
+            shutil.copyfile(logs_path, self.build_logs_path)
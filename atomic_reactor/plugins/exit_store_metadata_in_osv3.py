@@ -26,6 +26,7 @@ from atomic_reactor.constants import (PLUGIN_KOJI_IMPORT_PLUGIN_KEY,
                                       PLUGIN_GROUP_MANIFESTS_KEY,
                                       MEDIA_TYPE_DOCKER_V1)
 from atomic_reactor.plugin import ExitPlugin
+from atomic_reactor.timeline import Timeline
 from atomic_reactor.util import get_build_json
 
 
@@ -150,6 +151,7 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
             "errors": self.workflow.plugins_errors,
             "timestamps": self.workflow.plugins_timestamps,
             "durations": self.workflow.plugins_durations,
+            "resource_usage": self.workflow.plugins_resource_usage,
         }
 
     def make_labels(self):
@@ -236,6 +238,10 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
             "plugins-metadata": json.dumps(self.get_plugin_metadata())
         }
 
+        timeline = Timeline.from_workflow(self.workflow)
+        if timeline.workers:
+            annotations['critical-path'] = json.dumps(timeline.get_summary())
+
         help_result = self.workflow.prebuild_results.get(AddHelpPlugin.key)
         if isinstance(help_result, dict) and 'help_file' in help_result and 'status' in help_result:
             if help_result['status'] == AddHelpPlugin.NO_HELP_FILE_FOUND:
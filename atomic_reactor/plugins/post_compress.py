@@ -6,19 +6,30 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+from collections import deque
 import gzip
+import hashlib
 try:
     # if we import "lzma" first, we get pyliblzma on Py2, but we want backports.lzma
     #  so first try to import backports.lzma on Py2 and then 'lzma' on Py3
     from backports import lzma
 except ImportError:
     import lzma
+from multiprocessing.pool import ThreadPool
 import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # zstd method not available
+    zstandard = None
 
 from atomic_reactor.constants import (EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE,
-                                      IMAGE_TYPE_DOCKER_ARCHIVE)
+                                      IMAGE_TYPE_DOCKER_ARCHIVE, COMPRESS_BLOCK_SIZE)
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.util import get_exported_image_metadata, human_size
+from atomic_reactor.util import (get_exported_image_metadata, human_size, HashingWriter,
+                                 read_ahead)
 
 
 class CompressPlugin(PostBuildPlugin):
@@ -28,51 +39,125 @@ class CompressPlugin(PostBuildPlugin):
             "name": "compress",
             "args": {
                     "method": "gzip",
-                    "load_exported_image": true
+                    "load_exported_image": true,
+                    "threads": 8
             }
     }]
 
-    Currently supported compression methods are gzip and lzma; gzip is default.
+    Currently supported compression methods are gzip, lzma and zstd (when
+    the zstandard module is installed); gzip is default.
     By default, the plugin doesn't work on exported image, you have to explicitly
     ask for it by using `load_exported_image: true`.
+
+    With more than one thread, gzip and lzma compress blocks of the image in
+    parallel and write each of them as a separate gzip member or xz stream;
+    gzip, xz and Python's decompressors read such concatenated files as one.
+    zstd uses the multi-threaded compressor of the zstandard module.
     """
     key = 'compress'
     is_allowed_to_fail = False
 
+    extensions = {
+        'gzip': 'gz',
+        'lzma': 'xz',
+        'zstd': 'zst',
+    }
+    default_levels = {
+        'gzip': 6,
+        'lzma': 6,
+        'zstd': 3,
+    }
+
     # TODO: add remove_former_image?
-    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip'):
+    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip',
+                 threads=1, level=None):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param load_exported_image: bool, when running squash plugin with `dont_load=True`,
                                     you may load the exported tar with this switch
+        :param method: str, compression method: gzip, lzma or zstd
+        :param threads: int, number of threads compressing the image
+        :param level: int, compression level (preset for lzma); default depends on method
         """
         super(CompressPlugin, self).__init__(tasker, workflow)
         self.load_exported_image = load_exported_image
         self.method = method
+        self.threads = max(threads or 1, 1)
+        self.level = level if level is not None else self.default_levels.get(method)
         self.uncompressed_size = 0
+        self.uncompressed_sha256sum = None
 
-    def _compress_image_stream(self, stream):
-        outfile = os.path.join(self.workflow.source.workdir,
-                               EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE)
+    def _read_blocks(self, stream, block_size, uncompressed_sha256):
+        # the image is read from the daemon (or disk) while compressing it
+        for data in read_ahead(stream, block_size):
+            uncompressed_sha256.update(data)
+            yield data
+
+    def _open_compressor(self, raw):
         if self.method == 'gzip':
-            outfile = outfile.format('gz')
-            fp = gzip.open(outfile, 'wb', compresslevel=6)
+            return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.level)
         elif self.method == 'lzma':
-            outfile = outfile.format('xz')
-            fp = lzma.open(outfile, 'wb')
+            return lzma.LZMAFile(raw, mode='wb', preset=self.level)
         else:
+            compressor = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+            return compressor.stream_writer(raw)
+
+    def _compress_block(self, data):
+        """
+        compress data as a complete gzip member or xz stream; both zlib and
+        lzma release the GIL while compressing, so blocks run in parallel
+        """
+        if self.method == 'gzip':
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+        else:
+            return lzma.compress(data, preset=self.level)
+
+    def _compress_blocks_concurrently(self, blocks, raw):
+        pool = ThreadPool(self.threads)
+        try:
+            # keep only a few blocks per thread in memory
+            pending = deque()
+            for data in blocks:
+                pending.append(pool.apply_async(self._compress_block, (data,)))
+                if len(pending) >= 2 * self.threads:
+                    raw.write(pending.popleft().get())
+            while pending:
+                raw.write(pending.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+
+    def _compress_image_stream(self, stream):
+        if self.method not in self.extensions:
             raise RuntimeError('Unsupported compression format {0}'.format(self.method))
+        if self.method == 'zstd' and zstandard is None:
+            raise RuntimeError('zstd compression requires the zstandard module')
+
+        outfile = os.path.join(self.workflow.source.workdir,
+                               EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE)
+        outfile = outfile.format(self.extensions[self.method])
+
+        self.log.info('compressing image %s to %s using %s method (level %s, %d threads)',
+                      self.workflow.image, outfile, self.method, self.level, self.threads)
+        uncompressed_sha256 = hashlib.sha256()
 
-        _chunk_size = 1024**2  # 1 MB chunk size for reading/writing
-        self.log.info('compressing image %s to %s using %s method',
-                      self.workflow.image, outfile, self.method)
-        data = stream.read(_chunk_size)
-        while data != b'':
-            fp.write(data)
-            data = stream.read(_chunk_size)
+        # checksums of the compressed image are computed as it's written,
+        # so they are known without reading it back
+        with HashingWriter(outfile) as raw:
+            if self.threads > 1 and self.method != 'zstd':
+                blocks = self._read_blocks(stream, COMPRESS_BLOCK_SIZE, uncompressed_sha256)
+                self._compress_blocks_concurrently(blocks, raw)
+            else:
+                fp = self._open_compressor(raw)
+                _chunk_size = 1024**2  # 1 MB chunk size for reading/writing
+                for data in self._read_blocks(stream, _chunk_size, uncompressed_sha256):
+                    fp.write(data)
+                fp.close()
 
         self.uncompressed_size = stream.tell()
+        self.uncompressed_sha256sum = uncompressed_sha256.hexdigest()
 
         return outfile
 
@@ -96,6 +181,7 @@ class CompressPlugin(PostBuildPlugin):
 
         if self.uncompressed_size != 0:
             metadata['uncompressed_size'] = self.uncompressed_size
+            metadata['uncompressed_sha256sum'] = self.uncompressed_sha256sum
             savings = 1 - metadata['size'] / float(metadata['uncompressed_size'])
             self.log.debug('uncompressed: %s, compressed: %s, ratio: %.2f %% saved',
                            human_size(metadata['uncompressed_size']),
@@ -13,6 +13,9 @@ it for all existing image tags.
 
 from __future__ import unicode_literals
 import json
+from multiprocessing.pool import ThreadPool
+import threading
+
 import requests
 
 from atomic_reactor.plugin import PostBuildPlugin, PluginFailedException
@@ -41,7 +44,8 @@ class GroupManifestsPlugin(PostBuildPlugin):
         MEDIA_TYPE_OCI_V1_INDEX
     ]
 
-    def __init__(self, tasker, workflow, registries, group=True, goarch=None):
+    def __init__(self, tasker, workflow, registries, group=True, goarch=None,
+                 upload_workers=None):
         """
         constructor
 
@@ -55,6 +59,8 @@ class GroupManifestsPlugin(PostBuildPlugin):
         :param group: bool, if true, create a manifest list; otherwise only add tags to
                       amd64 image manifest
         :param goarch: dict, keys are platform, values are go language platform names
+        :param upload_workers: int, mount blobs and upload manifests concurrently on up
+                               to this many threads
         """
         # call parent constructor
         super(GroupManifestsPlugin, self).__init__(tasker, workflow)
@@ -62,6 +68,20 @@ class GroupManifestsPlugin(PostBuildPlugin):
         self.goarch = goarch or {}
         self.registries = registries
         self.worker_registries = {}
+        self.upload_workers = upload_workers
+        self.thread_pool = None
+        # (registry, repository, digest) of blobs known to be in the repository
+        self.linked_blobs = set()
+        self.linked_blobs_lock = threading.Lock()
+
+    def run_tasks(self, func, items):
+        """
+        Calls func for each of items, concurrently when upload_workers is set
+        """
+        items = list(items)
+        if self.thread_pool and len(items) > 1:
+            return self.thread_pool.map(func, items)
+        return [func(item) for item in items]
 
     def get_manifest(self, session, repository, ref):
         """
@@ -86,6 +106,13 @@ class GroupManifestsPlugin(PostBuildPlugin):
         Links ("mounts" in Docker Registry terminology) a blob from one repository in a
         registry into another repository in the same registry.
         """
+        key = (session.registry, target_repo, digest)
+        with self.linked_blobs_lock:
+            if key in self.linked_blobs:
+                self.log.debug("%s: blob %s already linked to %s",
+                               session.registry, digest, target_repo)
+                return
+
         self.log.debug("%s: Linking blob %s from %s to %s",
                        session.registry, digest, source_repo, target_repo)
 
@@ -96,6 +123,8 @@ class GroupManifestsPlugin(PostBuildPlugin):
             self.log.debug("%s: blob %s, not present in %s, skipping",
                            session.registry, digest, source_repo)
             # Assume we don't need to copy it - maybe it's a foreign layer
+            with self.linked_blobs_lock:
+                self.linked_blobs.add(key)
             return
         result.raise_for_status()
 
@@ -108,15 +137,14 @@ class GroupManifestsPlugin(PostBuildPlugin):
             # we're starting an upload - but we've checked that above
             raise RuntimeError("Blob mount had unexpected status {}".format(result.status_code))
 
-    def link_manifest_references_into_repository(self, session, manifest, media_type,
-                                                 source_repo, target_repo):
+        with self.linked_blobs_lock:
+            self.linked_blobs.add(key)
+
+    def get_manifest_references(self, manifest, media_type):
         """
-        Links all the blobs referenced by the manifest from source_repo into target_repo.
+        Returns digests of all the blobs referenced by the manifest.
         """
 
-        if source_repo == target_repo:
-            return
-
         parsed = json.loads(manifest.decode('utf-8'))
 
         references = []
@@ -129,30 +157,29 @@ class GroupManifestsPlugin(PostBuildPlugin):
             # we never copy a manifest list as a whole between repositories
             raise RuntimeError("Unhandled media-type {}".format(media_type))
 
-        for digest in references:
-            self.link_blob_into_repository(session, digest, source_repo, target_repo)
+        return references
 
-    def store_manifest_in_repository(self, session, manifest, media_type,
-                                     source_repo, target_repo, digest=None, tag=None):
+    def link_manifest_references_into_repository(self, session, manifest, media_type,
+                                                 source_repo, target_repo):
         """
-        Stores the manifest into target_repo, possibly tagging it. This may involve
-        copying referenced blobs from source_repo.
+        Links all the blobs referenced by the manifest from source_repo into target_repo.
         """
 
-        if tag:
-            self.log.debug("%s: Tagging manifest (or list) from %s as %s:%s",
-                           session.registry, source_repo, target_repo, tag)
-            ref = tag
-        elif digest:
-            self.log.debug("%s: Storing manifest (or list) %s from %s in %s",
-                           session.registry, digest, source_repo, target_repo)
-            ref = digest
-        else:
-            raise RuntimeError("Either digest or tag must be specified")
+        if source_repo == target_repo:
+            return
 
-        self.link_manifest_references_into_repository(session, manifest, media_type,
-                                                      source_repo, target_repo)
+        references = self.get_manifest_references(manifest, media_type)
+        self.run_tasks(lambda digest: self.link_blob_into_repository(session, digest,
+                                                                     source_repo, target_repo),
+                       references)
 
+    def put_manifest(self, session, manifest, media_type, target_repo, ref):
+        """
+        Uploads the manifest into target_repo as ref, a digest or a tag. All the
+        blobs it references must already be in target_repo.
+        """
+        self.log.debug("%s: Storing manifest (or list) in %s as %s",
+                       session.registry, target_repo, ref)
         url = '/v2/{}/manifests/{}'.format(target_repo, ref)
         headers = {'Content-Type': media_type}
         response = session.put(url, data=manifest, headers=headers)
@@ -227,19 +254,39 @@ class GroupManifestsPlugin(PostBuildPlugin):
         # Now push the manifest list to the registry once per each tag
         self.log.info("%s: Tagging manifest list", session.registry)
 
+        target_repos = []
         for image in self.workflow.tag_conf.images:
             target_repo = image.to_str(registry=False, tag=False)
-            # We have to call store_manifest_in_repository directly for each
-            # referenced manifest, since they potentially come from different repos
+            if target_repo not in target_repos:
+                target_repos.append(target_repo)
+
+        # The referenced manifests potentially come from different repos, first
+        # link all their blobs into each target repository
+        links = []
+        for target_repo in target_repos:
             for manifest in manifests:
-                self.store_manifest_in_repository(session,
-                                                  manifest['content'],
-                                                  manifest['media_type'],
-                                                  manifest['repository'],
-                                                  target_repo,
-                                                  digest=manifest['digest'])
-            self.store_manifest_in_repository(session, list_json, list_type,
-                                              target_repo, target_repo, tag=image.tag)
+                if manifest['repository'] == target_repo:
+                    continue
+                for digest in self.get_manifest_references(manifest['content'],
+                                                           manifest['media_type']):
+                    link = (digest, manifest['repository'], target_repo)
+                    if link not in links:
+                        links.append(link)
+        self.run_tasks(lambda link: self.link_blob_into_repository(session, *link), links)
+
+        # then store the manifests themselves, by digest
+        self.log.debug("%s: Storing %d manifests in %s", session.registry,
+                       len(manifests), target_repos)
+        self.run_tasks(lambda args: self.put_manifest(session, *args),
+                       [(manifest['content'], manifest['media_type'], target_repo,
+                         manifest['digest'])
+                        for target_repo in target_repos for manifest in manifests])
+
+        # and finally the list referencing them, once per each tag
+        self.run_tasks(lambda image: self.put_manifest(session, list_json, list_type,
+                                                       image.to_str(registry=False, tag=False),
+                                                       image.tag),
+                       self.workflow.tag_conf.images)
         # Get the digest of the manifest list using one of the tags
         registry_image = self.workflow.tag_conf.unique_images[0]
         _, digest_str, _, _ = self.get_manifest(session,
@@ -281,11 +328,19 @@ class GroupManifestsPlugin(PostBuildPlugin):
 
         push_conf_registry = self.workflow.push_conf.add_docker_registry(session.registry,
                                                                          insecure=session.insecure)
-        for image in self.workflow.tag_conf.images:
-            target_repo = image.to_str(registry=False, tag=False)
-            self.store_manifest_in_repository(session, image_manifest, media_type,
-                                              source_repo, target_repo, tag=image.tag)
+        target_repos = set(image.to_str(registry=False, tag=False)
+                           for image in self.workflow.tag_conf.images)
+        for target_repo in sorted(target_repos):
+            self.link_manifest_references_into_repository(session, image_manifest, media_type,
+                                                          source_repo, target_repo)
+
+        self.log.debug("%s: Tagging manifest from %s", session.registry, source_repo)
+        self.run_tasks(lambda image: self.put_manifest(session, image_manifest, media_type,
+                                                       image.to_str(registry=False, tag=False),
+                                                       image.tag),
+                       self.workflow.tag_conf.images)
 
+        for image in self.workflow.tag_conf.images:
             # add a tag for any plugins running later that expect it
             push_conf_registry.digests[image.tag] = digests
 
@@ -336,18 +391,37 @@ class GroupManifestsPlugin(PostBuildPlugin):
 
         return sources
 
-    def get_registry_session(self, registry):
+    def get_registry_session(self, registry, source=None):
         registry_conf = self.registries[registry]
 
         insecure = registry_conf.get('insecure', False)
         secret_path = registry_conf.get('secret')
 
-        return RegistrySession(registry, insecure=insecure, dockercfg_path=secret_path)
+        # worker repositories are read from, tagged repositories written to
+        repositories = set(image.to_str(registry=False, tag=False)
+                           for image in self.workflow.tag_conf.images)
+        repositories.update(worker_image['repository']
+                            for worker_image in (source or {}).values())
+
+        return RegistrySession(registry, insecure=insecure, dockercfg_path=secret_path,
+                               content_cache=self.workflow.registry_content_cache,
+                               repositories=sorted(repositories))
 
     def run(self):
+        if self.upload_workers:
+            self.thread_pool = ThreadPool(self.upload_workers)
+        try:
+            return self.group_or_tag()
+        finally:
+            if self.thread_pool:
+                self.thread_pool.close()
+                self.thread_pool.join()
+                self.thread_pool = None
+
+    def group_or_tag(self):
         digests = dict()
         for registry, source in self.sort_annotations().items():
-            session = self.get_registry_session(registry)
+            session = self.get_registry_session(registry, source)
 
             if self.group:
                 repo, digest = self.group_manifests_and_tag(session, source)
@@ -262,11 +262,17 @@ class KojiUploadPlugin(PostBuildPlugin):
         :return: list, Output instances
         """
 
-        build_logs = NamedTemporaryFile(prefix="buildstep-%s" % self.build_id,
-                                         suffix=".log",
-                                         mode='wb')
-        build_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
-        build_logs.flush()
+        logs_path = self.workflow.build_result.logs_path
+        if logs_path and os.path.exists(logs_path):
+            # upload the whole log as written during the build
+            build_logs = open(logs_path, 'rb')
+        else:
+            build_logs = NamedTemporaryFile(prefix="buildstep-%s" % self.build_id,
+                                             suffix=".log",
+                                             mode='wb')
+            build_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
+            build_logs.flush()
+
         filename = "{platform}-build.log".format(platform=self.platform)
         return [Output(file=build_logs,
                        metadata=self.get_output_metadata(build_logs.name,
@@ -78,6 +78,7 @@ def get_manifests_in_pulp_repository(workflow):
 class PulpSyncPlugin(PostBuildPlugin):
     key = PLUGIN_PULP_SYNC_KEY
     is_allowed_to_fail = False
+    checkpoint_workspace = True
 
     CER = 'pulp.cer'
     KEY = 'pulp.key'
@@ -6,14 +6,17 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+from collections import OrderedDict
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 import re
 import subprocess
 
 from atomic_reactor.constants import IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.plugins.exit_remove_built_image import defer_removal
-from atomic_reactor.util import get_manifest_digests, get_config_from_registry, Dockercfg
+from atomic_reactor.util import (get_manifest_digests, get_config_from_registry, Dockercfg,
+                                 RegistrySession)
 
 
 __all__ = ('TagAndPushPlugin', )
@@ -27,7 +30,7 @@ class TagAndPushPlugin(PostBuildPlugin):
     key = "tag_and_push"
     is_allowed_to_fail = False
 
-    def __init__(self, tasker, workflow, registries):
+    def __init__(self, tasker, workflow, registries, push_workers=None):
         """
         constructor
 
@@ -40,11 +43,16 @@ class TagAndPushPlugin(PostBuildPlugin):
                               plain HTTP.
                             * "secret" optional string - path to the secret, which stores
                               email, login and password for remote registry
+        :param push_workers: int, push images and query registries concurrently
+                             on up to this many threads; the first tag for each
+                             registry is pushed before the rest so that layers
+                             are uploaded only once
         """
         # call parent constructor
         super(TagAndPushPlugin, self).__init__(tasker, workflow)
 
         self.registries = deepcopy(registries)
+        self.push_workers = push_workers
 
     def need_skopeo_push(self):
         if len(self.workflow.exported_image_sequence) > 0:
@@ -96,12 +104,141 @@ class TagAndPushPlugin(PostBuildPlugin):
             e.cmd = log_cmd  # hide credentials
             raise
 
+    def push_image(self, registry_image, insecure, docker_push_secret):
+        if self.need_skopeo_push():
+            self.push_with_skopeo(registry_image, insecure, docker_push_secret)
+        else:
+            self.tasker.tag_and_push_image(self.workflow.builder.image_id,
+                                           registry_image, insecure=insecure,
+                                           force=True, dockercfg=docker_push_secret)
+
+    def push_concurrently(self):
+        registry_images = OrderedDict()
+        for registry in self.registries:
+            registry_images[registry] = []
+            for image in self.workflow.tag_conf.images:
+                if image.registry:
+                    raise RuntimeError("Image name must not contain registry: %r" % image.registry)
+
+                registry_image = image.copy()
+                registry_image.registry = registry
+                registry_images[registry].append(registry_image)
+
+        if not self.need_skopeo_push():
+            # tags pushed before a failure still have to be removed
+            for images in registry_images.values():
+                for registry_image in images:
+                    defer_removal(self.workflow, registry_image)
+
+        def push(registry_image):
+            registry_conf = self.registries[registry_image.registry]
+            self.push_image(registry_image, registry_conf.get('insecure', False),
+                            registry_conf.get('secret', None))
+
+        # one pooled session per registry, shared by all the threads
+        repositories = sorted(set(image.to_str(registry=False, tag=False)
+                                  for image in self.workflow.tag_conf.images))
+        registry_sessions = {}
+        for registry, registry_conf in self.registries.items():
+            registry_sessions[registry] = RegistrySession(
+                registry, insecure=registry_conf.get('insecure', False),
+                dockercfg_path=registry_conf.get('secret', None),
+                content_cache=self.workflow.registry_content_cache,
+                repositories=repositories)
+
+        def push_and_query(args):
+            registry_image, should_push = args
+            if should_push:
+                push(registry_image)
+
+            registry = registry_image.registry
+            registry_conf = self.registries[registry]
+            return get_manifest_digests(registry_image, registry,
+                                        registry_conf.get('insecure', False),
+                                        registry_conf.get('secret', None),
+                                        registry_session=registry_sessions[registry],
+                                        head=True, max_workers=self.push_workers)
+
+        def query_config(args):
+            registry, config_registry_image, digest, manifest_type = args
+            registry_conf = self.registries[registry]
+            return get_config_from_registry(config_registry_image, registry, digest,
+                                            registry_conf.get('insecure', False),
+                                            registry_conf.get('secret', None),
+                                            manifest_type,
+                                            content_cache=self.workflow.registry_content_cache)
+
+        thread_pool = ThreadPool(self.push_workers)
+        try:
+            first_images = [images[0] for images in registry_images.values() if images]
+            self.log.info("pushing %d images to %d registries on %d threads",
+                          sum(len(images) for images in registry_images.values()),
+                          len(registry_images), self.push_workers)
+            # blobs are uploaded by the first push to each registry,
+            # the remaining tags only need to refer to them
+            thread_pool.map(push, first_images)
+
+            tasks = [(registry_image, index > 0)
+                     for images in registry_images.values()
+                     for index, registry_image in enumerate(images)]
+            all_digests = thread_pool.map(push_and_query, tasks)
+
+            # record the results in the same order as pushing them one by one would
+            pushed_images = []
+            config_queries = []
+            push_conf_registries = []
+            config_manifest_digest = None
+            config_manifest_type = None
+            config_registry_image = None
+            digests_iter = iter(all_digests)
+            for registry, images in registry_images.items():
+                insecure = self.registries[registry].get('insecure', False)
+                push_conf_registry = \
+                    self.workflow.push_conf.add_docker_registry(registry, insecure=insecure)
+
+                for registry_image in images:
+                    digests = next(digests_iter)
+                    pushed_images.append(registry_image)
+                    tag = registry_image.to_str(registry=False)
+                    push_conf_registry.digests[tag] = digests
+
+                    if not config_manifest_digest and (digests.v2 or digests.oci):
+                        if digests.v2:
+                            config_manifest_digest = digests.v2
+                            config_manifest_type = 'v2'
+                        else:
+                            config_manifest_digest = digests.oci
+                            config_manifest_type = 'oci'
+                        config_registry_image = registry_image
+
+                if config_manifest_digest:
+                    push_conf_registries.append(push_conf_registry)
+                    config_queries.append((registry, config_registry_image,
+                                           config_manifest_digest, config_manifest_type))
+                else:
+                    self.log.info("V2 schema 2 or OCI manifest is not available "
+                                  "to get config from")
+
+            configs = thread_pool.map(query_config, config_queries)
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+
+        for push_conf_registry, config in zip(push_conf_registries, configs):
+            push_conf_registry.config = config
+
+        self.log.info("All images were tagged and pushed")
+        return pushed_images
+
     def run(self):
         pushed_images = []
 
         if not self.workflow.tag_conf.unique_images:
             self.workflow.tag_conf.add_unique_image(self.workflow.image)
 
+        if self.push_workers:
+            return self.push_concurrently()
+
         config_manifest_digest = None
         config_manifest_type = None
         config_registry_image = None
@@ -119,12 +256,8 @@ class TagAndPushPlugin(PostBuildPlugin):
 
                 registry_image = image.copy()
                 registry_image.registry = registry
-                if self.need_skopeo_push():
-                    self.push_with_skopeo(registry_image, insecure, docker_push_secret)
-                else:
-                    self.tasker.tag_and_push_image(self.workflow.builder.image_id,
-                                                   registry_image, insecure=insecure,
-                                                   force=True, dockercfg=docker_push_secret)
+                self.push_image(registry_image, insecure, docker_push_secret)
+                if not self.need_skopeo_push():
                     defer_removal(self.workflow, registry_image)
 
                 pushed_images.append(registry_image)
@@ -146,7 +279,8 @@ class TagAndPushPlugin(PostBuildPlugin):
             if config_manifest_digest:
                 push_conf_registry.config = get_config_from_registry(
                     config_registry_image, registry, config_manifest_digest, insecure,
-                    docker_push_secret, config_manifest_type)
+                    docker_push_secret, config_manifest_type,
+                    content_cache=self.workflow.registry_content_cache)
             else:
                 self.log.info("V2 schema 2 or OCI manifest is not available to get config from")
 
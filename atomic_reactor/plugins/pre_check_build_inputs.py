@@ -0,0 +1,217 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+try:
+    # py2
+    from ConfigParser import ConfigParser, Error as ConfigParserError
+    from StringIO import StringIO
+except ImportError:
+    # py3
+    from configparser import ConfigParser, Error as ConfigParserError
+    from io import StringIO
+
+import hashlib
+import json
+
+import requests
+
+from atomic_reactor.constants import (PLUGIN_CHECK_BUILD_INPUTS_KEY, PLUGIN_FETCH_MAVEN_KEY,
+                                      YUM_REPOS_DIR)
+from atomic_reactor.plugin import PreBuildPlugin, AutoRebuildCanceledException
+from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
+from atomic_reactor.util import (df_parser, get_build_json, get_all_label_keys,
+                                 get_retrying_requests_session)
+
+
+DEFAULT_LABEL_KEY = 'build-inputs-digest'
+# values of OpenShift labels are limited to 63 characters
+DIGEST_LENGTH = 63
+# labels which change with every build, even when built from the same inputs
+VOLATILE_LABELS = (('build-date',) +
+                   get_all_label_keys('release') +
+                   get_all_label_keys('com.redhat.build-host'))
+
+
+class CheckBuildInputsPlugin(PreBuildPlugin):
+    """
+    Cancel autorebuilds whose inputs didn't change since the last build
+
+    This plugin computes a digest of the effective inputs of the build:
+
+    - the source repository and commit
+    - the Dockerfile after all edits by pre-build plugins, without labels
+      which change with every build (build date, release, build host)
+    - ID of the parent image
+    - files added to the build, e.g. yum repo files
+    - checksums of repodata/repomd.xml of the yum repos in those files, so
+      new packages in a repo make the build run even when its URL is the same
+    - checksums of fetched artifacts
+    - names of configured plugins
+
+    The digest of the last successful build is stored by the
+    set_build_inputs_digest exit plugin as a label on the BuildConfig,
+    from where OpenShift copies it to the next build. When this build is
+    an autorebuild and the digest is the same, AutoRebuildCanceledException
+    is raised, so the image of the last build is kept. Autorebuilds using
+    yum repos whose metadata can't be fetched (e.g. mirrorlist repos or
+    URLs with yum variables) are never canceled.
+
+    The plugin has to be configured as the last pre-build plugin.
+
+    Example configuration:
+
+    {
+      "name": "check_build_inputs",
+      "args": {
+        "label_key": "build-inputs-digest"
+      }
+    }
+    """
+
+    key = PLUGIN_CHECK_BUILD_INPUTS_KEY
+    # set is_allowed_to_fail to False, so that the actual build is skipped
+    # if this plugin raises AutoRebuildCanceledException
+    is_allowed_to_fail = False
+
+    def __init__(self, tasker, workflow, label_key=DEFAULT_LABEL_KEY):
+        """
+        constructor
+
+        :param tasker: DockerTasker instance
+        :param workflow: DockerBuildWorkflow instance
+        :param label_key: str, key of label holding digest of the last build
+        """
+        # call parent constructor
+        super(CheckBuildInputsPlugin, self).__init__(tasker, workflow)
+        self.label_key = label_key
+
+    def get_dockerfile_inputs(self):
+        dfp = df_parser(self.workflow.builder.df_path, workflow=self.workflow)
+        instructions = [(instruction['instruction'], instruction['value'])
+                        for instruction in dfp.structure
+                        if instruction['instruction'] != 'LABEL']
+        labels = dict((key, value) for key, value in dfp.labels.items()
+                      if key not in VOLATILE_LABELS)
+        return {'instructions': instructions, 'labels': labels}
+
+    def get_parent_image_id(self):
+        try:
+            return self.workflow.base_image_inspect['Id']
+        except KeyError:
+            # scratch or custom base image
+            return None
+
+    def get_artifacts(self):
+        downloads = self.workflow.prebuild_results.get(PLUGIN_FETCH_MAVEN_KEY) or []
+        return sorted([download.url, download.dest, download.checksums]
+                      for download in downloads)
+
+    def get_repo_metadata(self):
+        """
+        checksums of metadata of yum repos added to the build
+
+        :return: dict, "file [repo]" -> sha256 of repodata/repomd.xml of
+                 the repo, None when it can't be fetched
+        """
+        session = get_retrying_requests_session()
+        metadata = {}
+        for path, content in self.workflow.files.items():
+            if not path.startswith(YUM_REPOS_DIR):
+                continue
+
+            repos = ConfigParser()
+            try:
+                repos.readfp(StringIO(content))
+            except ConfigParserError as ex:
+                self.log.warning("can't parse yum repo file %s: %r", path, ex)
+                metadata[path] = None
+                continue
+
+            for section in repos.sections():
+                if (repos.has_option(section, 'enabled') and
+                        repos.get(section, 'enabled', raw=True).strip() == '0'):
+                    continue
+                name = '{} [{}]'.format(path, section)
+                metadata[name] = None
+                if not repos.has_option(section, 'baseurl'):
+                    continue
+                baseurls = repos.get(section, 'baseurl', raw=True).split()
+                if not baseurls or '$' in baseurls[0]:
+                    continue
+
+                url = baseurls[0].rstrip('/') + '/repodata/repomd.xml'
+                try:
+                    response = session.get(url)
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as ex:
+                    self.log.warning("can't fetch metadata of yum repo %s: %r", name, ex)
+                    continue
+                metadata[name] = hashlib.sha256(response.content).hexdigest()
+
+        return metadata
+
+    def get_plugin_names(self):
+        plugin_names = {}
+        for phase in ('prebuild', 'buildstep', 'prepublish', 'postbuild', 'exit'):
+            plugins_conf = getattr(self.workflow, phase + '_plugins_conf') or []
+            plugin_names[phase] = [plugin.get('name') for plugin in plugins_conf]
+        return plugin_names
+
+    def get_inputs(self):
+        """
+        collect effective inputs of the build
+
+        :return: dict
+        """
+        vcs = self.workflow.source.get_vcs_info()
+        return {
+            'vcs': [vcs.vcs_type, vcs.vcs_url, vcs.vcs_ref] if vcs else None,
+            'dockerfile': self.get_dockerfile_inputs(),
+            'parent_image_id': self.get_parent_image_id(),
+            'files': self.workflow.files,
+            'repos': self.get_repo_metadata(),
+            'artifacts': self.get_artifacts(),
+            'plugins': self.get_plugin_names(),
+        }
+
+    def get_digest(self, inputs):
+        serialized = json.dumps(inputs, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(serialized).hexdigest()[:DIGEST_LENGTH]
+
+    def run(self):
+        """
+        run the plugin
+
+        :return: str, digest of build inputs
+        """
+        inputs = self.get_inputs()
+        digest = self.get_digest(inputs)
+        self.log.info("digest of build inputs: %s", digest)
+
+        if not is_rebuild(self.workflow):
+            return digest
+
+        unknown_repos = sorted(name for name, checksum in inputs['repos'].items()
+                               if checksum is None)
+        if unknown_repos:
+            self.log.info("content of yum repos %s is unknown, not comparing build inputs",
+                          unknown_repos)
+            return digest
+
+        labels = get_build_json().get('metadata', {}).get('labels', {})
+        last_digest = labels.get(self.label_key)
+        self.log.info("digest of build inputs of the last build: %s", last_digest)
+        if last_digest == digest:
+            self.log.info('build inputs did not change, %s is interrupting the build',
+                          self.key)
+            raise AutoRebuildCanceledException(self.key,
+                                               'build inputs did not change since last build')
+
+        return digest
@@ -13,7 +13,7 @@ import koji
 import os
 
 from atomic_reactor import util
-from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE
+from atomic_reactor.constants import DEFAULT_DOWNLOAD_BLOCK_SIZE, PLUGIN_FETCH_MAVEN_KEY
 from atomic_reactor.koji_util import create_koji_session
 from atomic_reactor.plugin import PreBuildPlugin
 from collections import namedtuple
@@ -65,8 +65,11 @@ DownloadRequest = namedtuple('DownloadRequest', 'url dest checksums')
 
 class FetchMavenArtifactsPlugin(PreBuildPlugin):
 
-    key = 'fetch_maven_artifacts'
+    key = PLUGIN_FETCH_MAVEN_KEY
     is_allowed_to_fail = False
+    reads = ()
+    writes = ('artifacts',)
+    can_prefetch = True
 
     NVR_REQUESTS_FILENAME = 'fetch-artifacts-koji.yaml'
     URL_REQUESTS_FILENAME = 'fetch-artifacts-url.yaml'
@@ -219,7 +222,7 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
                         'Computed {} checksum, {}, does not match expected checksum, {}'
                         .format(algo, checksum.hexdigest(), download.checksums[algo]))
 
-    def run(self):
+    def fetch_artifacts(self):
         self.session = create_koji_session(self.koji_info['hub'], self.koji_info.get('auth'))
 
         nvr_requests = self.read_nvr_requests()
@@ -229,6 +232,19 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
                           self.process_by_url(url_requests))
 
         self.download_files(download_queue)
+        return download_queue
+
+    def prefetch(self):
+        """
+        download artifacts when the build starts, they only depend
+        on files in the source repository
+        """
+        return self.fetch_artifacts()
+
+    def run(self):
+        download_queue = self.get_prefetched()
+        if download_queue is None:
+            download_queue = self.fetch_artifacts()
 
         # TODO: Return a list of files for koji metadata
         return download_queue
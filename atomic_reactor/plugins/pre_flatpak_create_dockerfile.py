@@ -79,6 +79,7 @@ def set_flatpak_source_info(workflow, source):
 class FlatpakCreateDockerfilePlugin(PreBuildPlugin):
     key = "flatpak_create_dockerfile"
     is_allowed_to_fail = False
+    checkpoint_workspace = True
 
     def __init__(self, tasker, workflow,
                  base_image=None):
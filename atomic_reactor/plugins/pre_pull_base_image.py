@@ -13,7 +13,9 @@ from __future__ import unicode_literals
 
 import docker
 
+from atomic_reactor.leases import ImageLeases
 from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.plugins.exit_remove_built_image import defer_lease_release
 from atomic_reactor.util import get_build_json, ImageName
 from atomic_reactor.core import RetryGeneratorException
 
@@ -21,8 +23,10 @@ from atomic_reactor.core import RetryGeneratorException
 class PullBaseImagePlugin(PreBuildPlugin):
     key = "pull_base_image"
     is_allowed_to_fail = False
+    can_prefetch = True
 
-    def __init__(self, tasker, workflow, parent_registry=None, parent_registry_insecure=False):
+    def __init__(self, tasker, workflow, parent_registry=None, parent_registry_insecure=False,
+                 leases_dir=None):
         """
         constructor
 
@@ -30,24 +34,18 @@ class PullBaseImagePlugin(PreBuildPlugin):
         :param workflow: DockerBuildWorkflow instance
         :param parent_registry: registry to enforce pulling from
         :param parent_registry_insecure: allow connecting to the registry over plain http
+        :param leases_dir: str, directory shared by builds on the docker host where
+                           leases on base images are kept; builds then share pulled
+                           base images and only the last one using it removes it
         """
         # call parent constructor
         super(PullBaseImagePlugin, self).__init__(tasker, workflow)
 
         self.parent_registry = parent_registry
         self.parent_registry_insecure = parent_registry_insecure
+        self.leases_dir = leases_dir
 
-    def run(self):
-        """
-        pull base image
-        """
-        base_image = self.workflow.builder.base_image
-        if self.parent_registry is not None:
-            self.log.info("pulling base image '%s' from registry '%s'",
-                          base_image, self.parent_registry)
-        else:
-            self.log.info("pulling base image '%s'", base_image)
-
+    def _get_image_with_registry(self, base_image):
         base_image_with_registry = base_image.copy()
 
         if self.parent_registry:
@@ -63,6 +61,14 @@ class PullBaseImagePlugin(PreBuildPlugin):
 
             base_image_with_registry.registry = self.parent_registry
 
+        return base_image_with_registry
+
+    def _pull_image(self, base_image_with_registry):
+        """
+        pull image, falling back to the 'library' namespace
+
+        :param base_image_with_registry: ImageName, updated to the pulled image
+        """
         try:
             self.tasker.pull_image(base_image_with_registry,
                                    insecure=self.parent_registry_insecure)
@@ -82,8 +88,66 @@ class PullBaseImagePlugin(PreBuildPlugin):
             except RetryGeneratorException:
                 raise original_exc
 
+    def _pull_base_image(self, base_image_with_registry):
+        """
+        pull base image, or take a lease on it when leases are used
+
+        :param base_image_with_registry: ImageName, image to pull
+        :return: ImageName, pulled image
+        """
+        if not self.leases_dir:
+            self._pull_image(base_image_with_registry)
+            # remove the image at the end of the build even when it wasn't used
+            self.workflow.pulled_base_images.add(base_image_with_registry.to_str())
+            return base_image_with_registry
+
+        def pull():
+            self._pull_image(base_image_with_registry)
+            return base_image_with_registry.to_str()
+
+        requested = base_image_with_registry.to_str()
+        holder = get_build_json()['metadata']['name']
+        leases = ImageLeases(self.leases_dir, holder)
+        pulled = leases.acquire(requested, pull, self.tasker.image_exists)
+        # the last build releasing the lease removes the image
+        defer_lease_release(self.workflow, self.leases_dir, holder, requested)
+        return ImageName.parse(pulled)
+
+    def prefetch(self):
+        """
+        pull base image specified in the Dockerfile when the build starts
+
+        :return: tuple (str, name of requested image; ImageName, pulled image) or None
+        """
+        base_image = self.workflow.builder.base_image
+        if base_image is None:
+            return None
+
+        requested = self._get_image_with_registry(base_image)
+        base_image_with_registry = self._pull_base_image(requested.copy())
+        return requested.to_str(), base_image_with_registry
+
+    def run(self):
+        """
+        pull base image
+        """
+        base_image = self.workflow.builder.base_image
+        if self.parent_registry is not None:
+            self.log.info("pulling base image '%s' from registry '%s'",
+                          base_image, self.parent_registry)
+        else:
+            self.log.info("pulling base image '%s'", base_image)
+
+        base_image_with_registry = self._get_image_with_registry(base_image)
+
+        prefetched = self.get_prefetched()
+        if prefetched and prefetched[0] == base_image_with_registry.to_str():
+            self.log.info("base image was prefetched")
+            base_image_with_registry = prefetched[1]
+        else:
+            base_image_with_registry = self._pull_base_image(base_image_with_registry)
+
         pulled_base = base_image_with_registry.to_str()
-        self.workflow.pulled_base_images.add(pulled_base)
 
         # Attempt to tag it using a unique ID. We might have to retry
         # if another build with the same parent image is finishing up
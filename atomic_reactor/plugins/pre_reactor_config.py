@@ -146,6 +146,7 @@ class ReactorConfigPlugin(PreBuildPlugin):
 
     # Exceptions from this plugin should fail the build
     is_allowed_to_fail = False
+    checkpoint_workspace = True
 
     def __init__(self, tasker, workflow, config_path, basename='config.yaml'):
         """
@@ -10,9 +10,11 @@ from __future__ import unicode_literals
 from atomic_reactor.constants import PLUGIN_KOJI_PARENT_KEY, PLUGIN_RESOLVE_COMPOSES_KEY
 from atomic_reactor.odcs_util import ODCSClient
 from atomic_reactor.plugin import PreBuildPlugin
-from atomic_reactor.plugins.build_orchestrate_build import override_build_kwarg
-from atomic_reactor.plugins.pre_check_and_set_rebuild import is_rebuild
-from atomic_reactor.plugins.pre_reactor_config import get_config
+from atomic_reactor.plugins.build_orchestrate_build import (OrchestrateBuildPlugin,
+                                                            override_build_kwarg)
+from atomic_reactor.plugins.pre_check_and_set_rebuild import (CheckAndSetRebuildPlugin,
+                                                              is_rebuild)
+from atomic_reactor.plugins.pre_reactor_config import ReactorConfigPlugin, get_config
 from datetime import datetime, timedelta
 
 try:
@@ -39,6 +41,8 @@ class ResolveComposesPlugin(PreBuildPlugin):
 
     key = PLUGIN_RESOLVE_COMPOSES_KEY
     is_allowed_to_fail = False
+    reads = (PLUGIN_KOJI_PARENT_KEY, CheckAndSetRebuildPlugin.key, ReactorConfigPlugin.key)
+    writes = (OrchestrateBuildPlugin.key,)
 
     REPO_CONFIG = 'container.yaml'
 
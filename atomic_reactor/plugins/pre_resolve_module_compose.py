@@ -80,6 +80,7 @@ def set_compose_info(workflow, source):
 class ResolveModuleComposePlugin(PreBuildPlugin):
     key = "resolve_module_compose"
     is_allowed_to_fail = False
+    checkpoint_workspace = True
 
     def __init__(self, tasker, workflow,
                  module_name, module_stream, module_version=None,
@@ -96,6 +96,8 @@ class PrePublishSquashPlugin(PrePublishPlugin):
         # loaded in to Docker daemon. If it's set to False it will be loaded.
         new_id = Squash(log=self.log, image=self.image, from_layer=self.from_layer,
                         tag=self.tag, output_path=output_path, load_image=not self.dont_load).run()
+        # docker-squash talks to the daemon on its own
+        self.tasker.image_cache.forget(self.tag, self.image)
 
         if ':' not in new_id:
             # Older versions of the daemon do not include the prefix
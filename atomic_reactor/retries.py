@@ -0,0 +1,305 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Retry policies shared by everything talking to remote services: randomized
+backoff so concurrent builds don't retry in lockstep, transient errors told
+apart from permanent ones, an overall deadline, and circuit breakers which
+hold off a remote host which keeps failing.
+"""
+
+from __future__ import unicode_literals, division
+
+from collections import defaultdict
+import logging
+import random
+import threading
+import time
+
+from atomic_reactor.constants import (RETRY_BREAKER_THRESHOLD, RETRY_BREAKER_RESET,
+                                      RETRY_POLL_JITTER)
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetryMetrics(object):
+    """
+    Attempts, retries and failures, counted per kind of operation
+    """
+
+    def __init__(self):
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def count(self, kind, event):
+        """
+        :param kind: str, kind of operation, e.g. 'docker' or 'git'
+        :param event: str, 'attempts', 'retries', 'failures', 'permanent', 'exhausted',
+                      'deadline' or 'refused'
+        """
+        with self._lock:
+            self._counts[kind][event] += 1
+
+    def get(self):
+        """
+        :return: dict, kind -> dict of event -> count
+        """
+        with self._lock:
+            return dict((kind, dict(events)) for kind, events in self._counts.items())
+
+
+metrics = RetryMetrics()
+
+
+def jitter(seconds, ratio=RETRY_POLL_JITTER):
+    """
+    randomize a poll interval, so pollers started together don't stay in step
+
+    :param seconds: float, poll interval
+    :param ratio: float, largest change as a fraction of seconds
+    :return: float
+    """
+    return seconds * random.uniform(1 - ratio, 1 + ratio)
+
+
+class CircuitOpenError(Exception):
+    """
+    Remote host not tried, its circuit breaker is open
+    """
+
+    def __init__(self, host, remaining):
+        """
+        :param host: str, remote host
+        :param remaining: float, seconds until the host may be tried again
+        """
+        super(CircuitOpenError, self).__init__(
+            "%s failed too many times, not trying it for another %.1f seconds" %
+            (host, remaining))
+        self.host = host
+        self.remaining = remaining
+
+
+class CircuitBreaker(object):
+    """
+    Consecutive failures talking to a remote host; after threshold of them
+    the breaker opens and nobody tries the host until reset seconds passed,
+    attempts fail with CircuitOpenError instead. The next attempt then
+    decides: success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, host, threshold=RETRY_BREAKER_THRESHOLD, reset=RETRY_BREAKER_RESET):
+        self.host = host
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """
+        :return: float, seconds until the host may be tried again, 0 when closed
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            return max(self.opened_at + self.reset - time.time(), 0)
+
+    def is_open(self):
+        """
+        :return: bool, whether attempts to the host are refused
+        """
+        return self.remaining() > 0
+
+    def succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("%s failed %d times in a row, holding off for %s seconds",
+                                   self.host, self.failures, self.reset)
+                self.opened_at = time.time()
+
+
+class CircuitBreakers(object):
+    """
+    Circuit breakers of all remote hosts this process talks to
+    """
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        """
+        :param host: str, remote host
+        :return: CircuitBreaker
+        """
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(host)
+            return self._breakers[host]
+
+
+breakers = CircuitBreakers()
+
+
+class RetryPolicy(object):
+    """
+    How to retry an operation of some kind
+
+    Delays use decorrelated jitter: each one is picked at random between
+    base_delay and three times the previous delay, capped at max_delay.
+    """
+
+    def __init__(self, kind, retries, base_delay, max_delay=None, deadline=None,
+                 is_transient=None):
+        """
+        :param kind: str, kind of operation, used for metrics and logging
+        :param retries: int, how many times to retry after the first attempt
+        :param base_delay: float, shortest delay in seconds between attempts
+        :param max_delay: float, longest delay in seconds between attempts;
+                          by default as long as exponential backoff would get
+        :param deadline: float, seconds after which no more attempts start, or None
+        :param is_transient: callable taking an exception, returning whether
+                             trying again may help; by default every error is
+        """
+        self.kind = kind
+        self.retries = int(retries)
+        self.base_delay = base_delay
+        if max_delay is None:
+            max_delay = base_delay * 2 ** max(self.retries - 1, 0)
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.is_transient = is_transient or (lambda exc: True)
+
+    def attempts(self, remote=None):
+        """
+        :param remote: str, host the operation talks to, for circuit breaking
+        :return: Attempts
+        """
+        return Attempts(self, remote)
+
+    def call(self, function, args=(), kwargs=None, remote=None):
+        """
+        call function until it succeeds or the policy gives up, in which case
+        the last exception is raised
+
+        :param function: callable
+        :param args: tuple, positional arguments for function
+        :param kwargs: dict, keyword arguments for function
+        :param remote: str, host the function talks to, for circuit breaking
+        :return: what function returns, None when no attempt is allowed
+        :raises CircuitOpenError: when the circuit breaker of remote is open
+        """
+        attempts = self.attempts(remote)
+        for _ in attempts:
+            try:
+                result = function(*args, **(kwargs or {}))
+            except Exception as exc:
+                if attempts.retry(exc):
+                    continue
+                raise
+            attempts.succeeded()
+            return result
+
+
+class Attempts(object):
+    """
+    Attempts made under a RetryPolicy, iterate over it to get attempt numbers:
+
+        attempts = policy.attempts(remote)
+        for attempt in attempts:
+            try:
+                ...
+            except SomeError as exc:
+                if attempts.retry(exc):
+                    continue
+                raise
+            attempts.succeeded()
+            break
+
+    Iterating raises CircuitOpenError right away, without waiting, when the
+    circuit breaker of the remote host is open.
+    """
+
+    def __init__(self, policy, remote=None):
+        self.policy = policy
+        self.breaker = breakers.get(remote) if remote else None
+        self.started = time.time()
+        self.delay = policy.base_delay
+        self.attempt = 0
+
+    def __iter__(self):
+        for attempt in range(self.policy.retries + 1):
+            self.attempt = attempt
+            self._check_breaker()
+            metrics.count(self.policy.kind, 'attempts')
+            yield attempt
+
+    def _check_breaker(self):
+        if self.breaker is None:
+            return
+        remaining = self.breaker.remaining()
+        if remaining:
+            logger.info("%s: not trying %s, its circuit breaker is open",
+                        self.policy.kind, self.breaker.host)
+            metrics.count(self.policy.kind, 'refused')
+            raise CircuitOpenError(self.breaker.host, remaining)
+
+    def _next_delay(self):
+        self.delay = min(self.policy.max_delay,
+                         random.uniform(self.policy.base_delay, self.delay * 3))
+        return self.delay
+
+    def retry(self, exc):
+        """
+        record a failed attempt and wait before the next one
+
+        :param exc: exception the attempt failed with
+        :return: bool, whether to try again
+        """
+        kind = self.policy.kind
+        metrics.count(kind, 'failures')
+        if not self.policy.is_transient(exc):
+            # the host answered, it's the request which can't succeed
+            logger.debug("%s: not retrying permanent error %r", kind, exc)
+            metrics.count(kind, 'permanent')
+            return False
+
+        if self.breaker is not None:
+            self.breaker.failed()
+            if self.breaker.is_open():
+                # the host is failing, give up with this error rather than
+                # refusing the next attempt
+                metrics.count(kind, 'exhausted')
+                return False
+        if self.attempt >= self.policy.retries:
+            metrics.count(kind, 'exhausted')
+            return False
+
+        delay = self._next_delay()
+        if self.policy.deadline is not None and \
+                time.time() - self.started + delay > self.policy.deadline:
+            logger.info("%s: not retrying, deadline of %s seconds would pass",
+                        kind, self.policy.deadline)
+            metrics.count(kind, 'deadline')
+            return False
+
+        logger.info("%s: attempt %d failed (%r), retrying in %.1f seconds",
+                    kind, self.attempt + 1, exc, delay)
+        metrics.count(kind, 'retries')
+        time.sleep(delay)
+        return True
+
+    def succeeded(self):
+        if self.breaker is not None:
+            self.breaker.succeeded()
@@ -0,0 +1,259 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Merge plugin timings of an orchestrated build and its worker builds into one
+timeline, and find the chain of plugins which gated the time-to-image.
+"""
+
+from __future__ import unicode_literals, division
+
+import datetime
+import logging
+
+from atomic_reactor.constants import PLUGIN_BUILD_ORCHESTRATE_KEY
+
+
+logger = logging.getLogger(__name__)
+
+ORCHESTRATOR = 'orchestrator'
+# name of the process for builds which did not orchestrate any worker builds
+BUILD = 'build'
+# plugin start and finish are taken from the same clock, allow only for rounding
+PRECISION = datetime.timedelta(milliseconds=1)
+
+
+def parse_timestamp(timestamp):
+    """
+    Parse timestamp stored by BuildPluginsRunner.save_plugin_timestamp
+
+    :param timestamp: str, datetime in ISO 8601 format
+    :return: datetime.datetime
+    """
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.datetime.strptime(timestamp, fmt)
+        except ValueError:
+            continue
+
+    raise ValueError('invalid timestamp: {!r}'.format(timestamp))
+
+
+class TimelineEvent(object):
+    """
+    Single plugin run within a build
+    """
+
+    def __init__(self, process, name, start, duration):
+        """
+        :param process: str, orchestrator or platform of the worker build
+        :param name: str, plugin key
+        :param start: datetime.datetime, when the plugin started
+        :param duration: float, how many seconds the plugin ran
+        """
+        self.process = process
+        self.name = name
+        self.start = start
+        self.duration = duration
+
+    @property
+    def end(self):
+        return self.start + datetime.timedelta(seconds=self.duration)
+
+    def __repr__(self):
+        return 'TimelineEvent({!r}, {!r}, {!r}, {!r})'.format(self.process, self.name,
+                                                              self.start, self.duration)
+
+
+class Timeline(object):
+    """
+    Plugin runs of a build and of the worker builds it orchestrated
+
+    Timestamps of each build are taken from the clock of its own build
+    container, so the workers are only comparable to the orchestrator as
+    far as the clocks of the cluster nodes agree.
+    """
+
+    def __init__(self, root=BUILD):
+        """
+        :param root: str, name of the process running this build
+        """
+        self.root = root
+        self.events = {}  # process -> [TimelineEvent]
+
+    @classmethod
+    def from_workflow(cls, workflow):
+        """
+        Collect plugin timings of workflow and of its worker builds
+
+        :param workflow: DockerBuildWorkflow instance
+        :return: Timeline
+        """
+        annotations = workflow.build_result.annotations or {}
+        worker_builds = annotations.get('worker-builds', {})
+
+        timeline = cls(ORCHESTRATOR if worker_builds else BUILD)
+        timeline.add_process(timeline.root, {
+            'timestamps': workflow.plugins_timestamps,
+            'durations': workflow.plugins_durations,
+        })
+        for platform, worker_annotations in worker_builds.items():
+            timeline.add_process(platform, worker_annotations.get('plugins-metadata', {}))
+
+        return timeline
+
+    @property
+    def workers(self):
+        return sorted(process for process, events in self.events.items()
+                      if process != self.root and events)
+
+    def add_process(self, process, plugins_metadata):
+        """
+        Add plugin runs of a single build
+
+        :param process: str, orchestrator or platform of the worker build
+        :param plugins_metadata: dict, with 'timestamps' and 'durations' maps
+        """
+        timestamps = plugins_metadata.get('timestamps', {})
+        durations = plugins_metadata.get('durations', {})
+
+        events = []
+        for name, timestamp in timestamps.items():
+            duration = durations.get(name)
+            if duration is None:
+                # plugin did not finish
+                continue
+
+            try:
+                start = parse_timestamp(timestamp)
+            except ValueError as exc:
+                logger.warning('ignoring %s plugin %s: %s', process, name, exc)
+                continue
+
+            events.append(TimelineEvent(process, name, start, duration))
+
+        self.events[process] = sorted(events, key=lambda event: event.start)
+
+    def _chain(self, events):
+        """
+        Walk back from the plugin which finished last, always stepping to
+        the plugin which finished last before the current one started
+
+        :param events: list of TimelineEvent, runs of a single build
+        :return: list of TimelineEvent, in order of execution
+        """
+        chain = []
+        candidates = list(events)
+        while candidates:
+            current = max(candidates, key=lambda event: event.end)
+            chain.append(current)
+            candidates = [event for event in candidates
+                          if event.start < current.start and
+                          event.end <= current.start + PRECISION]
+
+        chain.reverse()
+        return chain
+
+    def _end(self, process):
+        return max(event.end for event in self.events[process])
+
+    def get_gating_worker(self):
+        """
+        :return: str, platform of the worker build which finished last, or None
+        """
+        workers = self.workers
+        if not workers:
+            return None
+
+        return max(workers, key=self._end)
+
+    def get_critical_path(self):
+        """
+        Orchestrate build step is replaced by the critical path of the
+        worker build which finished last.
+
+        :return: list of TimelineEvent, in order of execution
+        """
+        path = []
+        gating_worker = self.get_gating_worker()
+        for event in self._chain(self.events.get(self.root, [])):
+            if event.name == PLUGIN_BUILD_ORCHESTRATE_KEY and gating_worker:
+                path.extend(self._chain(self.events[gating_worker]))
+            else:
+                path.append(event)
+
+        return path
+
+    def get_summary(self):
+        """
+        Describe the critical path in a form suitable for annotations
+
+        :return: dict
+        """
+        root_events = self.events.get(self.root, [])
+        duration = None
+        if root_events:
+            duration = (self._end(self.root) - root_events[0].start).total_seconds()
+
+        return {
+            'duration': duration,
+            'gating-platform': self.get_gating_worker(),
+            'plugins': [{
+                'process': event.process,
+                'plugin': event.name,
+                'start': event.start.isoformat(),
+                'duration': event.duration,
+            } for event in self.get_critical_path()],
+        }
+
+    def get_trace(self):
+        """
+        Convert the timeline to Chrome trace event format, one process per
+        build; plugins on the critical path are in 'critical-path' category
+
+        :return: dict, to be serialized as JSON
+        """
+        all_events = [event for events in self.events.values() for event in events]
+        if not all_events:
+            return {'traceEvents': [], 'displayTimeUnit': 'ms'}
+
+        origin = min(event.start for event in all_events)
+        critical = set(id(event) for event in self.get_critical_path())
+
+        def microseconds(delta):
+            return int(delta.total_seconds() * 1000000)
+
+        trace_events = []
+        for pid, process in enumerate([self.root] + self.workers, 1):
+            trace_events.append({
+                'name': 'process_name',
+                'ph': 'M',
+                'pid': pid,
+                'args': {'name': process},
+            })
+
+            # concurrently running plugins must not overlap within one thread
+            lanes = []
+            for event in self.events.get(process, []):
+                for tid, lane_end in enumerate(lanes):
+                    if lane_end <= event.start:
+                        break
+                else:
+                    tid = len(lanes)
+                    lanes.append(None)
+                lanes[tid] = event.end
+
+                trace_events.append({
+                    'name': event.name,
+                    'cat': 'critical-path' if id(event) in critical else 'plugin',
+                    'ph': 'X',
+                    'ts': microseconds(event.start - origin),
+                    'dur': microseconds(datetime.timedelta(seconds=event.duration)),
+                    'pid': pid,
+                    'tid': tid,
+                })
+
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
@@ -8,8 +8,11 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import print_function, unicode_literals
 
+import copy
 import hashlib
 import json
+import random
+import resource
 import jsonschema
 import os
 import re
@@ -26,10 +29,18 @@ import uuid
 import yaml
 import codecs
 import string
+import sys
+import threading
 import time
+from collections import deque, OrderedDict
+from multiprocessing.pool import ThreadPool
 
+import six
+from six.moves import queue
 from six.moves.urllib.parse import urlparse
 
+from atomic_reactor import retries
+from atomic_reactor.retries import RetryPolicy
 from atomic_reactor.constants import (DOCKERFILE_FILENAME, FLATPAK_FILENAME, TOOLS_USED,
                                       INSPECT_CONFIG,
                                       IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR,
@@ -37,12 +48,18 @@ from atomic_reactor.constants import (DOCKERFILE_FILENAME, FLATPAK_FILENAME, TOO
                                       HTTP_CLIENT_STATUS_RETRY, HTTP_REQUEST_TIMEOUT,
                                       MEDIA_TYPE_DOCKER_V2_SCHEMA1, MEDIA_TYPE_DOCKER_V2_SCHEMA2,
                                       MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST, MEDIA_TYPE_OCI_V1,
-                                      MEDIA_TYPE_OCI_V1_INDEX, GIT_MAX_RETRIES, GIT_BACKOFF_FACTOR)
+                                      MEDIA_TYPE_OCI_V1_INDEX, GIT_MAX_RETRIES, GIT_BACKOFF_FACTOR,
+                                      GIT_RETRY_DEADLINE,
+                                      COMMAND_LOG_TAIL_LINES, REGISTRY_CACHE_ENTRIES,
+                                      REGISTRY_CACHE_MAX_SIZE, CHECKSUM_BLOCKSIZE,
+                                      CHECKSUM_CACHE_ENTRIES, EXPORT_READ_AHEAD_CHUNKS,
+                                      DOCKERFILE_RACY_SECONDS)
 
 from dockerfile_parse import DockerfileParser
 from pkg_resources import resource_stream
 
 from importlib import import_module
+from requests.structures import CaseInsensitiveDict
 from requests.utils import guess_json_utf
 
 logger = logging.getLogger(__name__)
@@ -171,9 +188,18 @@ def figure_out_build_file(absolute_path, local_path=None):
 
 
 class CommandResult(object):
-    def __init__(self):
-        self._logs = []
-        self._parsed_logs = []
+    def __init__(self, logs_path=None, tail_lines=COMMAND_LOG_TAIL_LINES):
+        """
+        :param logs_path: str, file to write the whole log to while parsing it;
+                          when set, only the last tail_lines log lines and
+                          decoded items are kept in memory
+        :param tail_lines: int, how many lines to keep in memory when logs_path is set
+        """
+        maxlen = tail_lines if logs_path else None
+        self._logs = deque(maxlen=maxlen)
+        self._parsed_logs = deque(maxlen=maxlen)
+        self._logs_path = logs_path
+        self._logs_file = open(logs_path, 'wb') if logs_path else None
         self._error = None
         self._error_detail = None
 
@@ -194,6 +220,11 @@ class CommandResult(object):
         for l in line.splitlines():
             l = l.strip()
             self._logs.append(l)
+            if self._logs_file:
+                if isinstance(l, six.text_type):
+                    self._logs_file.write(l.encode('utf-8') + b'\n')
+                else:
+                    self._logs_file.write(l + b'\n')
             if l:
                 logger.debug(l)
 
@@ -203,13 +234,31 @@ class CommandResult(object):
             if self._error:
                 logger.error(item)
 
+    def close(self):
+        """
+        Finish writing the log file, if any
+        """
+        if self._logs_file:
+            self._logs_file.close()
+            self._logs_file = None
+
     @property
     def parsed_logs(self):
-        return self._parsed_logs
+        return list(self._parsed_logs)
 
     @property
     def logs(self):
-        return self._logs
+        """
+        :return: list, log lines; only the last ones when logs_path is set
+        """
+        return list(self._logs)
+
+    @property
+    def logs_path(self):
+        """
+        :return: str, path to the file with the whole log, or None
+        """
+        return self._logs_path
 
     @property
     def error(self):
@@ -223,22 +272,28 @@ class CommandResult(object):
         return bool(self.error) or bool(self.error_detail)
 
 
-def wait_for_command(logs_generator):
+def wait_for_command(logs_generator, logs_path=None):
     """
     Create a CommandResult from given iterator
 
+    :param logs_generator: iterator of log items
+    :param logs_path: str, file to write the whole log to, see CommandResult
     :return: CommandResult
     """
     logger.info("wait_for_command")
-    cr = CommandResult()
-    for item in logs_generator:
-        cr.parse_item(item)
+    cr = CommandResult(logs_path=logs_path)
+    try:
+        for item in logs_generator:
+            cr.parse_item(item)
+    finally:
+        cr.close()
 
     logger.info("no more logs")
     return cr
 
 
-def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES):
+def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES,
+                   retry_deadline=GIT_RETRY_DEADLINE):
     """
     clone provided git repo to target_dir, optionally checkout provided commit
 
@@ -246,10 +301,9 @@ def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES
     :param target_dir: str, filesystem path where the repo should be cloned
     :param commit: str, commit to checkout, SHA-1 or ref
     :param retry_times: int, number of retries for git clone
+    :param retry_deadline: float, seconds after which no more clone attempts start
     :return: str, commit ID of HEAD
     """
-    retry_delay = GIT_BACKOFF_FACTOR
-
     commit = commit or "master"
     logger.info("cloning git repo '%s'", git_url)
     logger.debug("url = '%s', dir = '%s', commit = '%s'",
@@ -258,18 +312,19 @@ def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES
     cmd = ["git", "clone", git_url, quote(target_dir)]
 
     logger.debug("cloning '%s'", cmd)
-    for counter in range(retry_times + 1):
-        try:
-            # we are using check_output, even though we aren't using
-            # the return value, but we will get 'output' in exception
-            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            break
-        except subprocess.CalledProcessError as exc:
-            if counter != retry_times:
-                logger.info("retrying command '%s':\n '%s'", cmd, exc.output)
-                time.sleep(retry_delay * (2 ** counter))
-            else:
-                raise
+
+    def is_transient(exc):
+        if isinstance(exc, subprocess.CalledProcessError):
+            logger.info("command '%s' failed:\n '%s'", cmd, exc.output)
+            return True
+        return False
+
+    policy = RetryPolicy('git', retry_times, GIT_BACKOFF_FACTOR, deadline=retry_deadline,
+                         is_transient=is_transient)
+    # we are using check_output, even though we aren't using
+    # the return value, but we will get 'output' in exception
+    policy.call(subprocess.check_output, (cmd,), {'stderr': subprocess.STDOUT},
+                remote=urlparse(git_url).hostname)
 
     cmd = ["git", "reset", "--hard", commit]
     logger.debug("checking out branch '%s'", cmd)
@@ -437,44 +492,187 @@ def _process_plugin_substitution(mapping, key_parts, value):
                            plugin_name, plugins_num)
 
 
+class ChecksumCache(object):
+    """
+    Checksums of files, keyed by device, inode, size and modification time,
+    so a file which didn't change is never read again
+    """
+
+    def __init__(self, max_entries=CHECKSUM_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._checksums = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path):
+        st = os.stat(path)
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1e9)
+        return st.st_dev, st.st_ino, st.st_size, mtime_ns
+
+    def get(self, key, algorithms):
+        """
+        :return: dict, algorithm -> hexdigest for the algorithms known for key
+        """
+        with self._lock:
+            known = self._checksums.get(key, {})
+            return dict((algorithm, known[algorithm]) for algorithm in algorithms
+                        if algorithm in known)
+
+    def update(self, key, checksums):
+        with self._lock:
+            known = self._checksums.pop(key, {})
+            known.update(checksums)
+            self._checksums[key] = known
+            while len(self._checksums) > self.max_entries:
+                self._checksums.popitem(last=False)
+
+
+checksum_cache = ChecksumCache()
+
+
 def get_checksums(path, algorithms):
     """
     Compute a checksum(s) of given file using specified algorithms.
 
+    All the algorithms are computed while reading the file once. Results are
+    remembered, so asking again about a file which didn't change doesn't read it.
+
     :param path: path to file
-    :param algorithms: list of cryptographic hash functions, currently supported: md5, sha256
+    :param algorithms: list of cryptographic hash functions, any supported by hashlib
     :return: dictionary
     """
     if not algorithms:
         return {}
 
-    compute_md5 = 'md5' in algorithms
-    compute_sha256 = 'sha256' in algorithms
-
-    if compute_md5:
-        md5 = hashlib.md5()
-    if compute_sha256:
-        sha256 = hashlib.sha256()
-    blocksize = 65536
-    with open(path, mode='rb') as f:
-        buf = f.read(blocksize)
-        while len(buf) > 0:
-            if compute_md5:
-                md5.update(buf)
-            if compute_sha256:
-                sha256.update(buf)
-            buf = f.read(blocksize)
+    key = ChecksumCache.key(path)
+    hexdigests = checksum_cache.get(key, algorithms)
+    missing = [algorithm for algorithm in algorithms if algorithm not in hexdigests]
+    if missing:
+        hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in missing)
+        with open(path, mode='rb') as f:
+            buf = f.read(CHECKSUM_BLOCKSIZE)
+            while len(buf) > 0:
+                for h in hashes.values():
+                    h.update(buf)
+                buf = f.read(CHECKSUM_BLOCKSIZE)
+
+        computed = dict((algorithm, h.hexdigest()) for algorithm, h in hashes.items())
+        checksum_cache.update(key, computed)
+        hexdigests.update(computed)
+    else:
+        logger.debug('using known checksums of %s', path)
 
     checksums = {}
-    if compute_md5:
-        checksums['md5sum'] = md5.hexdigest()
-        logger.debug('md5sum: %s', checksums['md5sum'])
-    if compute_sha256:
-        checksums['sha256sum'] = sha256.hexdigest()
-        logger.debug('sha256sum: %s', checksums['sha256sum'])
+    for algorithm in algorithms:
+        checksums['{}sum'.format(algorithm)] = hexdigests[algorithm]
+        logger.debug('%ssum: %s', algorithm, hexdigests[algorithm])
     return checksums
 
 
+class HashingWriter(object):
+    """
+    File-like object writing into a file and computing its size and checksums
+    on the way; once closed, the checksums are remembered so get_checksums
+    doesn't have to read the file again
+    """
+
+    def __init__(self, path, algorithms=('md5', 'sha256')):
+        """
+        :param path: str, path to file to create
+        :param algorithms: list of cryptographic hash functions, any supported by hashlib
+        """
+        self.name = path
+        self.size = 0
+        self._hashes = OrderedDict((algorithm, hashlib.new(algorithm))
+                                   for algorithm in algorithms)
+        self._fp = open(path, mode='wb')
+
+    @property
+    def closed(self):
+        return self._fp.closed
+
+    def write(self, data):
+        self._fp.write(data)
+        for h in self._hashes.values():
+            h.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self._fp.close()
+        checksum_cache.update(ChecksumCache.key(self.name), self.hexdigests())
+
+    def hexdigests(self):
+        """
+        :return: dict, algorithm -> hexdigest of data written so far
+        """
+        return dict((algorithm, h.hexdigest()) for algorithm, h in self._hashes.items())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_ahead(stream, chunk_size, depth=EXPORT_READ_AHEAD_CHUNKS):
+    """
+    Read stream on a separate thread, keeping up to depth chunks ready for
+    the consumer, so reading overlaps with processing the data
+
+    :param stream: file-like object to read from
+    :param chunk_size: int, bytes to read at once
+    :param depth: int, maximum number of chunks read but not consumed yet
+    :return: generator of chunks of data
+    """
+    chunks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def reader():
+        try:
+            data = stream.read(chunk_size)
+            while data and not stop.is_set():
+                put(data)
+                data = stream.read(chunk_size)
+            put(None)
+        except Exception:
+            put(sys.exc_info())
+
+    thread = threading.Thread(target=reader, name='read-ahead')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                return
+            if isinstance(item, tuple):
+                six.reraise(*item)
+            yield item
+    finally:
+        # the consumer may stop early, let the reader finish too
+        stop.set()
+        thread.join()
+
+
 def get_docker_architecture(tasker):
     docker_version = tasker.get_version()
     host_arch = docker_version['Arch']
@@ -669,11 +867,208 @@ class Dockercfg(object):
             return {}
 
 
+class RegistryContentCache(object):
+    """
+    Cache of registry content addressed by digest
+
+    Manifests and blobs fetched by digest never change, so they are kept
+    in memory (least recently used entries are dropped first) and, when
+    path is set, also stored in that directory. Anything fetched by tag
+    is never cached. Entries are kept per registry and repository: content
+    found in one of them doesn't prove it exists in another.
+    """
+
+    # /v2/<repository>/(manifests|blobs)/<digest>
+    url_re = re.compile(r'^/v2/(.+)/(manifests|blobs)/([a-z0-9]+:[a-f0-9]+)$')
+    cached_headers = ('Content-Type', 'Docker-Content-Digest')
+
+    def __init__(self, path=None, max_entries=REGISTRY_CACHE_ENTRIES,
+                 max_size=REGISTRY_CACHE_MAX_SIZE):
+        """
+        :param path: str, directory to store the content in, or None
+        :param max_entries: int, how many entries to keep in memory
+        :param max_size: int, content larger than this is not cached
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path and not os.path.isdir(path):
+            os.makedirs(path)
+
+    def key(self, registry, relative_url):
+        """
+        :param registry: str, registry the content is fetched from
+        :param relative_url: str, url of the content in the registry
+        :return: tuple, registry, repository, object type and digest, or
+                 None when the url doesn't refer to content by digest
+        """
+        match = self.url_re.match(relative_url.split('?', 1)[0])
+        if not match:
+            return None
+        return (registry,) + match.groups()
+
+    def _file_path(self, key):
+        location = hashlib.sha256('/'.join(key[:2]).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, '{}-{}-{}'.format(location, key[2],
+                                                         key[3].replace(':', '-')))
+
+    def _load(self, key):
+        file_path = self._file_path(key)
+        try:
+            with open(file_path + '.json') as f:
+                headers = json.load(f)
+            with open(file_path, 'rb') as f:
+                content = f.read()
+        except (IOError, OSError, ValueError):
+            return None
+        return content, headers
+
+    def _store(self, key, content, headers):
+        file_path = self._file_path(key)
+        try:
+            # write the content first, entries without metadata are ignored
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            with open(file_path + '.json', 'w') as f:
+                json.dump(headers, f)
+        except (IOError, OSError) as ex:
+            logger.warning("failed to store %s in registry cache: %r", key[3], ex)
+
+    def get(self, registry, relative_url):
+        """
+        :param registry: str, registry the content is fetched from
+        :param relative_url: str, url of the content in the registry
+        :return: tuple, content and dict of headers, or None
+        """
+        key = self.key(registry, relative_url)
+        if key is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None and self.path:
+                entry = self._load(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def set(self, registry, relative_url, content, headers):
+        key = self.key(registry, relative_url)
+        if key is None or content is None or len(content) > self.max_size:
+            return
+
+        headers = dict((name, headers[name]) for name in self.cached_headers
+                       if name in headers)
+        with self._lock:
+            self._entries[key] = (content, headers)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._store(key, content, headers)
+
+
+class RegistryTokenCache(object):
+    """
+    Bearer tokens issued by registry token servers, kept until they expire
+
+    Tokens are keyed by realm, service, scopes and the user they were
+    issued to. The token server each registry uses and the scopes it asked
+    for are remembered too, so new sessions can send tokens without
+    waiting for a 401 response.
+    """
+
+    # don't use tokens which expire in less than this many seconds
+    expiry_margin = 10
+    # lifetime of tokens when the token server doesn't say
+    default_expires_in = 60
+
+    def __init__(self):
+        self._tokens = {}
+        self._servers = {}
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    def get_server(self, registry):
+        """
+        :return: tuple, realm and service of the token server used by
+                 registry, or None when not known yet
+        """
+        with self._lock:
+            return self._servers.get(registry)
+
+    def set_server(self, registry, server):
+        with self._lock:
+            self._servers[registry] = server
+
+    def get_scope(self, registry, repository, kind):
+        """
+        :return: str, scope the registry last asked for when accessing
+                 repository, or None
+        """
+        with self._lock:
+            return self._scopes.get((registry, repository, kind))
+
+    def set_scope(self, registry, repository, kind, scope):
+        with self._lock:
+            self._scopes[(registry, repository, kind)] = scope
+
+    def get(self, key):
+        """
+        :return: str, token, or None when there is no valid token
+        """
+        with self._lock:
+            token, expires = self._tokens.get(key, (None, 0))
+            if expires - self.expiry_margin < time.time():
+                self._tokens.pop(key, None)
+                return None
+            return token
+
+    def set(self, key, token, expires_in=None):
+        expires = time.time() + (expires_in or self.default_expires_in)
+        with self._lock:
+            self._tokens[key] = (token, expires)
+
+
+# tokens are shared by all sessions, most calls create their own session
+registry_tokens = RegistryTokenCache()
+
+
 class RegistrySession(object):
-    def __init__(self, registry, insecure=False, dockercfg_path=None):
+    # /v2/<repository>/(manifests|blobs|tags)/...
+    repository_re = re.compile(r'^/v2/(.+?)/(manifests|blobs|tags)/')
+    # name="value" pairs in WWW-Authenticate header
+    challenge_param_re = re.compile(r'(\w+)="([^"]*)"')
+    # kind of access -> scope action it needs
+    kind_actions = {'read': 'pull', 'write': 'push', 'delete': 'delete'}
+
+    def __init__(self, registry, insecure=False, dockercfg_path=None, content_cache=None,
+                 repositories=None, actions=('pull', 'push')):
+        """
+        :param registry: str, registry hostname or URI
+        :param insecure: bool, when True registry's cert is not verified
+        :param dockercfg_path: str, dirname of .dockercfg location
+        :param content_cache: RegistryContentCache, used for content fetched by digest
+        :param repositories: list of str, repositories the session will access;
+                             registries using token authentication are asked
+                             for a single token covering all of them
+        :param actions: tuple of str, scope actions to ask for in that token
+        """
         self.registry = registry
         self._resolved = None
         self.insecure = insecure
+        self.content_cache = content_cache
+        self.repositories = list(repositories or [])
+        self.actions = tuple(actions)
 
         self.auth = None
         if dockercfg_path:
@@ -684,6 +1079,10 @@ class RegistrySession(object):
             if username and password:
                 self.auth = requests.auth.HTTPBasicAuth(username, password)
 
+        # realm and service of the token server, once the registry asked for a token
+        self._token_server = registry_tokens.get_server(registry)
+        self._broad_token_requested = False
+
         self._fallback = None
         if re.match('http(s)?://', self.registry):
             self._base = self.registry
@@ -697,33 +1096,179 @@ class RegistrySession(object):
 
         self.session = get_retrying_requests_session()
 
-    def _do(self, f, relative_url, *args, **kwargs):
-        kwargs['auth'] = self.auth
+    def _request(self, f, relative_url, *args, **kwargs):
+        kwargs.setdefault('auth', self.auth)
         kwargs['verify'] = not self.insecure
-        if self._fallback:
+        # the session may be shared by several threads, don't rely on
+        # the attributes staying the same during the request
+        fallback = self._fallback
+        if fallback:
             try:
                 res = f(self._base + relative_url, *args, **kwargs)
                 self._fallback = None  # don't fallback after one success
                 return res
             except (SSLError, ConnectionError):
-                self._base = self._fallback
+                self._base = fallback
                 self._fallback = None
         return f(self._base + relative_url, *args, **kwargs)
 
+    @staticmethod
+    def _access_kind(method):
+        if method in ('get', 'head'):
+            return 'read'
+        if method == 'delete':
+            return 'delete'
+        return 'write'
+
+    def _token_key(self, scopes):
+        username = self.auth.username if self.auth else None
+        return self._token_server + (tuple(scopes), username)
+
+    def _fetch_token(self, scopes):
+        key = self._token_key(scopes)
+        token = registry_tokens.get(key)
+        if token:
+            return token
+
+        realm, service = self._token_server
+        params = [('scope', scope) for scope in scopes]
+        if service:
+            params.append(('service', service))
+        logger.debug("requesting token from %s for %s", realm, scopes)
+        response = self.session.get(realm, params=params, auth=self.auth,
+                                    verify=not self.insecure)
+        response.raise_for_status()
+        result = response.json()
+        token = result.get('token') or result.get('access_token')
+        registry_tokens.set(key, token, result.get('expires_in'))
+        return token
+
+    def _cached_token(self, relative_url, kind):
+        """
+        :return: str, token to send with the request without waiting for
+                 the registry to ask for it, or None
+        """
+        if self._token_server is None:
+            return None
+
+        match = self.repository_re.match(relative_url)
+        if not match:
+            return None
+        repository = match.group(1)
+
+        scope = registry_tokens.get_scope(self.registry, repository, kind)
+        if scope:
+            return registry_tokens.get(self._token_key(scope.split(' ')))
+
+        if self.kind_actions[kind] in self.actions and repository in self.repositories:
+            return self._broad_token()
+
+        return None
+
+    def _broad_token(self):
+        """
+        Token for all the repositories passed to the constructor, requested
+        at most once per session; when the token server grants less, the
+        registry asks for the exact scope needed
+        """
+        actions = ','.join(self.actions)
+        scopes = ['repository:{}:{}'.format(repository, actions)
+                  for repository in sorted(set(self.repositories))]
+        token = registry_tokens.get(self._token_key(scopes))
+        if token or self._broad_token_requested:
+            return token
+
+        self._broad_token_requested = True
+        try:
+            return self._fetch_token(scopes)
+        except (HTTPError, RetryError, Timeout, ValueError) as ex:
+            logger.warning("failed to get token for %s: %r", self.repositories, ex)
+            return None
+
+    def _authenticate(self, response, relative_url, kind):
+        """
+        Get a token as asked for by a 401 response
+
+        :return: str, token, or None when the registry doesn't use tokens
+        """
+        challenge = response.headers.get('WWW-Authenticate', '')
+        if not challenge.lower().startswith('bearer '):
+            return None
+
+        params = dict(self.challenge_param_re.findall(challenge))
+        if 'realm' not in params:
+            return None
+
+        self._token_server = (params['realm'], params.get('service'))
+        registry_tokens.set_server(self.registry, self._token_server)
+        scope = params.get('scope')
+        if not scope:
+            return self._fetch_token([])
+
+        match = self.repository_re.match(relative_url)
+        if match:
+            registry_tokens.set_scope(self.registry, match.group(1), kind, scope)
+
+        return self._fetch_token(scope.split(' '))
+
+    def _with_token(self, token, kwargs):
+        kwargs = dict(kwargs)
+        kwargs['headers'] = dict(kwargs.get('headers') or {})
+        kwargs['headers']['Authorization'] = 'Bearer {}'.format(token)
+        kwargs['auth'] = None
+        return kwargs
+
+    def _do(self, method, relative_url, *args, **kwargs):
+        f = getattr(self.session, method)
+        kind = self._access_kind(method)
+
+        token = self._cached_token(relative_url, kind)
+        if token:
+            response = self._request(f, relative_url, *args, **self._with_token(token, kwargs))
+        else:
+            response = self._request(f, relative_url, *args, **kwargs)
+
+        if response.status_code != requests.codes.unauthorized:
+            return response
+
+        token = self._authenticate(response, relative_url, kind)
+        if not token:
+            return response
+
+        return self._request(f, relative_url, *args, **self._with_token(token, kwargs))
+
     def get(self, relative_url, data=None, **kwargs):
-        return self._do(self.session.get, relative_url, **kwargs)
+        if self.content_cache is None:
+            return self._do('get', relative_url, **kwargs)
+
+        cached = self.content_cache.get(self.registry, relative_url)
+        if cached is not None:
+            content, headers = cached
+            response = requests.Response()
+            response.status_code = requests.codes.ok
+            response.url = self._base + relative_url
+            response.headers = CaseInsensitiveDict(headers)
+            response.headers['Content-Length'] = str(len(content))
+            response._content = content
+            return response
+
+        response = self._do('get', relative_url, **kwargs)
+        if response.status_code == requests.codes.ok:
+            self.content_cache.set(self.registry, relative_url, response.content,
+                                   response.headers)
+        return response
 
     def head(self, relative_url, data=None, **kwargs):
-        return self._do(self.session.head, relative_url, **kwargs)
+        return self._do('head', relative_url, **kwargs)
 
     def post(self, relative_url, data=None, **kwargs):
-        return self._do(self.session.post, relative_url, data=data, **kwargs)
+        return self._do('post', relative_url, data=data, **kwargs)
 
     def put(self, relative_url, data=None, **kwargs):
-        return self._do(self.session.put, relative_url, data=data, **kwargs)
+        return self._do('put', relative_url, data=data, **kwargs)
 
     def delete(self, relative_url, **kwargs):
-        return self._do(self.session.delete, relative_url, **kwargs)
+        return self._do('delete', relative_url, **kwargs)
 
 
 class ManifestDigest(dict):
@@ -785,7 +1330,8 @@ def get_digests_map_from_annotations(digests_str):
     return digests
 
 
-def query_registry(registry_session, image, digest=None, version='v1', is_blob=False):
+def query_registry(registry_session, image, digest=None, version='v1', is_blob=False,
+                   head=False):
     """Return manifest digest for image.
 
     :param registry_session: RegistrySession
@@ -793,6 +1339,7 @@ def query_registry(registry_session, image, digest=None, version='v1', is_blob=F
     :param digest: str, digest of the image manifest
     :param version: str, which manifest schema version to fetch digest
     :param is_blob: bool, read blob config if set to True
+    :param head: bool, only fetch the headers, not the content
 
     :return: requests.Response object
     """
@@ -807,14 +1354,41 @@ def query_registry(registry_session, image, digest=None, version='v1', is_blob=F
     url = '/v2/{}/{}/{}'.format(context, object_type, reference)
     logger.debug("query_registry: querying {}, headers: {}".format(url, headers))
 
-    response = registry_session.get(url, headers=headers)
+    if head:
+        response = registry_session.head(url, headers=headers, allow_redirects=True)
+    else:
+        response = registry_session.get(url, headers=headers)
     response.raise_for_status()
 
     return response
 
 
+def _probe_manifest(registry_session, image, version, head=False):
+    """
+    Query the manifest of image for a single media type
+
+    :return: tuple, requests.Response or None, and the exception raised
+             by the query or None
+    """
+    try:
+        response = query_registry(registry_session, image, digest=None,
+                                  version=version, head=head)
+        if head and 'Content-Type' not in response.headers:
+            # the media type has to be guessed from the content
+            response = query_registry(registry_session, image, digest=None,
+                                      version=version)
+        return response, None
+    except (HTTPError, RetryError, Timeout) as ex:
+        response = getattr(ex, 'response', None)
+        if (head and response is not None and
+                response.status_code == requests.codes.method_not_allowed):
+            return _probe_manifest(registry_session, image, version)
+        return None, ex
+
+
 def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
-                         versions=('v1', 'v2', 'v2_list', 'oci', 'oci_index'), require_digest=True):
+                         versions=('v1', 'v2', 'v2_list', 'oci', 'oci_index'), require_digest=True,
+                         registry_session=None, head=False, max_workers=None):
     """Return manifest digest for image.
 
     :param image: ImageName, the remote image to inspect
@@ -825,11 +1399,31 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
     :param versions: tuple, which manifest schema versions to fetch digest
     :param require_digest: bool, when True exception is thrown if no digest is
                                  set in the headers.
+    :param registry_session: RegistrySession, session to reuse; a new one
+                             is created when not set
+    :param head: bool, use HEAD requests instead of downloading manifests
+    :param max_workers: int, query the media types concurrently on up to
+                        this many threads
 
     :return: dict, versions mapped to their digest
     """
 
-    registry_session = RegistrySession(registry, insecure=insecure, dockercfg_path=dockercfg_path)
+    if registry_session is None:
+        registry_session = RegistrySession(registry, insecure=insecure,
+                                           dockercfg_path=dockercfg_path)
+
+    if max_workers and len(versions) > 1:
+        thread_pool = ThreadPool(min(max_workers, len(versions)))
+        try:
+            results = thread_pool.map(
+                lambda version: _probe_manifest(registry_session, image, version, head=head),
+                versions)
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+    else:
+        results = (_probe_manifest(registry_session, image, version, head=head)
+                   for version in versions)
 
     digests = {}
     # If all of the media types return a 404 NOT_FOUND status, then we rethrow
@@ -838,16 +1432,17 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
     # This is interesting for the Pulp "retry until the manifest shows up" case.
     all_not_found = True
     saved_not_found = None
-    for version in versions:
+    for version, (response, ex) in zip(versions, results):
         media_type = get_manifest_media_type(version)
         headers = {'Accept': media_type}
 
-        try:
-            response = query_registry(
-                registry_session, image, digest=None,
-                version=version)
+        if ex is None:
             all_not_found = False
-        except (HTTPError, RetryError, Timeout) as ex:
+        else:
+            if getattr(ex, 'response', None) is None:
+                # e.g. timeouts, the registry didn't answer
+                raise ex
+
             if ex.response.status_code == requests.codes.not_found:
                 saved_not_found = ex
             else:
@@ -869,7 +1464,7 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
                   ex.response.status_code == requests.codes.not_acceptable):
                 continue
             else:
-                raise
+                raise ex
 
         received_media_type = None
         try:
@@ -924,7 +1519,7 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
 
 
 def get_config_from_registry(image, registry, digest, insecure=False,
-                             dockercfg_path=None, version='v2'):
+                             dockercfg_path=None, version='v2', content_cache=None):
     """Return image config by digest
 
     :param image: ImageName, the remote image to inspect
@@ -934,10 +1529,12 @@ def get_config_from_registry(image, registry, digest, insecure=False,
     :param insecure: bool, when True registry's cert is not verified
     :param dockercfg_path: str, dirname of .dockercfg location
     :param version: str, which manifest schema versions to fetch digest
+    :param content_cache: RegistryContentCache, manifests and configs already fetched
 
     :return: dict, versions mapped to their digest
     """
-    registry_session = RegistrySession(registry, insecure=insecure, dockercfg_path=dockercfg_path)
+    registry_session = RegistrySession(registry, insecure=insecure, dockercfg_path=dockercfg_path,
+                                       content_cache=content_cache)
 
     response = query_registry(
         registry_session, image, digest=digest, version=version)
@@ -958,6 +1555,116 @@ def get_config_from_registry(image, registry, digest, insecure=False,
     return blob_config
 
 
+class CachingDockerfileParser(DockerfileParser):
+    """
+    DockerfileParser parsing the Dockerfile once: its content and the views
+    derived from it (structure, labels, envs, baseimage) are remembered until
+    the Dockerfile changes. Changes made through the parser are written to
+    the file; changes made to the file by anything else are noticed from its
+    size and modification time, and for recently modified files, by comparing
+    the content.
+    """
+
+    cached_views = ('structure', 'labels', 'envs', 'baseimage')
+
+    def __init__(self, *args, **kwargs):
+        self._views = {}
+        self._known_file = None
+        super(CachingDockerfileParser, self).__init__(*args, **kwargs)
+
+    def _file_key(self):
+        if getattr(self, 'fileobj', None) is not None:
+            return None
+        try:
+            return ChecksumCache.key(self.dockerfile_path)
+        except OSError:
+            return None
+
+    def _check_file(self):
+        """
+        forget the content and views when the Dockerfile changed
+        """
+        key = self._file_key()
+        if key is None:
+            # nothing to compare with, don't trust anything remembered
+            self.cached_content = ''
+            self._views = {}
+        elif key != self._known_file or time.time() - key[-1] / 1e9 < DOCKERFILE_RACY_SECONDS:
+            # modification time granularity may hide a change made just now
+            with open(self.dockerfile_path, 'rb') as f:
+                content = f.read().decode('utf-8')
+            if content != self.cached_content:
+                logger.debug('%s changed, parsing it again', self.dockerfile_path)
+                self.cached_content = content
+                self._views = {}
+        self._known_file = key
+
+    def _changed(self):
+        self._views = {}
+        self._known_file = self._file_key()
+
+    def _view(self, name):
+        self._check_file()
+        if name not in self._views:
+            self._views[name] = getattr(super(CachingDockerfileParser, self), name)
+        value = self._views[name]
+        # hand out copies, so callers can't change what is remembered
+        if hasattr(value, 'parser'):
+            # Labels and Envs write changes through to the parser
+            return type(value)(dict(value), self)
+        return copy.deepcopy(value)
+
+    def _set(self, name, value):
+        getattr(DockerfileParser, name).__set__(self, value)
+        self._changed()
+
+    @property
+    def lines(self):
+        self._check_file()
+        return super(CachingDockerfileParser, self).lines
+
+    @lines.setter
+    def lines(self, lines):
+        self._set('lines', lines)
+
+    @property
+    def content(self):
+        self._check_file()
+        return super(CachingDockerfileParser, self).content
+
+    @content.setter
+    def content(self, content):
+        self._set('content', content)
+
+    @property
+    def structure(self):
+        return self._view('structure')
+
+    @property
+    def labels(self):
+        return self._view('labels')
+
+    @labels.setter
+    def labels(self, labels):
+        self._set('labels', labels)
+
+    @property
+    def envs(self):
+        return self._view('envs')
+
+    @envs.setter
+    def envs(self, envs):
+        self._set('envs', envs)
+
+    @property
+    def baseimage(self):
+        return self._view('baseimage')
+
+    @baseimage.setter
+    def baseimage(self, new_image):
+        self._set('baseimage', new_image)
+
+
 def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, parent_env=None):
     """
     Wrapper for dockerfile_parse's DockerfileParser that takes into account
@@ -969,6 +1676,10 @@ def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, par
     :param env_replace: bool, replace ENV declarations as part of DockerfileParser evaluation
     :param parent_env: dict, parent ENV key:value pairs to be inherited
 
+    When workflow is given, the parser is shared by everything asking for
+    the same Dockerfile during the build, so it is only parsed again after
+    it changes; cache_content doesn't apply then.
+
     :return: DockerfileParser object instance
     """
 
@@ -1006,8 +1717,17 @@ def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, par
             except KeyError:
                 logger.debug("Parent Environment not found, not applied to Dockerfile")
 
+    parsers = getattr(workflow, 'dockerfile_parsers', None)
+    parser_class = DockerfileParser
+    if isinstance(parsers, dict):
+        key = (df_path, env_replace, tuple(sorted(p_env.items())))
+        if key in parsers:
+            return parsers[key]
+        parser_class = CachingDockerfileParser
+        cache_content = True
+
     try:
-        dfparser = DockerfileParser(
+        dfparser = parser_class(
             df_path,
             cache_content=cache_content,
             env_replace=env_replace,
@@ -1016,12 +1736,14 @@ def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, par
     except TypeError:
         logger.debug("Old version of dockerfile-parse detected, unable to set inherited parent "
                      "ENVs")
-        dfparser = DockerfileParser(
+        dfparser = parser_class(
             df_path,
             cache_content=cache_content,
             env_replace=env_replace,
         )
 
+    if isinstance(parsers, dict):
+        parsers[key] = dfparser
     return dfparser
 
 
@@ -1099,13 +1821,98 @@ class SessionWithTimeout(requests.Session):
 
     def request(self, *args, **kwargs):
         kwargs.setdefault('timeout', HTTP_REQUEST_TIMEOUT)
+        count_call('http_requests')
         return super(SessionWithTimeout, self).request(*args, **kwargs)
 
 
+_call_counts = {
+    'http_requests': 0,
+    'docker_api_calls': 0,
+}
+_call_counts_lock = threading.Lock()
+
+
+def count_call(kind):
+    """
+    count a call made to a remote service, for resource accounting
+
+    :param kind: str, 'http_requests' or 'docker_api_calls'
+    """
+    with _call_counts_lock:
+        _call_counts[kind] += 1
+
+
+def get_resource_usage():
+    """
+    get resources used by this process so far
+
+    Bytes read and written are only available when /proc/self/io is readable.
+
+    :return: dict
+    """
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    usage = {
+        'cpu_user': rusage.ru_utime,
+        'cpu_system': rusage.ru_stime,
+        'max_rss': rusage.ru_maxrss,
+    }
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name in ('read_bytes', 'write_bytes'):
+                    usage[name] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+
+    with _call_counts_lock:
+        usage.update(_call_counts)
+    return usage
+
+
+def get_resource_usage_delta(start, end):
+    """
+    compute resources used between two get_resource_usage() snapshots
+
+    :param start: dict, snapshot taken first
+    :param end: dict, snapshot taken last
+    :return: dict, CPU user/system time in seconds, peak RSS growth in kB,
+             bytes read/written and number of HTTP requests and docker API calls
+    """
+    delta = {}
+    for name, value in end.items():
+        if name not in start:
+            continue
+        if name == 'max_rss':
+            delta['max_rss_delta'] = value - start[name]
+        elif isinstance(value, float):
+            delta[name] = round(value - start[name], 3)
+        else:
+            delta[name] = value - start[name]
+    return delta
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 Retry picking backoff times at random, so clients which failed
+    together don't retry together, and counting retries in retries.metrics
+    """
+
+    def get_backoff_time(self):
+        backoff = super(JitteredRetry, self).get_backoff_time()
+        if backoff <= self.backoff_factor:
+            return backoff
+        return random.uniform(self.backoff_factor, backoff)
+
+    def increment(self, *args, **kwargs):
+        retries.metrics.count('http', 'retries')
+        return super(JitteredRetry, self).increment(*args, **kwargs)
+
+
 def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
                                   times=HTTP_MAX_RETRIES, delay=HTTP_BACKOFF_FACTOR,
                                   method_whitelist=None):
-    retry = Retry(
+    retry = JitteredRetry(
         total=int(times),
         backoff_factor=delay,
         status_forcelist=client_statuses,
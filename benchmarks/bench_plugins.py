@@ -0,0 +1,326 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Benchmarks of plugin framework overhead
+
+Plugins used here do nothing and docker is replaced by stand-ins, so the
+numbers only reflect time spent in atomic_reactor itself. No network or
+docker daemon is needed.
+
+How to run (from the top directory of the git checkout):
+
+    python -m benchmarks.bench_plugins --output before.json
+    # apply changes
+    python -m benchmarks.bench_plugins --compare before.json
+
+All results are in seconds per operation.
+"""
+
+from __future__ import print_function, unicode_literals, division
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import timeit
+
+from atomic_reactor.build import BuildResult
+from atomic_reactor.inner import DockerBuildWorkflow
+from atomic_reactor.plugin import (PluginRegistry, PreBuildPluginsRunner, PreBuildPlugin,
+                                   BuildStepPlugin, PrePublishPlugin, PostBuildPlugin,
+                                   ExitPlugin, InputPlugin)
+import atomic_reactor.inner
+import atomic_reactor.plugin
+
+
+SOURCE = {'provider': 'path', 'uri': 'file://' + os.path.dirname(os.path.abspath(__file__))}
+# registry reused by all runs of bench_index_warm
+warm_registry = PluginRegistry()
+# workflows whose source tmpdir has to be removed
+workflows = []
+NOOP_PLUGIN_KEYS = {
+    'prebuild': 'bench_noop_pre',
+    'buildstep': 'bench_noop_buildstep',
+    'prepublish': 'bench_noop_prepub',
+    'postbuild': 'bench_noop_post',
+    'exit': 'bench_noop_exit',
+}
+PLUGIN_ARGS = {
+    'image_id': 'BUILT_IMAGE_ID',
+    'dockerfile': 'BUILD_DOCKERFILE_PATH',
+    'options': {'paths': ['BUILD_SOURCE_PATH', 'file'], 'verbose': True},
+    'unknown': 'ignored',
+}
+
+
+class NoopPreBuildPlugin(PreBuildPlugin):
+    key = 'bench_noop_pre'
+
+    def __init__(self, tasker, workflow, image_id=None, dockerfile=None, options=None):
+        super(NoopPreBuildPlugin, self).__init__(tasker, workflow)
+
+    def run(self):
+        return None
+
+
+class NoopBuildStepPlugin(BuildStepPlugin):
+    key = 'bench_noop_buildstep'
+
+    def run(self):
+        return BuildResult(image_id='image-id')
+
+
+class NoopPrePublishPlugin(PrePublishPlugin):
+    key = 'bench_noop_prepub'
+
+    def run(self):
+        return None
+
+
+class NoopPostBuildPlugin(PostBuildPlugin):
+    key = 'bench_noop_post'
+
+    def run(self):
+        return None
+
+
+class NoopExitPlugin(ExitPlugin):
+    key = 'bench_noop_exit'
+
+    def run(self):
+        return None
+
+
+class StandInDocker(object):
+    def history(self, name):
+        return [{'Size': 1, 'Id': 'sha256:layer'}]
+
+
+class StandInTasker(object):
+    def __init__(self):
+        self.d = StandInDocker()
+
+    def inspect_image(self, name):
+        return {}
+
+
+class StandInSource(object):
+    dockerfile_path = '/'
+    path = '/tmp'
+
+
+class StandInBuilder(object):
+    """
+    replaces InsideBuilder, nothing is cloned or built
+    """
+
+    def __init__(self, source=None, image=None, **kwargs):
+        self.tasker = StandInTasker()
+        self.source = StandInSource()
+        self.base_image = None
+        self.image_id = None
+        self.image = image
+        self.is_built = False
+        self.df_path = 'Dockerfile'
+        self.df_dir = '/tmp'
+
+    def ensure_not_built(self):
+        pass
+
+    def inspect_built_image(self):
+        return {'RootFS': {'Layers': ['sha256:diff_id']}}
+
+
+def make_workflow(plugins=0):
+    workflow = DockerBuildWorkflow(
+        SOURCE, 'bench-image',
+        prebuild_plugins=[{'name': NOOP_PLUGIN_KEYS['prebuild'], 'args': PLUGIN_ARGS}] * plugins,
+        buildstep_plugins=[{'name': NOOP_PLUGIN_KEYS['buildstep']}],
+        prepublish_plugins=[{'name': NOOP_PLUGIN_KEYS['prepublish']}] * plugins,
+        postbuild_plugins=[{'name': NOOP_PLUGIN_KEYS['postbuild']}] * plugins,
+        exit_plugins=[{'name': NOOP_PLUGIN_KEYS['exit']}] * plugins,
+        plugin_files=[os.path.abspath(__file__).replace('.pyc', '.py')])
+    workflow.builder = StandInBuilder()
+    workflows.append(workflow)
+    return workflow
+
+
+def plugin_files():
+    plugins_dir = os.path.join(os.path.dirname(atomic_reactor.plugin.__file__), 'plugins')
+    return [os.path.join(plugins_dir, f) for f in sorted(os.listdir(plugins_dir))
+            if f.endswith('.py')]
+
+
+def bench_index_cold():
+    files = plugin_files()
+    PluginRegistry().get_plugin_classes(files, PreBuildPlugin)
+
+
+def bench_index_warm():
+    warm_registry.get_plugin_classes(plugin_files(), PreBuildPlugin)
+
+
+def bench_import_all():
+    registry = PluginRegistry()
+    files = plugin_files()
+    for plugin_class in (PreBuildPlugin, BuildStepPlugin, PrePublishPlugin,
+                         PostBuildPlugin, ExitPlugin, InputPlugin):
+        plugin_classes = registry.get_plugin_classes(files, plugin_class)
+        for key in plugin_classes:
+            try:
+                plugin_classes[key]
+            except KeyError:
+                # missing optional dependency of the plugin
+                pass
+
+
+def make_dispatch_bench(plugins):
+    workflow = make_workflow(plugins)
+
+    def bench_dispatch():
+        PreBuildPluginsRunner(workflow.builder.tasker, workflow,
+                              workflow.prebuild_plugins_conf,
+                              plugin_files=workflow.plugin_files).run()
+    return bench_dispatch
+
+
+def make_translate_bench():
+    workflow = make_workflow()
+    runner = PreBuildPluginsRunner(workflow.builder.tasker, workflow, [],
+                                   plugin_files=workflow.plugin_files)
+
+    def bench_translate_special_values():
+        runner._translate_special_values(PLUGIN_ARGS)
+    return bench_translate_special_values
+
+
+def make_remove_unknown_args_bench():
+    workflow = make_workflow()
+    runner = PreBuildPluginsRunner(workflow.builder.tasker, workflow, [],
+                                   plugin_files=workflow.plugin_files)
+
+    def bench_remove_unknown_args():
+        runner._remove_unknown_args(NoopPreBuildPlugin, PLUGIN_ARGS)
+    return bench_remove_unknown_args
+
+
+def make_build_bench(plugins):
+    def bench_build_docker_image():
+        workflow = make_workflow(plugins)
+        # the build removes the source tmpdir itself
+        workflows.remove(workflow)
+        workflow.build_docker_image()
+    return bench_build_docker_image
+
+
+def measure(func, number, repeat):
+    """
+    :return: dict, statistics of seconds per call of func
+    """
+    func()  # warm up
+    timings = sorted(t / number for t in timeit.repeat(func, number=number, repeat=repeat))
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'max': timings[-1],
+    }
+
+
+def run_benchmarks(plugins, repeat):
+    """
+    :param plugins: int, number of no-op plugins in each phase
+    :param repeat: int, number of measurements of each benchmark
+    :return: dict, benchmark name -> statistics
+    """
+    benchmarks = [
+        ('index_cold', bench_index_cold, 5),
+        ('index_warm', bench_index_warm, 50),
+        ('import_all', bench_import_all, 1),
+        ('translate_special_values', make_translate_bench(), 1000),
+        ('remove_unknown_args', make_remove_unknown_args_bench(), 1000),
+        ('dispatch_%d_plugins' % plugins, make_dispatch_bench(plugins), 5),
+        ('build_docker_image_%d_plugins' % plugins, make_build_bench(plugins), 3),
+    ]
+
+    results = {}
+    for name, func, number in benchmarks:
+        results[name] = measure(func, number, repeat)
+        print('%-40s %.6f s' % (name, results[name]['median']), file=sys.stderr)
+
+    dispatch = results['dispatch_%d_plugins' % plugins]
+    results['dispatch_per_plugin'] = dict(dispatch, **dict(
+        (stat, dispatch[stat] / plugins) for stat in ('min', 'median', 'max')))
+    return results
+
+
+def compare(results, previous):
+    """
+    print ratios of median timings to previous results
+
+    :return: list of str, names of benchmarks which are more than 10 % slower
+    """
+    slower = []
+    for name in sorted(results):
+        if name not in previous:
+            continue
+        ratio = results[name]['median'] / previous[name]['median']
+        print('%-40s %6.2fx' % (name, ratio))
+        if ratio > 1.1:
+            slower.append(name)
+    return slower
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='benchmark plugin framework overhead')
+    parser.add_argument('--plugins', type=int, default=50,
+                        help='number of no-op plugins in each phase')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of measurements of each benchmark')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare results with results written by --output')
+    args = parser.parse_args(args)
+
+    # nothing is cloned or built
+    atomic_reactor.inner.InsideBuilder = StandInBuilder
+    # missing optional dependencies of plugins are reported as warnings
+    logging.getLogger('atomic_reactor').setLevel(logging.ERROR)
+
+    try:
+        results = run_benchmarks(args.plugins, args.repeat)
+    finally:
+        for workflow in workflows:
+            workflow.source.remove_tmpdir()
+
+    output = {
+        'python': platform.python_version(),
+        'plugins': args.plugins,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(output['results'], previous['results']):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Copyright (c) 2017 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+from flexmock import flexmock
+from osbs.api import OSBS
+import pytest
+import requests
+import responses
+
+from atomic_reactor.build import BuildResult
+from atomic_reactor.constants import PLUGIN_CHECK_BUILD_INPUTS_KEY
+from atomic_reactor.core import DockerTasker
+from atomic_reactor.inner import DockerBuildWorkflow
+from atomic_reactor.plugin import (PreBuildPluginsRunner, ExitPluginsRunner,
+                                   AutoRebuildCanceledException)
+from atomic_reactor.plugins.pre_check_and_set_rebuild import CheckAndSetRebuildPlugin
+from atomic_reactor.plugins.pre_check_build_inputs import CheckBuildInputsPlugin
+from atomic_reactor.plugins.exit_set_build_inputs_digest import SetBuildInputsDigestPlugin
+from atomic_reactor.util import ImageName
+
+from tests.constants import INPUT_IMAGE, MOCK, MOCK_SOURCE
+if MOCK:
+    from tests.docker_mock import mock_docker
+
+
+DOCKERFILE = """\
+FROM fedora:25
+LABEL name="test" release="{release}" build-date="{build_date}"
+RUN yum install -y python
+"""
+REPO_FILE = """\
+[updates]
+name=updates
+baseurl=http://repos.example.com/updates/
+"""
+MIRRORLIST_REPO_FILE = """\
+[updates]
+name=updates
+mirrorlist=http://mirrors.example.com/?repo=updates&arch=$basearch
+"""
+REPOMD_URL = 'http://repos.example.com/updates/repodata/repomd.xml'
+
+
+class Y(object):
+    path = ''
+    dockerfile_path = ''
+
+
+class X(object):
+    image_id = INPUT_IMAGE
+    source = Y()
+    base_image = ImageName.parse('fedora:25')
+
+
+def run_check(tmpdir, monkeypatch, rebuild=True, last_digest=None, release='1',
+              build_date='2017-01-01', run_command='yum install -y python', files=None):
+    if MOCK:
+        mock_docker()
+    df_path = tmpdir.join('Dockerfile')
+    df_path.write(DOCKERFILE.format(release=release, build_date=build_date)
+                  .replace('yum install -y python', run_command))
+
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = X()
+    workflow.builder.df_path = str(df_path)
+    workflow._base_image_inspect = {'Id': 'parent-id'}
+    workflow.prebuild_results[CheckAndSetRebuildPlugin.key] = rebuild
+    workflow.files.update(files or {})
+    flexmock(workflow.source, get_vcs_info=lambda: None)
+
+    labels = {'buildconfig': 'buildconfig1'}
+    if last_digest:
+        labels['build-inputs-digest'] = last_digest
+    monkeypatch.setenv('BUILD', json.dumps({'metadata': {'labels': labels}}))
+
+    runner = PreBuildPluginsRunner(DockerTasker(), workflow,
+                                   [{'name': CheckBuildInputsPlugin.key}])
+    runner.run()
+    return workflow, workflow.prebuild_results[CheckBuildInputsPlugin.key]
+
+
+def test_digest_ignores_volatile_labels(tmpdir, monkeypatch):
+    _, digest = run_check(tmpdir, monkeypatch, rebuild=False)
+    _, other_digest = run_check(tmpdir, monkeypatch, rebuild=False,
+                                release='2', build_date='2017-02-02')
+    _, changed_digest = run_check(tmpdir, monkeypatch, rebuild=False,
+                                  run_command='yum install -y python3')
+    assert len(digest) == 63
+    assert digest == other_digest
+    assert digest != changed_digest
+
+
+def test_rebuild_with_unchanged_inputs_canceled(tmpdir, monkeypatch):
+    _, digest = run_check(tmpdir, monkeypatch, rebuild=False)
+
+    with pytest.raises(AutoRebuildCanceledException):
+        run_check(tmpdir, monkeypatch, last_digest=digest, release='2')
+
+
+@pytest.mark.parametrize('last_digest', [None, 'other-digest'])
+def test_rebuild_with_changed_inputs(tmpdir, monkeypatch, last_digest):
+    # does not raise
+    run_check(tmpdir, monkeypatch, last_digest=last_digest)
+
+
+@responses.activate
+def test_digest_covers_repo_metadata(tmpdir, monkeypatch):
+    files = {'/etc/yum.repos.d/updates.repo': REPO_FILE}
+    responses.add(responses.GET, REPOMD_URL, body='<revision>1</revision>')
+    responses.add(responses.GET, REPOMD_URL, body='<revision>2</revision>')
+    responses.add(responses.GET, REPOMD_URL, body='<revision>2</revision>')
+
+    _, digest = run_check(tmpdir, monkeypatch, rebuild=False, files=files)
+    # new packages in the repo
+    _, changed_digest = run_check(tmpdir, monkeypatch, last_digest=digest, files=files)
+    assert changed_digest != digest
+
+    with pytest.raises(AutoRebuildCanceledException):
+        run_check(tmpdir, monkeypatch, last_digest=changed_digest, files=files)
+
+
+@responses.activate
+@pytest.mark.parametrize('repo_file', [REPO_FILE, MIRRORLIST_REPO_FILE])
+def test_rebuild_with_unknown_repo_metadata(tmpdir, monkeypatch, repo_file):
+    files = {'/etc/yum.repos.d/updates.repo': repo_file}
+    responses.add(responses.GET, REPOMD_URL,
+                  body=requests.exceptions.ConnectionError('connection refused'))
+
+    _, digest = run_check(tmpdir, monkeypatch, rebuild=False, files=files)
+    # does not raise, the content of the repo may have changed
+    run_check(tmpdir, monkeypatch, last_digest=digest, files=files)
+
+
+@pytest.mark.parametrize('failed', [True, False])
+def test_set_build_inputs_digest(monkeypatch, failed):
+    if MOCK:
+        mock_docker()
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = X()
+    workflow.build_result = BuildResult(image_id=INPUT_IMAGE)
+    workflow.plugin_failed = failed
+    workflow.prebuild_results[PLUGIN_CHECK_BUILD_INPUTS_KEY] = 'digest'
+    monkeypatch.setenv('BUILD', json.dumps({
+        'metadata': {'labels': {'buildconfig': 'buildconfig1'}},
+    }))
+
+    (flexmock(OSBS)
+        .should_receive('set_labels_on_build_config')
+        .with_args('buildconfig1', {'build-inputs-digest': 'digest'})
+        .times(0 if failed else 1))
+
+    runner = ExitPluginsRunner(DockerTasker(), workflow,
+                               [{'name': SetBuildInputsDigestPlugin.key,
+                                 'args': {'url': 'https://localhost:8443/'}}])
+    results = runner.run()
+    assert results[SetBuildInputsDigestPlugin.key] == (None if failed else 'digest')
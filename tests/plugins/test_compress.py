@@ -1,3 +1,5 @@
+import gzip
+import hashlib
 import os
 import tarfile
 
@@ -7,8 +9,9 @@ from atomic_reactor.constants import (EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE,
                                       IMAGE_TYPE_DOCKER_ARCHIVE)
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PostBuildPluginsRunner
-from atomic_reactor.plugins.post_compress import CompressPlugin
+from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
+from atomic_reactor.plugins import post_compress
+from atomic_reactor.plugins.post_compress import CompressPlugin, lzma
 from atomic_reactor.util import ImageName
 
 from tests.constants import INPUT_IMAGE, MOCK
@@ -76,4 +79,78 @@ class TestCompress(object):
         assert metadata['type'] == IMAGE_TYPE_DOCKER_ARCHIVE
         assert 'uncompressed_size' in metadata
         assert isinstance(metadata['uncompressed_size'], integer_types)
+        assert len(metadata['uncompressed_sha256sum']) == 64
+        assert metadata['size'] == os.path.getsize(compressed_img)
+        with open(compressed_img, 'rb') as f:
+            assert metadata['sha256sum'] == hashlib.sha256(f.read()).hexdigest()
         assert ", ratio: " in caplog.text()
+
+    @pytest.mark.parametrize('method, extension, decompress', [
+        ('gzip', 'gz', gzip.open),
+        ('lzma', 'xz', lzma.open),
+    ])
+    def test_compress_concurrently(self, tmpdir, monkeypatch, method, extension, decompress):
+        if MOCK:
+            mock_docker()
+        monkeypatch.setattr(post_compress, 'COMPRESS_BLOCK_SIZE', 1024)
+
+        tasker = DockerTasker()
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        workflow.builder = X()
+        exp_img = os.path.join(str(tmpdir), 'img.tar')
+        content = os.urandom(4096) + b'x' * 10000
+        with open(exp_img, 'wb') as f:
+            f.write(content)
+        workflow.exported_image_sequence.append({'path': exp_img,
+                                                 'type': IMAGE_TYPE_DOCKER_ARCHIVE})
+
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': CompressPlugin.key,
+                'args': {
+                    'method': method,
+                    'load_exported_image': True,
+                    'threads': 4,
+                    'level': 1,
+                },
+            }]
+        )
+
+        runner.run()
+
+        compressed_img = os.path.join(
+            workflow.source.tmpdir,
+            EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE.format(extension))
+        # concatenated members decompress into the original image
+        with decompress(compressed_img) as f:
+            assert f.read() == content
+        metadata = workflow.exported_image_sequence[-1]
+        assert metadata['path'] == compressed_img
+        assert metadata['uncompressed_size'] == len(content)
+        assert metadata['uncompressed_sha256sum'] == hashlib.sha256(content).hexdigest()
+
+    def test_compress_zstd_unavailable(self, tmpdir, monkeypatch):
+        if MOCK:
+            mock_docker()
+        monkeypatch.setattr(post_compress, 'zstandard', None)
+
+        tasker = DockerTasker()
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        workflow.builder = X()
+
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': CompressPlugin.key,
+                'args': {
+                    'method': 'zstd',
+                },
+            }]
+        )
+
+        with pytest.raises(PluginFailedException) as exc:
+            runner.run()
+        assert 'zstandard' in str(exc.value)
@@ -8,6 +8,8 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import os
+
 import docker
 import requests
 
@@ -17,7 +19,8 @@ from atomic_reactor.plugin import PluginFailedException
 from atomic_reactor.build import InsideBuilder, BuildResult
 from atomic_reactor.util import ImageName, CommandResult
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.constants import INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS
+from atomic_reactor.constants import (INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS,
+                                      BUILD_LOG_FILENAME)
 
 from tests.docker_mock import mock_docker
 from flexmock import flexmock
@@ -106,6 +109,8 @@ def test_build(is_failed, image_id):
     assert isinstance(workflow.buildstep_result['docker_api'], BuildResult)
     assert workflow.build_result == workflow.buildstep_result['docker_api']
     assert workflow.build_result.is_failed() == is_failed
+    assert workflow.build_result.logs_path == os.path.join(workflow.source.workdir,
+                                                           BUILD_LOG_FILENAME)
 
     if is_failed:
         assert workflow.build_result.fail_reason == error
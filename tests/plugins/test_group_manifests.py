@@ -318,6 +318,7 @@ REGISTRY_V2 = 'registry_v2.example.com'
 OTHER_V2 = 'registry.example.com:5001'
 
 
+@pytest.mark.parametrize('upload_workers', (None, 4))
 @pytest.mark.parametrize('schema_version', ('v2', 'oci'))
 @pytest.mark.parametrize(('test_name', 'group', 'foreign_layers',
                           'registries', 'workers', 'expected_exception'), [
@@ -416,7 +417,7 @@ OTHER_V2 = 'registry.example.com:5001'
 @responses.activate  # noqa
 def test_group_manifests(tmpdir, test_name,
                          schema_version, group, foreign_layers, registries, workers,
-                         expected_exception):
+                         expected_exception, upload_workers):
     if MOCK:
         mock_docker()
 
@@ -455,6 +456,7 @@ def test_group_manifests(tmpdir, test_name,
             'registries': registry_conf,
             'group': group,
             'goarch': goarch,
+            'upload_workers': upload_workers,
         },
     }]
 
@@ -546,6 +548,11 @@ def test_group_manifests(tmpdir, test_name,
                                                   source_manifest, 'x86_64',
                                                   tag)
 
+        # Each blob is linked into a repository only once
+        blob_heads = [call.request.url for call in responses.calls
+                      if call.request.method == 'HEAD' and '/blobs/' in call.request.url]
+        assert len(blob_heads) == len(set(blob_heads))
+
         # Check that plugin returns ManifestDigest object
         plugin_result = results[GroupManifestsPlugin.key]
         assert isinstance(plugin_result, dict)
@@ -15,9 +15,11 @@ import pytest
 import atomic_reactor
 
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PreBuildPluginsRunner, PluginFailedException
+from atomic_reactor.plugin import (PreBuildPluginsRunner, PrefetchPluginsRunner,
+                                   PluginFailedException)
 from atomic_reactor.util import ImageName, CommandResult
 from atomic_reactor.core import DockerTasker
+from atomic_reactor.plugins.exit_remove_built_image import GarbageCollectionPlugin
 from atomic_reactor.plugins.pre_pull_base_image import PullBaseImagePlugin
 from tests.constants import MOCK, MOCK_SOURCE, LOCALHOST_REGISTRY
 
@@ -246,3 +248,78 @@ def test_try_with_library_pull_base_image(library):
         runner.run()
 
     assert error_message in exc.value.args[0]
+
+
+def test_pull_base_image_prefetched(monkeypatch):
+    if MOCK:
+        mock_docker(remember_images=True)
+
+    tasker = DockerTasker(retry_times=0)
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = MockBuilder()
+    workflow.builder.base_image = ImageName.parse(BASE_IMAGE)
+    plugins_conf = [{
+        'name': PullBaseImagePlugin.key,
+        'args': {'parent_registry': LOCALHOST_REGISTRY, 'parent_registry_insecure': True}
+    }]
+
+    prefetch_runner = PrefetchPluginsRunner(tasker, workflow, plugins_conf)
+    prefetch_runner.run()
+    prefetch_runner.wait()
+    assert PullBaseImagePlugin.key in workflow.prefetch_results
+    assert BASE_IMAGE_W_REGISTRY in workflow.pulled_base_images
+
+    def pull_image(*args, **kwargs):
+        raise AssertionError("prefetched image pulled again")
+
+    monkeypatch.setattr(tasker, 'pull_image', pull_image)
+    runner = PreBuildPluginsRunner(tasker, workflow, plugins_conf)
+    runner.run()
+
+    assert not workflow.prefetch_results
+    for image in (BASE_IMAGE_W_REGISTRY, BASE_IMAGE, UNIQUE_ID):
+        assert tasker.image_exists(image)
+        assert image in workflow.pulled_base_images
+
+
+def test_pull_base_image_leases(tmpdir, monkeypatch):
+    if MOCK:
+        mock_docker(remember_images=True)
+
+    leases_dir = str(tmpdir)
+    tasker = DockerTasker(retry_times=0)
+    pulls = []
+    pull_image = tasker.pull_image
+
+    def spy_pull_image(image, *args, **kwargs):
+        pulls.append(image.to_str())
+        return pull_image(image, *args, **kwargs)
+
+    monkeypatch.setattr(tasker, 'pull_image', spy_pull_image)
+
+    workflows = []
+    for build in ('build-1', 'build-2'):
+        monkeypatch.setenv("BUILD", json.dumps({'metadata': {'name': build}}))
+        workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+        workflow.builder = MockBuilder()
+        workflow.builder.base_image = ImageName.parse(BASE_IMAGE)
+        runner = PreBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': PullBaseImagePlugin.key,
+                'args': {'parent_registry': LOCALHOST_REGISTRY,
+                         'parent_registry_insecure': True,
+                         'leases_dir': leases_dir}
+            }]
+        )
+        runner.run()
+        workflows.append(workflow)
+
+    # the second build shares the image pulled by the first one
+    assert pulls == [BASE_IMAGE_W_REGISTRY]
+    for workflow, build in zip(workflows, ('build-1', 'build-2')):
+        assert BASE_IMAGE_W_REGISTRY not in workflow.pulled_base_images
+        assert workflow.plugin_workspace[GarbageCollectionPlugin.key]['leases_to_release'] == \
+            set([(leases_dir, build, BASE_IMAGE_W_REGISTRY)])
+    assert tasker.image_exists(BASE_IMAGE_W_REGISTRY)
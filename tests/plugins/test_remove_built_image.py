@@ -8,14 +8,17 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import print_function, unicode_literals
 
+from docker.errors import NotFound
 import flexmock
 import pytest
 
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner
+from atomic_reactor.leases import ImageLeases
 from atomic_reactor.plugins.exit_remove_built_image import (GarbageCollectionPlugin,
-                                                            defer_removal)
+                                                            defer_removal,
+                                                            defer_lease_release)
 from atomic_reactor.plugins.post_tag_and_push import TagAndPushPlugin
 from atomic_reactor.util import ImageName
 from tests.constants import (LOCALHOST_REGISTRY,
@@ -83,3 +86,83 @@ class TestGarbageCollectionPlugin(object):
         image_set = set(removed_images)
         assert len(image_set) == len(removed_images)
         assert image_set == expected
+
+    @pytest.mark.parametrize(('other_build', 'remove_base', 'expected'), [
+        (False, True, set([INPUT_IMAGE, IMPORTED_IMAGE_ID, 'leased'])),
+        (False, False, set([INPUT_IMAGE])),
+        (True, True, set([INPUT_IMAGE, IMPORTED_IMAGE_ID])),
+    ])
+    def test_remove_built_image_leases(self, tmpdir, other_build, remove_base, expected):
+        tasker, workflow = mock_environment()
+        leases_dir = str(tmpdir)
+        for build in ['build-1', 'build-2'] if other_build else ['build-1']:
+            ImageLeases(leases_dir, build).acquire('leased', lambda: 'leased',
+                                                   lambda image: True)
+        defer_lease_release(workflow, leases_dir, 'build-1', 'leased')
+
+        runner = PostBuildPluginsRunner(
+            tasker,
+            workflow,
+            [{
+                'name': GarbageCollectionPlugin.key,
+                'args': {'remove_pulled_base_image': remove_base},
+            }]
+        )
+        removed_images = []
+
+        def spy_remove_image(image_id, force=None):
+            removed_images.append(image_id)
+
+        flexmock(tasker, remove_image=spy_remove_image)
+        runner.run()
+        assert set(removed_images) == expected
+        if 'leased' in expected:
+            # released after the image built from it is removed
+            assert removed_images[-1] == 'leased'
+
+    @pytest.mark.parametrize('background', [False, True])
+    def test_remove_built_image_dedup(self, background):
+        built_id = 'sha256:' + 'a' * 64
+        base_id = 'sha256:' + 'b' * 64
+        image_ids = {
+            built_id: built_id,
+            'registry.example.com/test-image:1.0': built_id,
+            'test-image:latest': built_id,
+            'fedora:27': base_id,
+            'build-name-123:latest': base_id,
+            base_id[len('sha256:'):]: base_id,
+        }
+
+        tasker, workflow = mock_environment()
+        workflow.builder.image_id = built_id
+        workflow.pulled_base_images = set(['fedora:27', 'build-name-123:latest',
+                                           base_id[len('sha256:'):], 'gone'])
+        for image in ['registry.example.com/test-image:1.0', 'test-image:latest',
+                      built_id]:
+            defer_removal(workflow, image)
+
+        def mock_inspect_image(image):
+            if image not in image_ids:
+                raise NotFound(message='no such image', response='404',
+                               explanation='no such image')
+            return {'Id': image_ids[image]}
+
+        removed_images = []
+
+        def spy_remove_image(image_id, force=None):
+            removed_images.append((image_id, force))
+
+        flexmock(tasker, inspect_image=mock_inspect_image, remove_image=spy_remove_image)
+        plugin = GarbageCollectionPlugin(tasker, workflow, background=background)
+        plugin.run()
+        if background:
+            plugin.reaper.join()
+        else:
+            assert plugin.reaper is None
+
+        # tags of the built image are removed along with it, missing images
+        # aren't removed at all
+        assert removed_images[0] == (built_id, True)
+        assert sorted(removed_images[1:3]) == [('build-name-123:latest', False),
+                                               ('fedora:27', False)]
+        assert removed_images[3:] == [(base_id, False)]
@@ -209,6 +209,9 @@ CMD blabla"""
     workflow.plugins_durations = {
         PostBuildRPMqaPlugin.key: 3.03,
     }
+    workflow.plugins_resource_usage = {
+        PostBuildRPMqaPlugin.key: {'cpu_user': 1.5, 'http_requests': 2},
+    }
     workflow.plugins_errors = {}
 
     if koji:
@@ -319,9 +322,12 @@ CMD blabla"""
     assert "errors" in annotations["plugins-metadata"]
     assert "durations" in annotations["plugins-metadata"]
     assert "timestamps" in annotations["plugins-metadata"]
+    assert "resource_usage" in annotations["plugins-metadata"]
 
     plugins_metadata = json.loads(annotations["plugins-metadata"])
     assert "all_rpm_packages" in plugins_metadata["durations"]
+    assert plugins_metadata["resource_usage"]["all_rpm_packages"] == {
+        'cpu_user': 1.5, 'http_requests': 2}
 
     if br_annotations:
         assert annotations['br_annotations'] == expected_br_annotations
@@ -525,6 +531,57 @@ CMD blabla"""
     assert "koji-build-id" not in labels
 
 
+@pytest.mark.parametrize('worker_metadata', (True, False))
+def test_critical_path_annotation(tmpdir, worker_metadata):
+    workflow = prepare()
+    workflow.exit_results = {}
+    df = df_parser(str(tmpdir))
+    df.content = "FROM fedora\n"
+    workflow.builder = X
+    workflow.builder.df_path = df.dockerfile_path
+    workflow.builder.df_dir = str(tmpdir)
+
+    start = datetime(2018, 1, 1, 10, 0, 0)
+    workflow.plugins_timestamps = {
+        OrchestrateBuildPlugin.key: start.isoformat(),
+    }
+    workflow.plugins_durations = {
+        OrchestrateBuildPlugin.key: 60,
+    }
+    worker_annotations = {}
+    if worker_metadata:
+        worker_annotations['plugins-metadata'] = {
+            'timestamps': {'docker_api': (start + timedelta(seconds=5)).isoformat()},
+            'durations': {'docker_api': 50},
+        }
+    workflow.build_result = BuildResult(
+        image_id="id1234",
+        annotations={'worker-builds': {'x86_64': worker_annotations}})
+
+    runner = ExitPluginsRunner(
+        None,
+        workflow,
+        [{
+            'name': StoreMetadataInOSv3Plugin.key,
+            "args": {
+                "url": "http://example.com/"
+            }
+        }]
+    )
+    output = runner.run()
+    annotations = output[StoreMetadataInOSv3Plugin.key]["annotations"]
+    if not worker_metadata:
+        assert "critical-path" not in annotations
+        return
+
+    critical_path = json.loads(annotations["critical-path"])
+    assert critical_path["duration"] == 60
+    assert critical_path["gating-platform"] == "x86_64"
+    assert [(plugin["process"], plugin["plugin"]) for plugin in critical_path["plugins"]] == [
+        ("x86_64", "docker_api"),
+    ]
+
+
 def test_exit_before_dockerfile_created(tmpdir):
     workflow = prepare(before_dockerfile=True)
     workflow.exit_results = {}
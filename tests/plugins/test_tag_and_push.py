@@ -13,6 +13,7 @@ from atomic_reactor.constants import IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
+from atomic_reactor import util
 from atomic_reactor.plugins.post_tag_and_push import TagAndPushPlugin
 from atomic_reactor.util import ImageName, ManifestDigest, get_exported_image_metadata
 from tests.constants import LOCALHOST_REGISTRY, TEST_IMAGE, INPUT_IMAGE, MOCK, DOCKER0_REGISTRY
@@ -504,3 +505,68 @@ def test_tag_and_push_plugin_oci(
         assert workflow.push_conf.docker_registries[0].digests[TEST_IMAGE].oci == DIGEST_OCI
 
         assert workflow.push_conf.docker_registries[0].config is config_json
+
+
+def test_tag_and_push_plugin_concurrently():
+    if MOCK:
+        mock_docker()
+    else:
+        return
+
+    registries = ['registry1.example.com', 'registry2.example.com']
+    tags = ['{}:tag{}'.format(TEST_IMAGE, i) for i in range(3)]
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, TEST_IMAGE)
+    workflow.tag_conf.add_primary_images(tags[:-1])
+    workflow.tag_conf.add_unique_image(tags[-1])
+    setattr(workflow, 'builder', X)
+
+    pushed = []
+
+    def tag_and_push_image(image, target_image, **kwargs):
+        pushed.append(target_image.to_str())
+
+    def get_manifest_digests(image, registry, insecure, secret, **kwargs):
+        # every image must be pushed before its digests are looked up
+        assert image.to_str() in pushed
+        assert kwargs['head']
+        return ManifestDigest(v1=DIGEST_V1, v2=DIGEST_V2)
+
+    flexmock(tasker, tag_and_push_image=tag_and_push_image)
+    # the runner imports the plugin module itself, which binds these from util
+    (flexmock(util)
+        .should_receive('get_manifest_digests')
+        .replace_with(get_manifest_digests))
+    (flexmock(util)
+        .should_receive('get_config_from_registry')
+        .with_args(object, object, DIGEST_V2, False, None, 'v2',
+                   content_cache=workflow.registry_content_cache)
+        .and_return({'config': {}})
+        .times(len(registries)))
+
+    runner = PostBuildPluginsRunner(
+        tasker,
+        workflow,
+        [{
+            'name': TagAndPushPlugin.key,
+            'args': {
+                'registries': {registry: {} for registry in registries},
+                'push_workers': 4,
+            },
+        }]
+    )
+    output = runner.run()
+
+    expected = set('{}/{}'.format(registry, tag) for registry in registries for tag in tags)
+    assert set(image.to_str() for image in output[TagAndPushPlugin.key]) == expected
+    assert set(pushed) == expected
+    # the first tag for each registry is pushed before any of the others
+    assert set(pushed[:len(registries)]) == set('{}/{}'.format(registry, tags[0])
+                                                for registry in registries)
+
+    assert len(workflow.push_conf.docker_registries) == len(registries)
+    for registry in workflow.push_conf.docker_registries:
+        assert set(registry.digests) == set(tags)
+        assert registry.digests[tags[0]].v2 == DIGEST_V2
+        assert registry.config == {'config': {}}
@@ -84,6 +84,9 @@ class MockDockerTasker(object):
     def inspect_image(self, name):
         return {}
 
+    def image_exists(self, image_id):
+        return True
+
     def build_image_from_path(self):
         return True
 
@@ -137,6 +140,9 @@ class MockInsideBuilder(object):
     def ensure_not_built(self):
         pass
 
+    def set_df_path(self, path):
+        self.df_path = path
+
 
 class RaisesMixIn(object):
     """
@@ -272,6 +278,33 @@ class ExitRaisesAllowed(RaisesMixIn, ExitPlugin):
     key = 'exit_raises_allowed'
 
 
+class PreInspectsBaseImage(PreBuildPlugin):
+    """
+    A PreBuild plugin which inspects the base image.
+    """
+
+    key = 'pre_inspects_base_image'
+
+    def run(self):
+        return self.workflow.base_image_inspect['Id']
+
+
+class ExitReadsPrebuildState(ExitPlugin):
+    """
+    An Exit plugin which records state left by PreBuild plugins.
+    """
+
+    key = 'exit_reads_prebuild_state'
+
+    def __init__(self, tasker, workflow, state, *args, **kwargs):
+        super(ExitReadsPrebuildState, self).__init__(tasker, workflow, *args, **kwargs)
+        self.state = state
+
+    def run(self):
+        self.state.base_image_inspect = self.workflow.base_image_inspect
+        self.state.prebuild_results = self.workflow.prebuild_results
+
+
 class ExitCompat(WatchedMixIn, ExitPlugin):
     """
     An Exit plugin called as a Post-build plugin.
@@ -1350,3 +1383,124 @@ def test_layer_sizes():
     ]
 
     assert workflow.layer_sizes == expected
+
+
+@pytest.mark.parametrize('image_exists', [True, False])
+def test_workflow_checkpoint(tmpdir, image_exists):
+    """
+    A build which failed after the image was built resumes from the
+    last completed phase, unless the built image is gone.
+    """
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreRaises)
+    mock_docker()
+    source_dir = tmpdir.mkdir('source')
+    source_dir.join('Dockerfile').write('FROM fedora\n')
+    checkpoint_path = str(tmpdir.join('checkpoint'))
+
+    def run_build(fail):
+        fake_builder = MockInsideBuilder()
+        flexmock(InsideBuilder).new_instances(fake_builder)
+        watchers = dict((phase, Watcher())
+                        for phase in ('pre', 'buildstep', 'prepub', 'post', 'exit'))
+        postbuild_plugins = [{'name': 'post_watched',
+                              'args': {'watcher': watchers['post']}}]
+        if fail:
+            postbuild_plugins.insert(0, {'name': 'post_raises', 'args': {}})
+
+        workflow = DockerBuildWorkflow({'provider': 'path', 'uri': str(source_dir)},
+                                       'test-image',
+                                       prebuild_plugins=[{'name': 'pre_watched',
+                                                          'args': {
+                                                              'watcher': watchers['pre']
+                                                          }}],
+                                       buildstep_plugins=[{'name': 'buildstep_watched',
+                                                           'args': {
+                                                               'watcher': watchers['buildstep']
+                                                           }}],
+                                       prepublish_plugins=[{'name': 'prepub_watched',
+                                                            'args': {
+                                                                'watcher': watchers['prepub']
+                                                            }}],
+                                       postbuild_plugins=postbuild_plugins,
+                                       exit_plugins=[{'name': 'exit_watched',
+                                                      'args': {
+                                                          'watcher': watchers['exit']
+                                                      }}],
+                                       plugin_files=[this_file],
+                                       checkpoint_path=checkpoint_path)
+        fake_builder.df_path = os.path.join(workflow.source.path, 'Dockerfile')
+        return workflow, fake_builder, watchers
+
+    workflow, _, watchers = run_build(fail=True)
+    with pytest.raises(PluginFailedException):
+        workflow.build_docker_image()
+    assert all(watcher.was_called() for phase, watcher in watchers.items() if phase != 'post')
+    assert os.path.exists(checkpoint_path)
+
+    workflow, fake_builder, watchers = run_build(fail=False)
+    (flexmock(fake_builder.tasker)
+        .should_receive('image_exists')
+        .and_return(image_exists))
+    workflow.build_docker_image()
+    if image_exists:
+        assert workflow.resumed_phase == 'prepublish'
+    else:
+        assert workflow.resumed_phase is None
+    assert watchers['pre'].was_called() == (not image_exists)
+    assert watchers['buildstep'].was_called() == (not image_exists)
+    assert watchers['prepub'].was_called() == (not image_exists)
+    assert watchers['post'].was_called()
+    assert watchers['exit'].was_called()
+    assert workflow.build_result.image_id == DUMMY_BUILD_RESULT.image_id
+    assert workflow.layer_sizes
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_workflow_checkpoint_prebuild_state(tmpdir):
+    """
+    Plugins running after a resumed build see state left by PreBuild
+    plugins, which don't run again.
+    """
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreRaises)
+    mock_docker()
+    source_dir = tmpdir.mkdir('source')
+    source_dir.join('Dockerfile').write('FROM fedora\n')
+    checkpoint_path = str(tmpdir.join('checkpoint'))
+
+    def run_build(fail, state):
+        fake_builder = MockInsideBuilder()
+        flexmock(InsideBuilder).new_instances(fake_builder)
+        postbuild_plugins = [{'name': 'post_raises', 'args': {}}] if fail else []
+        workflow = DockerBuildWorkflow({'provider': 'path', 'uri': str(source_dir)},
+                                       'test-image',
+                                       prebuild_plugins=[{'name': 'pre_inspects_base_image'}],
+                                       buildstep_plugins=[{'name': 'buildstep_watched',
+                                                           'args': {'watcher': Watcher()}}],
+                                       postbuild_plugins=postbuild_plugins,
+                                       exit_plugins=[{'name': 'exit_reads_prebuild_state',
+                                                      'args': {'state': state}}],
+                                       plugin_files=[this_file],
+                                       checkpoint_path=checkpoint_path)
+        fake_builder.df_path = os.path.join(workflow.source.path, 'Dockerfile')
+        return workflow, fake_builder
+
+    workflow, fake_builder = run_build(True, X())
+    (flexmock(fake_builder.tasker)
+        .should_receive('inspect_image')
+        .and_return({'Id': 'base-image-id'}))
+    with pytest.raises(PluginFailedException):
+        workflow.build_docker_image()
+    assert os.path.exists(checkpoint_path)
+
+    state = X()
+    workflow, fake_builder = run_build(False, state)
+    # the base image may be gone by now, its inspection comes from the checkpoint
+    (flexmock(fake_builder.tasker)
+        .should_receive('inspect_image')
+        .never())
+    workflow.build_docker_image()
+    assert workflow.resumed_phase == 'prepublish'
+    assert state.base_image_inspect == {'Id': 'base-image-id'}
+    assert state.prebuild_results == {'pre_inspects_base_image': 'base-image-id'}
@@ -0,0 +1,97 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from atomic_reactor.leases import ImageLeases
+
+
+IMAGE = 'registry.example.com/fedora:27'
+DIGEST_IMAGE = 'registry.example.com/fedora@sha256:1234'
+
+
+class Daemon(object):
+    def __init__(self, present=()):
+        self.images = set(present)
+        self.pulls = []
+        self.removals = []
+
+    def pull(self, image):
+        def pull():
+            self.pulls.append(image)
+            self.images.add(image)
+            return image
+        return pull
+
+    def exists(self, image):
+        return image in self.images
+
+    def remove(self, image):
+        self.removals.append(image)
+        self.images.discard(image)
+
+
+def test_leases_share_pull(tmpdir):
+    daemon = Daemon()
+    first = ImageLeases(str(tmpdir), 'build-1')
+    second = ImageLeases(str(tmpdir), 'build-2')
+
+    assert first.acquire(IMAGE, daemon.pull(IMAGE), daemon.exists) == IMAGE
+    assert second.acquire(IMAGE, daemon.pull(IMAGE), daemon.exists) == IMAGE
+    assert daemon.pulls == [IMAGE]
+
+    # only the last build releasing the lease removes the image
+    assert not first.release(IMAGE, daemon.remove)
+    assert daemon.removals == []
+    assert second.release(IMAGE, daemon.remove)
+    assert daemon.removals == [IMAGE]
+
+    # releasing again does nothing
+    assert not second.release(IMAGE, daemon.remove)
+    assert daemon.removals == [IMAGE]
+
+
+def test_leases_pull_removed_image(tmpdir):
+    daemon = Daemon()
+    first = ImageLeases(str(tmpdir), 'build-1')
+    second = ImageLeases(str(tmpdir), 'build-2')
+
+    first.acquire(IMAGE, daemon.pull(IMAGE), daemon.exists)
+    # removed by something not using leases
+    daemon.images.clear()
+    second.acquire(IMAGE, daemon.pull(IMAGE), daemon.exists)
+    assert daemon.pulls == [IMAGE, IMAGE]
+
+
+def test_leases_present_by_digest(tmpdir):
+    daemon = Daemon(present=[DIGEST_IMAGE])
+    leases = ImageLeases(str(tmpdir), 'build-1')
+
+    assert leases.acquire(DIGEST_IMAGE, daemon.pull(DIGEST_IMAGE),
+                          daemon.exists) == DIGEST_IMAGE
+    assert daemon.pulls == []
+    # the image wasn't pulled by a lease holder, keep it
+    assert not leases.release(DIGEST_IMAGE, daemon.remove)
+    assert daemon.removals == []
+
+
+def test_leases_abandoned(tmpdir, monkeypatch):
+    daemon = Daemon()
+    crashed = ImageLeases(str(tmpdir), 'build-1', expiry=60)
+    leases = ImageLeases(str(tmpdir), 'build-2', expiry=60)
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    crashed.acquire(IMAGE, daemon.pull(IMAGE), daemon.exists)
+    leases.acquire(IMAGE, daemon.pull(IMAGE), daemon.exists)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    assert leases.release(IMAGE, daemon.remove)
+    assert daemon.removals == [IMAGE]
@@ -10,6 +10,7 @@ from __future__ import unicode_literals
 
 import json
 import os
+import threading
 import time
 
 from dockerfile_parse import DockerfileParser
@@ -23,8 +24,10 @@ from atomic_reactor.plugin import (BuildPluginsRunner, PreBuildPluginsRunner,
                                    PluginFailedException, PrePublishPluginsRunner,
                                    ExitPluginsRunner, BuildStepPluginsRunner,
                                    PluginsRunner, InappropriateBuildStepError,
+                                   PostBuildPlugin, ExitPlugin,
                                    BuildStepPlugin, PreBuildPlugin,
-                                   PreBuildSleepPlugin)
+                                   PreBuildSleepPlugin, PluginRegistry,
+                                   PrefetchPluginsRunner)
 from atomic_reactor.plugins.pre_add_yum_repo_by_url import AddYumRepoByUrlPlugin
 from atomic_reactor.util import ImageName
 
@@ -103,6 +106,101 @@ class X(object):
     pass
 
 
+PLUGIN_FILE_CONTENT = """
+from atomic_reactor.constants import PLUGIN_KOJI_PARENT_KEY
+from atomic_reactor.plugin import PreBuildPlugin, ExitPlugin
+
+MY_KEY = 'my_plugin'
+
+
+class MyPlugin(PreBuildPlugin):
+    key = MY_KEY
+
+
+class MyChildPlugin(MyPlugin):
+    key = PLUGIN_KOJI_PARENT_KEY
+
+
+class MyExitPlugin(ExitPlugin):
+    key = 'my_exit_plugin'
+"""
+
+
+class TestPluginRegistry(object):
+    @pytest.mark.parametrize(('plugin_class', 'expected'), [
+        (PreBuildPlugin, ['koji_parent', 'my_plugin']),
+        (PostBuildPlugin, ['my_exit_plugin']),
+        (BuildStepPlugin, []),
+    ])
+    def test_get_plugin_classes(self, tmpdir, plugin_class, expected):
+        plugin_file = tmpdir.join('my_plugins.py')
+        plugin_file.write(PLUGIN_FILE_CONTENT)
+
+        registry = PluginRegistry()
+        plugin_classes = registry.get_plugin_classes([str(plugin_file)], plugin_class)
+        assert sorted(plugin_classes) == expected
+        assert not plugin_classes._modules
+
+        for key in expected:
+            assert plugin_classes[key].key == key
+        assert bool(plugin_classes._modules) == bool(expected)
+
+    def test_import_per_lookup(self, tmpdir):
+        plugin_file = tmpdir.join('my_plugins.py')
+        plugin_file.write(PLUGIN_FILE_CONTENT)
+
+        registry = PluginRegistry()
+        first = registry.get_plugin_classes([str(plugin_file)], PreBuildPlugin)
+        second = registry.get_plugin_classes([str(plugin_file)], PreBuildPlugin)
+        assert first['my_plugin'] is first['my_plugin']
+        # modules are imported again for every runner
+        assert first['my_plugin'] is not second['my_plugin']
+
+    def test_computed_key(self, tmpdir):
+        plugin_file = tmpdir.join('my_plugins.py')
+        plugin_file.write(PLUGIN_FILE_CONTENT + """
+
+class MyComputedPlugin(PreBuildPlugin):
+    key = 'my_' + 'computed'
+""")
+
+        registry = PluginRegistry()
+        plugin_classes = registry.get_plugin_classes([str(plugin_file)], PreBuildPlugin)
+        assert sorted(plugin_classes) == ['koji_parent', 'my_computed', 'my_plugin']
+        assert plugin_classes._modules
+
+    def test_inherited_key(self, tmpdir):
+        plugin_file = tmpdir.join('my_inherited_plugins.py')
+        plugin_file.write(PLUGIN_FILE_CONTENT + """
+
+from atomic_reactor.plugins import pre_pull_base_image
+
+
+class MyPullPlugin(pre_pull_base_image.PullBaseImagePlugin):
+    pass
+""")
+
+        registry = PluginRegistry()
+        plugin_classes = registry.get_plugin_classes([str(plugin_file)], PreBuildPlugin)
+        assert plugin_classes._modules
+        assert sorted(plugin_classes) == ['koji_parent', 'my_plugin', 'pull_base_image']
+        assert plugin_classes['pull_base_image'].__name__ == 'MyPullPlugin'
+
+    def test_cache(self, tmpdir):
+        plugin_file = tmpdir.join('my_plugins.py')
+        plugin_file.write(PLUGIN_FILE_CONTENT)
+        cache_path = str(tmpdir.join('index.json'))
+
+        registry = PluginRegistry(cache_path=cache_path)
+        registry.get_plugin_classes([str(plugin_file)], PreBuildPlugin)
+        assert os.path.exists(cache_path)
+
+        registry = PluginRegistry(cache_path=cache_path)
+        flexmock(registry).should_receive('scan_file').never()
+        plugin_classes = registry.get_plugin_classes([str(plugin_file)], PreBuildPlugin)
+        assert sorted(plugin_classes) == ['koji_parent', 'my_plugin']
+
+
 def test_prebuild_plugin_failure(docker_tasker):  # noqa
     workflow = DockerBuildWorkflow(SOURCE, "test-image")
     setattr(workflow, 'builder', X())
@@ -328,6 +426,250 @@ class TestBuildPluginsRunner(object):
             assert getattr(plugin, key) == value
 
 
+class TestConcurrentPluginsRunner(object):
+
+    def make_workflow(self):
+        workflow = flexmock(plugins_timestamps={}, plugins_durations={},
+                            plugins_resource_usage={}, plugins_errors={},
+                            plugin_failed=False, prebuild_results={})
+        workflow.builder = flexmock(image_id='image-id', base_image=None)
+        workflow.builder.source = flexmock(dockerfile_path='dockerfile-path', path='path')
+        return workflow
+
+    def make_plugin(self, key, reads=None, writes=None, run=None, allowed_to_fail=True):
+        return type(str(key), (PreBuildPlugin,), {
+            'key': key,
+            'reads': reads,
+            'writes': writes,
+            'is_allowed_to_fail': allowed_to_fail,
+            'run': run or (lambda self: key),
+        })
+
+    def test_plugin_dependencies(self):
+        plugins = [
+            self.make_plugin('a', reads=(), writes=('files',)),
+            self.make_plugin('b', reads=(), writes=('artifacts',)),
+            self.make_plugin('c', reads=('files',), writes=()),
+            self.make_plugin('d', reads=('b',), writes=()),
+            self.make_plugin('e'),
+            self.make_plugin('f', reads=(), writes=()),
+            self.make_plugin('g', reads=(), writes=()),
+            self.make_plugin('h', reads=('plugin_failed',), writes=()),
+        ]
+        flexmock(PluginsRunner, load_plugins=lambda x: {})
+        runner = PreBuildPluginsRunner(flexmock(), self.make_workflow(), [])
+        assert runner.get_plugin_dependencies(plugins) == [
+            set(), set(), set([0]), set([1]), set([0, 1, 2, 3]), set([4]), set([4]),
+            set([0, 1, 2, 3, 4, 5, 6]),
+        ]
+
+    def test_run_concurrently(self):
+        started = threading.Event()
+
+        def waiting_run(self):
+            return started.wait(5)
+
+        def signalling_run(self):
+            started.set()
+            return True
+
+        first = self.make_plugin('first', reads=(), writes=(), run=waiting_run)
+        second = self.make_plugin('second', reads=(), writes=(), run=signalling_run)
+        third = self.make_plugin('third', reads=('first', 'second'), writes=())
+        flexmock(PluginsRunner, load_plugins=lambda x: {
+            first.key: first, second.key: second, third.key: third})
+
+        workflow = self.make_workflow()
+        runner = PreBuildPluginsRunner(flexmock(), workflow,
+                                       [{'name': 'first'}, {'name': 'second'},
+                                        {'name': 'third'}],
+                                       max_workers=2)
+        results = runner.run()
+
+        assert results == {'first': True, 'second': True, 'third': 'third'}
+        assert set(workflow.plugins_timestamps) == set(['first', 'second', 'third'])
+        assert set(workflow.plugins_durations) == set(['first', 'second', 'third'])
+        assert set(workflow.plugins_resource_usage) == set(['first', 'second', 'third'])
+        for usage in workflow.plugins_resource_usage.values():
+            assert 'cpu_user' in usage
+            assert 'http_requests' in usage
+
+    @pytest.mark.parametrize('keep_going', [True, False])
+    def test_run_concurrently_failure(self, keep_going):
+        def failing_run(self):
+            raise RuntimeError('failed')
+
+        failing = self.make_plugin('failing', reads=(), writes=(), run=failing_run,
+                                   allowed_to_fail=False)
+        dependent = self.make_plugin('dependent', reads=('failing',), writes=())
+        flexmock(PluginsRunner, load_plugins=lambda x: {
+            failing.key: failing, dependent.key: dependent})
+
+        workflow = self.make_workflow()
+        runner = PreBuildPluginsRunner(flexmock(), workflow,
+                                       [{'name': 'failing'}, {'name': 'dependent'}],
+                                       max_workers=2)
+        with pytest.raises(PluginFailedException) as exc:
+            runner.run(keep_going=keep_going)
+
+        assert "plugin 'failing' raised an exception" in str(exc.value)
+        assert workflow.plugin_failed
+        assert 'failing' in workflow.plugins_errors
+        assert ('dependent' in workflow.prebuild_results) == keep_going
+
+    @pytest.mark.parametrize('keep_going', [True, False])
+    def test_run_concurrently_missing_plugin(self, keep_going):
+        seen_failure = {}
+
+        def make_run(key):
+            def run(self):
+                seen_failure[key] = self.workflow.plugin_failed
+                return key
+            return run
+
+        plugins = [self.make_plugin(key, reads=(), writes=(), run=make_run(key))
+                   for key in ['before', 'after']]
+        flexmock(PluginsRunner, load_plugins=lambda x: dict((p.key, p) for p in plugins))
+
+        workflow = self.make_workflow()
+        runner = PreBuildPluginsRunner(flexmock(), workflow,
+                                       [{'name': 'before'}, {'name': 'missing'},
+                                        {'name': 'after'}],
+                                       max_workers=2)
+        if keep_going:
+            runner.run(keep_going=True)
+        else:
+            with pytest.raises(PluginFailedException) as exc:
+                runner.run()
+            assert "no such plugin: 'missing'" in str(exc.value)
+
+        # the missing plugin fails where it would fail when running plugins one by one
+        assert workflow.plugin_failed
+        if keep_going:
+            assert seen_failure == {'before': False, 'after': True}
+        else:
+            assert seen_failure == {'before': False}
+
+    def test_exit_plugins_concurrently(self):
+        order = []
+
+        def make_run(key, fail=False):
+            def run(self):
+                order.append(key)
+                if fail:
+                    raise RuntimeError(key)
+                return key
+            return run
+
+        plugins = [
+            type(str(key), (ExitPlugin,), {
+                'key': key, 'reads': reads, 'writes': (), 'run': make_run(key, fail),
+                'is_allowed_to_fail': False,
+            })
+            for key, reads, fail in [('import', (), True),
+                                     ('delete', (), True),
+                                     ('tag', ('import',), False),
+                                     ('publish', (), False),
+                                     ('mail', ('plugin_failed',), False)]
+        ]
+        plugins.append(type(str('store'), (ExitPlugin,), {'key': 'store',
+                                                          'run': make_run('store')}))
+        flexmock(PluginsRunner, load_plugins=lambda x: dict((p.key, p) for p in plugins))
+
+        workflow = self.make_workflow()
+        workflow.exit_results = {}
+        runner = ExitPluginsRunner(flexmock(), workflow,
+                                   [{'name': p.key} for p in plugins],
+                                   max_workers=3)
+        with pytest.raises(PluginFailedException) as exc:
+            runner.run(keep_going=True)
+
+        assert "Multiple plugins raised an exception" in str(exc.value)
+        assert set(workflow.plugins_errors) == set(['import', 'delete'])
+        assert set(workflow.exit_results) == set(['import', 'delete', 'tag', 'publish',
+                                                  'mail', 'store'])
+        assert order.index('tag') > order.index('import')
+        # plugins checking for failures see failures of all plugins before them
+        assert order.index('mail') > max(order.index(key)
+                                         for key in ['import', 'delete', 'tag', 'publish'])
+        assert order[-1] == 'store'
+
+
+class TestPrefetchPluginsRunner(object):
+
+    def make_plugin(self, key, prefetch=None):
+        attrs = {
+            'key': key,
+            'run': lambda self: self.get_prefetched(),
+        }
+        if prefetch:
+            attrs.update({'can_prefetch': True, 'prefetch': prefetch})
+        return type(str(key), (PreBuildPlugin,), attrs)
+
+    def test_prefetch(self):
+        def failing_prefetch(self):
+            raise RuntimeError('failed')
+
+        plugins = [
+            self.make_plugin('prefetched', prefetch=lambda self: 'result'),
+            self.make_plugin('failing', prefetch=failing_prefetch),
+            self.make_plugin('plain'),
+        ]
+        flexmock(PluginsRunner, load_plugins=lambda x: dict((p.key, p) for p in plugins))
+        workflow = flexmock(plugins_timestamps={}, plugins_durations={},
+                            plugins_resource_usage={}, plugins_errors={},
+                            plugin_failed=False, prebuild_results={}, prefetch_results={})
+        workflow.builder = flexmock(image_id='image-id', base_image=None)
+        workflow.builder.source = flexmock(dockerfile_path='dockerfile-path', path='path')
+        plugins_conf = [{'name': 'prefetched'}, {'name': 'failing'}, {'name': 'plain'},
+                        {'name': 'missing', 'required': False}]
+
+        prefetch_runner = PrefetchPluginsRunner(flexmock(), workflow, plugins_conf)
+        prefetch_runner.run()
+        prefetch_runner.wait()
+        assert set(workflow.prefetch_results) == set(['prefetched', 'failing'])
+
+        results = PreBuildPluginsRunner(flexmock(), workflow, plugins_conf).run()
+        assert results == {'prefetched': 'result', 'failing': None, 'plain': None}
+        assert not workflow.prefetch_results
+        assert not workflow.plugin_failed
+
+    def test_prefetch_wait(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow_prefetch(self):
+            started.set()
+            finish.wait(5)
+            return 'result'
+
+        plugin = self.make_plugin('slow', prefetch=slow_prefetch)
+        flexmock(PluginsRunner, load_plugins=lambda x: {plugin.key: plugin})
+        workflow = flexmock(plugins_timestamps={}, plugins_durations={},
+                            plugins_resource_usage={}, plugins_errors={},
+                            plugin_failed=False, prebuild_results={}, prefetch_results={})
+        workflow.builder = flexmock(image_id='image-id', base_image=None)
+        workflow.builder.source = flexmock(dockerfile_path='dockerfile-path', path='path')
+
+        prefetch_runner = PrefetchPluginsRunner(flexmock(), workflow, [{'name': 'slow'}])
+        prefetch_runner.run()
+        assert started.wait(5)
+        async_result = workflow.prefetch_results['slow']
+        original_wait = async_result.wait
+        waits = []
+
+        def wait(timeout=None):
+            waits.append(timeout)
+            finish.set()
+            return original_wait(timeout)
+
+        flexmock(async_result, wait=wait)
+        assert plugin(flexmock(), workflow).get_prefetched() == 'result'
+        # waiting without timeout can't be interrupted by signals
+        assert waits[0] == 1
+        prefetch_runner.wait()
+
+
 class TestInputPluginsRunner(object):
     def test_substitution(self, tmpdir):
         tmpdir_path = str(tmpdir)
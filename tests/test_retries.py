@@ -0,0 +1,157 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from flexmock import flexmock
+import pytest
+
+from atomic_reactor import retries
+from atomic_reactor.retries import (RetryPolicy, RetryMetrics, CircuitBreakers, CircuitOpenError,
+                                    jitter)
+
+
+class TransientError(Exception):
+    pass
+
+
+class PermanentError(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(retries, 'metrics', RetryMetrics())
+    monkeypatch.setattr(retries, 'breakers', CircuitBreakers())
+
+
+class Flaky(object):
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def is_transient(exc):
+    return isinstance(exc, TransientError)
+
+
+def test_retry_until_success():
+    delays = []
+    flexmock(time).should_receive('sleep').replace_with(delays.append)
+    policy = RetryPolicy('test', 3, 5, is_transient=is_transient)
+    function = Flaky(TransientError(), TransientError(), 'done')
+
+    assert policy.call(function) == 'done'
+    assert function.calls == 3
+    assert len(delays) == 2
+    # decorrelated jitter stays between the base delay and the cap
+    assert all(5 <= delay <= 20 for delay in delays)
+    assert retries.metrics.get()['test'] == {'attempts': 3, 'failures': 2, 'retries': 2}
+
+
+@pytest.mark.parametrize('retry_times', [-1, 0, 2])
+def test_retry_exhausted(retry_times):
+    flexmock(time).should_receive('sleep')
+    policy = RetryPolicy('test', retry_times, 1, is_transient=is_transient)
+    function = Flaky(*[TransientError()] * 5)
+
+    if retry_times < 0:
+        assert policy.call(function) is None
+    else:
+        with pytest.raises(TransientError):
+            policy.call(function)
+    assert function.calls == max(retry_times + 1, 0)
+
+
+def test_retry_permanent_error():
+    flexmock(time).should_receive('sleep').never()
+    policy = RetryPolicy('test', 3, 1, is_transient=is_transient)
+    function = Flaky(PermanentError(), 'done')
+
+    with pytest.raises(PermanentError):
+        policy.call(function)
+    assert function.calls == 1
+    assert retries.metrics.get()['test']['permanent'] == 1
+
+
+def test_retry_deadline():
+    flexmock(time).should_receive('sleep').never()
+    policy = RetryPolicy('test', 3, 10, deadline=5, is_transient=is_transient)
+    function = Flaky(TransientError(), 'done')
+
+    with pytest.raises(TransientError):
+        policy.call(function)
+    assert retries.metrics.get()['test']['deadline'] == 1
+
+
+def test_circuit_breaker():
+    flexmock(time).should_receive('sleep')
+    breaker = retries.breakers.get('registry.example.com')
+    breaker.threshold = 2
+    policy = RetryPolicy('test', 3, 1, max_delay=1, is_transient=is_transient)
+    function = Flaky(TransientError(), TransientError(), 'done')
+
+    # opening the breaker ends the retries with the last error
+    with pytest.raises(TransientError):
+        policy.call(function, remote='registry.example.com')
+    assert function.calls == 2
+    assert breaker.is_open()
+
+    # once the breaker resets, the host is tried again
+    breaker.opened_at -= breaker.reset
+    assert policy.call(Flaky('done'), remote='registry.example.com') == 'done'
+    assert not breaker.is_open()
+    assert breaker.failures == 0
+
+
+def test_circuit_breaker_open():
+    breaker = retries.breakers.get('registry.example.com')
+    breaker.threshold = 1
+    breaker.failed()
+    flexmock(time).should_receive('sleep').never()
+    policy = RetryPolicy('test', 3, 1, is_transient=is_transient)
+    function = Flaky('done')
+
+    with pytest.raises(CircuitOpenError) as exc_info:
+        policy.call(function, remote='registry.example.com')
+    assert exc_info.value.host == 'registry.example.com'
+    assert 0 < exc_info.value.remaining <= breaker.reset
+    assert function.calls == 0
+    assert retries.metrics.get()['test'] == {'refused': 1}
+
+    # other hosts are not affected
+    assert policy.call(function, remote='other.example.com') == 'done'
+
+
+def test_circuit_breaker_permanent_error():
+    flexmock(time).should_receive('sleep').never()
+    breaker = retries.breakers.get('registry.example.com')
+    breaker.threshold = 1
+    policy = RetryPolicy('test', 1, 1, is_transient=is_transient)
+
+    with pytest.raises(PermanentError):
+        policy.call(Flaky(PermanentError()), remote='registry.example.com')
+    # the host answered, so it stays available to other operations
+    assert breaker.remaining() == 0
+    assert policy.call(Flaky('done'), remote='registry.example.com') == 'done'
+
+
+def test_jitter():
+    values = [jitter(10, ratio=0.5) for _ in range(100)]
+    assert all(5 <= value <= 15 for value in values)
+    assert len(set(values)) > 1
+    assert jitter(0) == 0
@@ -10,6 +10,7 @@ from __future__ import print_function, unicode_literals
 
 from tests.fixtures import temp_image_name, docker_tasker  # noqa
 
+from atomic_reactor import retries
 from atomic_reactor.core import DockerTasker, retry, RetryGeneratorException
 from atomic_reactor.util import ImageName, clone_git_repo, CommandResult
 from tests.constants import LOCALHOST_REGISTRY, INPUT_IMAGE, DOCKERFILE_GIT, MOCK, COMMAND
@@ -165,6 +166,96 @@ def test_inspect_image():
     assert isinstance(inspect_data, dict)
 
 
+def test_inspect_images_concurrently():
+    if MOCK:
+        mock_docker()
+
+    t = DockerTasker(workers=2)
+    try:
+        result = t.submit(t.inspect_image, input_image_name)
+        assert isinstance(result.get(), dict)
+
+        inspected = t.map_concurrently(t.inspect_image, [input_image_name] * 3)
+        assert len(inspected) == 3
+        assert all(isinstance(data, dict) for data in inspected)
+    finally:
+        t.close()
+
+
+def test_map_concurrently_error():
+    if MOCK:
+        mock_docker()
+
+    def fail(item):
+        if item == 2:
+            raise RuntimeError('failed on {0}'.format(item))
+        return item
+
+    t = DockerTasker()
+    assert t.map_concurrently(fail, [0, 1]) == [0, 1]
+    with pytest.raises(RuntimeError) as exc:
+        t.map_concurrently(fail, [0, 1, 2, 3])
+    assert 'failed on 2' in str(exc.value)
+    t.close()
+    # the pool is created again when needed
+    assert t.submit(fail, 1).get() == 1
+    t.close()
+
+
+def test_inspect_image_cached():
+    if MOCK:
+        mock_docker()
+
+    t = DockerTasker()
+    image_id = 'sha256:1234'
+    inspection = {'Id': image_id, 'RepoTags': [INPUT_IMAGE]}
+    (flexmock(t.d.wrapped)
+        .should_receive('inspect_image')
+        .and_return(inspection)
+        .times(3))
+    flexmock(t.d.wrapped).should_receive('tag').and_return(True)
+
+    assert t.inspect_image(input_image_name) == inspection
+    assert t.inspect_image(INPUT_IMAGE) == inspection
+    assert t.inspect_image(image_id) == inspection
+    assert (t.image_cache.hits, t.image_cache.misses) == (2, 1)
+    # other builds may remove the image, existence is never taken from the cache
+    assert t.image_exists(INPUT_IMAGE)
+    assert (t.image_cache.hits, t.image_cache.misses) == (2, 1)
+
+    # callers can't change the cached inspection
+    t.inspect_image(image_id)['RepoTags'].append('junk')
+    assert t.inspect_image(image_id) == inspection
+
+    # moving the tag away from the image makes it inspected again
+    t.tag_image(ImageName.parse('other'), input_image_name)
+    assert t.inspect_image(image_id) == inspection
+
+
+def test_inspect_image_cache_keys():
+    if MOCK:
+        mock_docker()
+
+    t = DockerTasker()
+    image_id = 'sha256:1234'
+    inspection = {'Id': image_id, 'RepoTags': ['fedora:latest']}
+    (flexmock(t.d.wrapped)
+        .should_receive('inspect_image')
+        .and_return(inspection)
+        .and_raise(docker.errors.NotFound, 'gone', flexmock(status_code=404, content='gone'))
+        .times(2))
+
+    assert t.inspect_image('fedora') == inspection
+    assert t.inspect_image('fedora:latest') == inspection
+    assert t.inspect_image(ImageName.parse('fedora:latest')) == inspection
+    assert (t.image_cache.hits, t.image_cache.misses) == (2, 1)
+
+    # the image was removed by someone else
+    assert not t.image_exists('fedora:latest')
+    assert t.image_cache.get('fedora') is None
+    assert t.image_cache.get(image_id) is None
+
+
 def test_tag_image(temp_image_name):  # noqa
     if MOCK:
         mock_docker()
@@ -463,3 +554,21 @@ def test_retry_generator(exc, in_init, retry_times):
     else:
         t.retry_generator(lambda *args, **kwargs: simplegen(),
                           *my_args, **my_kwargs)
+
+
+def test_retry_generator_circuit_open(monkeypatch):
+    monkeypatch.setattr(retries, 'breakers', retries.CircuitBreakers())
+    breaker = retries.breakers.get('registry.example.com')
+    breaker.threshold = 1
+    breaker.failed()
+    (flexmock(time)
+        .should_receive('sleep')
+        .never())
+    (flexmock(atomic_reactor.util)
+        .should_receive('wait_for_command')
+        .never())
+
+    t = DockerTasker(retry_times=3)
+    with pytest.raises(RetryGeneratorException) as exc:
+        t.retry_generator(lambda *args, **kwargs: iter([]), remote='registry.example.com')
+    assert isinstance(exc.value.error, retries.CircuitOpenError)
@@ -0,0 +1,149 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+
+import pytest
+
+from atomic_reactor.build import BuildResult
+from atomic_reactor.constants import PLUGIN_BUILD_ORCHESTRATE_KEY
+from atomic_reactor.timeline import Timeline, parse_timestamp, ORCHESTRATOR, BUILD
+
+
+START = datetime.datetime(2018, 1, 1, 10, 0, 0)
+
+
+def plugins_metadata(*plugins):
+    """
+    :param plugins: tuples (name, offset, duration), in seconds from START
+    """
+    return {
+        'timestamps': {name: (START + datetime.timedelta(seconds=offset)).isoformat()
+                       for name, offset, _ in plugins},
+        'durations': {name: duration for name, _, duration in plugins},
+    }
+
+
+class FakeWorkflow(object):
+    def __init__(self, metadata, worker_builds=None):
+        self.plugins_timestamps = metadata['timestamps']
+        self.plugins_durations = metadata['durations']
+        annotations = {}
+        if worker_builds:
+            annotations['worker-builds'] = {
+                platform: {'plugins-metadata': worker_metadata}
+                for platform, worker_metadata in worker_builds.items()
+            }
+        self.build_result = BuildResult(image_id='image', annotations=annotations)
+
+
+def orchestrated_workflow():
+    return FakeWorkflow(plugins_metadata(('reactor_config', 0, 1),
+                                         (PLUGIN_BUILD_ORCHESTRATE_KEY, 1, 100),
+                                         ('fetch_worker_metadata', 101, 2),
+                                         ('koji_import', 103, 5)),
+                        worker_builds={
+                            'x86_64': plugins_metadata(('pull_base_image', 10, 5),
+                                                       ('docker_api', 15, 30),
+                                                       ('tag_and_push', 45, 10)),
+                            'ppc64le': plugins_metadata(('pull_base_image', 10, 20),
+                                                        ('fetch_maven_artifacts', 10, 40),
+                                                        ('docker_api', 50, 40),
+                                                        ('tag_and_push', 90, 5)),
+                        })
+
+
+@pytest.mark.parametrize(('timestamp', 'expected'), [
+    ('2018-01-01T10:00:00', START),
+    ('2018-01-01T10:00:00.500000', START + datetime.timedelta(milliseconds=500)),
+])
+def test_parse_timestamp(timestamp, expected):
+    assert parse_timestamp(timestamp) == expected
+
+
+def test_parse_timestamp_invalid():
+    with pytest.raises(ValueError):
+        parse_timestamp('yesterday')
+
+
+def test_critical_path():
+    timeline = Timeline.from_workflow(orchestrated_workflow())
+
+    assert timeline.root == ORCHESTRATOR
+    assert timeline.workers == ['ppc64le', 'x86_64']
+    assert timeline.get_gating_worker() == 'ppc64le'
+    assert [(event.process, event.name) for event in timeline.get_critical_path()] == [
+        (ORCHESTRATOR, 'reactor_config'),
+        ('ppc64le', 'fetch_maven_artifacts'),
+        ('ppc64le', 'docker_api'),
+        ('ppc64le', 'tag_and_push'),
+        (ORCHESTRATOR, 'fetch_worker_metadata'),
+        (ORCHESTRATOR, 'koji_import'),
+    ]
+
+    summary = timeline.get_summary()
+    assert summary['duration'] == 108
+    assert summary['gating-platform'] == 'ppc64le'
+    assert summary['plugins'][1] == {
+        'process': 'ppc64le',
+        'plugin': 'fetch_maven_artifacts',
+        'start': '2018-01-01T10:00:10',
+        'duration': 40,
+    }
+
+
+def test_critical_path_without_workers():
+    metadata = plugins_metadata(('reactor_config', 0, 1),
+                                ('docker_api', 1, 10),
+                                ('unfinished', 11, None))
+    metadata['timestamps']['invalid'] = 'yesterday'
+    metadata['durations']['invalid'] = 1
+    timeline = Timeline.from_workflow(FakeWorkflow(metadata))
+
+    assert timeline.root == BUILD
+    assert timeline.workers == []
+    assert timeline.get_gating_worker() is None
+    assert [event.name for event in timeline.get_critical_path()] == [
+        'reactor_config', 'docker_api',
+    ]
+
+
+def test_empty_timeline():
+    timeline = Timeline.from_workflow(FakeWorkflow(plugins_metadata()))
+
+    assert timeline.get_critical_path() == []
+    assert timeline.get_summary() == {'duration': None, 'gating-platform': None, 'plugins': []}
+    assert timeline.get_trace() == {'traceEvents': [], 'displayTimeUnit': 'ms'}
+
+
+def test_trace():
+    trace = Timeline.from_workflow(orchestrated_workflow()).get_trace()
+    events = trace['traceEvents']
+
+    processes = {event['pid']: event['args']['name']
+                 for event in events if event['ph'] == 'M'}
+    assert processes == {1: ORCHESTRATOR, 2: 'ppc64le', 3: 'x86_64'}
+
+    plugins = {(processes[event['pid']], event['name']): event
+               for event in events if event['ph'] == 'X'}
+    assert len(plugins) == 11
+
+    maven = plugins['ppc64le', 'fetch_maven_artifacts']
+    assert maven['ts'] == 10 * 1000000
+    assert maven['dur'] == 40 * 1000000
+    assert maven['cat'] == 'critical-path'
+    # ran concurrently with pull_base_image, which is not on the critical path
+    pull = plugins['ppc64le', 'pull_base_image']
+    assert pull['cat'] == 'plugin'
+    assert pull['tid'] != maven['tid']
+
+    assert plugins['x86_64', 'docker_api']['cat'] == 'plugin'
+    assert plugins[ORCHESTRATOR, PLUGIN_BUILD_ORCHESTRATE_KEY]['cat'] == 'plugin'
+    assert plugins[ORCHESTRATOR, 'koji_import']['cat'] == 'critical-path'
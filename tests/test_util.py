@@ -14,8 +14,9 @@ import tempfile
 import pytest
 import requests
 import responses
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
 import six
+from six.moves.urllib.parse import urlparse, parse_qs
 import subprocess
 import time
 
@@ -25,24 +26,29 @@ from flexmock import flexmock
 
 from collections import OrderedDict
 import docker
+from dockerfile_parse import DockerfileParser
 from atomic_reactor.build import BuildResult
 from atomic_reactor.constants import (IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR)
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.util import (ImageName, wait_for_command, clone_git_repo,
                                  LazyGit, figure_out_build_file,
                                  render_yum_repo, process_substitutions,
-                                 get_checksums, print_version_of_tools,
+                                 get_checksums, HashingWriter, read_ahead,
+                                 print_version_of_tools,
                                  get_version_of_tools, get_preferred_label_key,
                                  human_size, CommandResult,
                                  registry_hostname, Dockercfg, RegistrySession,
                                  get_manifest_digests, ManifestDigest,
+                                 RegistryContentCache,
                                  get_build_json, is_scratch_build, df_parser,
                                  are_plugins_in_order, LabelFormatter,
                                  get_manifest_media_type,
                                  get_manifest_media_version,
                                  get_primary_images,
-                                 get_image_upload_filename)
-from atomic_reactor import util
+                                 get_image_upload_filename,
+                                 get_resource_usage, get_resource_usage_delta,
+                                 count_call)
+from atomic_reactor import retries, util
 from tests.constants import (DOCKERFILE_GIT, FLATPAK_GIT,
                              INPUT_IMAGE, MOCK, DOCKERFILE_SHA1, MOCK_SOURCE)
 from atomic_reactor.constants import INSPECT_CONFIG
@@ -146,6 +152,29 @@ class TestCommandResult(object):
         cr.parse_item(item)
         assert cr.logs == [expected]
 
+    def test_logs_path(self, tmpdir):
+        logs_path = str(tmpdir.join('build.log'))
+        cr = CommandResult(logs_path=logs_path, tail_lines=2)
+        for i in range(5):
+            cr.parse_item({"stream": "line %d‘" % i})
+        cr.close()
+
+        assert cr.logs_path == logs_path
+        assert cr.logs == ["line 3‘", "line 4‘"]
+        assert len(cr.parsed_logs) == 2
+        with open(logs_path, 'rb') as f:
+            content = f.read().decode('utf-8')
+        assert content.splitlines() == ["line %d‘" % i for i in range(5)]
+
+    def test_wait_for_command_logs_path(self, tmpdir):
+        logs_path = str(tmpdir.join('build.log'))
+        logs_gen = iter([{"stream": "first"}, {"stream": "second"}])
+        cr = wait_for_command(logs_gen, logs_path=logs_path)
+
+        assert cr.logs == ["first", "second"]
+        with open(logs_path) as f:
+            assert f.read() == "first\nsecond\n"
+
 
 @requires_internet
 def test_clone_git_repo_by_sha1(tmpdir):
@@ -247,6 +276,76 @@ def test_get_hexdigests(tmpdir, content, algorithms, expected):
         assert checksums == expected
 
 
+def test_get_checksums_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr(util, 'checksum_cache', util.ChecksumCache())
+    path = str(tmpdir.join('image.tar'))
+    with open(path, 'wb') as f:
+        f.write(b'abc')
+
+    assert get_checksums(path, ['md5']) == {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}
+    key = util.ChecksumCache.key(path)
+    assert util.checksum_cache.get(key, ['md5', 'sha1']) == \
+        {'md5': '900150983cd24fb0d6963f7d28e17f72'}
+
+    # only the missing algorithm is computed
+    assert get_checksums(path, ['md5', 'sha1']) == {
+        'md5sum': '900150983cd24fb0d6963f7d28e17f72',
+        'sha1sum': 'a9993e364706816aba3e25717850c26c9cd0d89d',
+    }
+    assert get_checksums(path, ['sha1', 'md5'])['sha1sum'] == \
+        'a9993e364706816aba3e25717850c26c9cd0d89d'
+
+    # changed files are read again
+    with open(path, 'wb') as f:
+        f.write(b'abcd')
+    os.utime(path, (0, 0))
+    assert get_checksums(path, ['md5']) == {'md5sum': 'e2fc714c4727ee9395f324cd2e7f331f'}
+
+
+def test_hashing_writer(tmpdir, monkeypatch):
+    monkeypatch.setattr(util, 'checksum_cache', util.ChecksumCache())
+    path = str(tmpdir.join('image.tar'))
+    with HashingWriter(path) as writer:
+        assert writer.write(b'ab') == 2
+        writer.write(b'c')
+        assert writer.tell() == 3
+
+    assert writer.closed
+    with open(path, 'rb') as f:
+        assert f.read() == b'abc'
+
+    expected = {
+        'md5sum': '900150983cd24fb0d6963f7d28e17f72',
+        'sha256sum': 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad',
+    }
+    # checksums are known without reading the file
+    key = util.ChecksumCache.key(path)
+    assert util.checksum_cache.get(key, ['md5', 'sha256']) == writer.hexdigests()
+    assert get_checksums(path, ['md5', 'sha256']) == expected
+
+
+def test_read_ahead():
+    assert list(read_ahead(six.BytesIO(b'abcdefg'), 3)) == [b'abc', b'def', b'g']
+    assert list(read_ahead(six.BytesIO(b''), 3)) == []
+
+    # consumer stopping early doesn't leave the reader behind
+    stream = six.BytesIO(b'a' * 100)
+    chunks = read_ahead(stream, 1, depth=2)
+    assert next(chunks) == b'a'
+    chunks.close()
+    assert stream.tell() < 100
+
+
+def test_read_ahead_error():
+    class BrokenStream(object):
+        def read(self, size):
+            raise IOError('connection reset')
+
+    with pytest.raises(IOError) as exc:
+        list(read_ahead(BrokenStream(), 3))
+    assert 'connection reset' in str(exc.value)
+
+
 @pytest.mark.parametrize('path, image_type, expected', [
     ('foo.tar', IMAGE_TYPE_DOCKER_ARCHIVE, 'docker-image-XXX.x86_64.tar'),
     ('foo.tar.gz', IMAGE_TYPE_DOCKER_ARCHIVE, 'docker-image-XXX.x86_64.tar.gz'),
@@ -385,6 +484,133 @@ def test_registry_session(tmpdir, registry, insecure, method, responses_method):
     assert res.text == 'A-OK'
 
 
+class TestRegistryContentCache(object):
+    DIGEST = 'sha256:' + 'a' * 64
+
+    REGISTRY = 'registry.example.com'
+
+    def test_key(self):
+        cache = RegistryContentCache()
+        assert cache.key(self.REGISTRY, '/v2/spam/manifests/latest') is None
+        assert cache.key(self.REGISTRY,
+                         '/v2/spam/blobs/uploads/?mount={}&from=foo'.format(self.DIGEST)) is None
+        assert cache.key(self.REGISTRY, '/v2/foo/spam/manifests/' + self.DIGEST) == \
+            (self.REGISTRY, 'foo/spam', 'manifests', self.DIGEST)
+        assert cache.key(self.REGISTRY, '/v2/spam/blobs/' + self.DIGEST) == \
+            (self.REGISTRY, 'spam', 'blobs', self.DIGEST)
+
+    def test_lru(self):
+        cache = RegistryContentCache(max_entries=2, max_size=5)
+        urls = ['/v2/spam/blobs/sha256:{}'.format(c * 64) for c in 'abc']
+        headers = {'Content-Type': 'application/json', 'Other': 'header'}
+        for url in urls:
+            cache.set(self.REGISTRY, url, b'{}', headers)
+        cache.set(self.REGISTRY, '/v2/spam/blobs/sha256:' + 'd' * 64, b'too large', headers)
+
+        assert cache.get(self.REGISTRY, urls[0]) is None
+        assert cache.get(self.REGISTRY, urls[1]) == (b'{}', {'Content-Type': 'application/json'})
+        assert cache.get(self.REGISTRY, urls[2]) is not None
+        assert cache.get(self.REGISTRY, '/v2/spam/blobs/sha256:' + 'd' * 64) is None
+        assert cache.hits == 2
+        assert cache.misses == 2
+
+    def test_location(self):
+        cache = RegistryContentCache()
+        url = '/v2/spam/manifests/' + self.DIGEST
+        cache.set(self.REGISTRY, url, b'{}', {})
+
+        # content is only known to exist where it was fetched from
+        assert cache.get(self.REGISTRY, url) is not None
+        assert cache.get('other.example.com', url) is None
+        assert cache.get(self.REGISTRY, '/v2/eggs/manifests/' + self.DIGEST) is None
+
+    def test_disk(self, tmpdir):
+        url = '/v2/spam/manifests/' + self.DIGEST
+        path = str(tmpdir.join('cache'))
+        RegistryContentCache(path=path).set(self.REGISTRY, url, b'{}',
+                                            {'Content-Type': 'application/json'})
+
+        assert RegistryContentCache(path=path).get(self.REGISTRY, url) == \
+            (b'{}', {'Content-Type': 'application/json'})
+        assert RegistryContentCache(path=path).get('other.example.com', url) is None
+        assert RegistryContentCache().get(self.REGISTRY, url) is None
+
+    @responses.activate
+    def test_registry_session(self):
+        cache = RegistryContentCache()
+        session = RegistrySession('registry.example.com', content_cache=cache)
+        base = 'https://registry.example.com'
+        by_digest = '/v2/spam/manifests/' + self.DIGEST
+        by_tag = '/v2/spam/manifests/latest'
+        headers = {'Content-Type': 'application/json', 'Docker-Content-Digest': self.DIGEST}
+        responses.add(responses.GET, base + by_digest, body='{"a": 1}', adding_headers=headers)
+        responses.add(responses.GET, base + by_tag, body='{"a": 1}', adding_headers=headers)
+
+        for cached in [False, True]:
+            response = session.get(by_digest)
+            assert response.json() == {'a': 1}
+            assert response.headers['Docker-Content-Digest'] == self.DIGEST
+            if cached:
+                assert int(response.headers['Content-Length']) == len(b'{"a": 1}')
+            session.get(by_tag)
+
+        assert len(responses.calls) == 3
+
+        # the same content in another registry has to be fetched from it
+        other = RegistrySession('other.example.com', content_cache=cache)
+        responses.add(responses.GET, 'https://other.example.com' + by_digest,
+                      body='{"a": 1}', adding_headers=headers)
+        other.get(by_digest)
+        assert len(responses.calls) == 4
+
+
+@responses.activate
+def test_registry_session_token_auth(monkeypatch):
+    monkeypatch.setattr(util, 'registry_tokens', util.RegistryTokenCache())
+    base = 'https://registry.example.com'
+    realm = 'https://auth.example.com/token'
+
+    def token_callback(request):
+        query = parse_qs(urlparse(request.url).query)
+        assert query['service'] == ['registry.example.com']
+        token = ' '.join(sorted(query['scope']))
+        return (200, {}, json.dumps({'token': token, 'expires_in': 300}))
+
+    def registry_callback(request):
+        repo = urlparse(request.url).path.split('/')[2]
+        authorization = request.headers.get('Authorization', '')
+        if 'repository:{}:pull'.format(repo) in authorization:
+            return (200, {}, '{}')
+        challenge = ('Bearer realm="{}",service="registry.example.com",'
+                     'scope="repository:{}:pull"'.format(realm, repo))
+        return (401, {'WWW-Authenticate': challenge}, '')
+
+    responses.add_callback(responses.GET, realm, callback=token_callback)
+    for repo in ('spam', 'eggs'):
+        responses.add_callback(responses.GET, '{}/v2/{}/manifests/latest'.format(base, repo),
+                               callback=registry_callback)
+
+    def calls_to(url):
+        return len([call for call in responses.calls if call.request.url.startswith(url)])
+
+    session = RegistrySession('registry.example.com', repositories=['eggs', 'spam'])
+    # the first request is challenged
+    assert session.get('/v2/spam/manifests/latest').status_code == 200
+    assert calls_to(base) == 2
+    assert calls_to(realm) == 1
+
+    # one token covering all the repositories is requested and used right away
+    assert session.get('/v2/eggs/manifests/latest').status_code == 200
+    assert calls_to(base) == 3
+    assert calls_to(realm) == 2
+
+    # tokens are reused by new sessions
+    session = RegistrySession('registry.example.com')
+    assert session.get('/v2/spam/manifests/latest').status_code == 200
+    assert calls_to(base) == 4
+    assert calls_to(realm) == 2
+
+
 @pytest.mark.parametrize(('version', 'expected'), [
     ('v1', 'application/vnd.docker.distribution.manifest.v1+json'),
     ('v2', 'application/vnd.docker.distribution.manifest.v2+json'),
@@ -700,6 +926,61 @@ def test_get_manifest_digests_connection_error(tmpdir):
         get_manifest_digests(**kwargs)
 
 
+@pytest.mark.parametrize('head', [True, False])
+@pytest.mark.parametrize('error', [ConnectTimeout, ReadTimeout])
+@responses.activate
+def test_get_manifest_digests_no_response(head, error):
+    image = ImageName.parse('example.com/spam:latest')
+    registry = 'https://example.com'
+    url = 'https://example.com/v2/spam/manifests/latest'
+    responses.add(responses.HEAD, url, body=error())
+    responses.add(responses.GET, url, body=error())
+
+    with pytest.raises(error):
+        get_manifest_digests(image, registry, versions=('v1', 'v2'), head=head,
+                             max_workers=2)
+
+
+@pytest.mark.parametrize('head_allowed', [True, False])
+@responses.activate
+def test_get_manifest_digests_head(head_allowed):
+    image = ImageName.parse('example.com/spam:latest')
+    registry = 'https://example.com'
+    url = 'https://example.com/v2/spam/manifests/latest'
+    versions = ('v1', 'v2', 'v2_list')
+
+    def request_callback(request):
+        if request.method == 'HEAD' and not head_allowed:
+            return (405, {}, '')
+
+        media_type = request.headers['Accept']
+        if media_type.endswith('list.v2+json'):
+            return (404, {}, '')
+        digest = 'v2-digest' if media_type.endswith('v2+json') else 'v1-digest'
+        headers = {
+            'Content-Type': media_type,
+            'Docker-Content-Digest': digest,
+        }
+        return (200, headers, '')
+
+    responses.add_callback(responses.HEAD, url, callback=request_callback)
+    responses.add_callback(responses.GET, url, callback=request_callback)
+
+    session = RegistrySession(registry)
+    digests = get_manifest_digests(image, registry, versions=versions,
+                                   registry_session=session, head=True,
+                                   max_workers=len(versions))
+    assert digests.v1 == 'v1-digest'
+    assert digests.v2 == 'v2-digest'
+    assert digests.v2_list is None
+
+    methods = [call.request.method for call in responses.calls]
+    if head_allowed:
+        assert methods == ['HEAD'] * len(versions)
+    else:
+        assert sorted(methods) == ['GET'] * len(versions) + ['HEAD'] * len(versions)
+
+
 @pytest.mark.parametrize('namespace,repo,explicit,expected', [
     ('foo', 'bar', False, 'foo/bar'),
     ('foo', 'bar', True, 'foo/bar'),
@@ -830,6 +1111,42 @@ def test_df_parser_parent_env_wf(tmpdir, caplog, env_arg):
         assert df.labels.get('label') == 'foobar ' + env_arg[0].split('=', 1)[1]
 
 
+def test_df_parser_shared(tmpdir, monkeypatch):
+    df_content = dedent("""\
+        FROM fedora
+        LABEL label="foobar"
+        """)
+    tmpdir.join('Dockerfile').write(df_content)
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    df = df_parser(str(tmpdir), workflow=workflow)
+    assert df_parser(str(tmpdir), workflow=workflow) is df
+    assert df_parser(str(tmpdir), workflow=workflow, env_replace=False) is not df
+    assert df_parser(str(tmpdir)) is not df
+
+    parses = []
+    structure = DockerfileParser.structure
+    monkeypatch.setattr(DockerfileParser, 'structure',
+                        property(lambda self: parses.append(1) or structure.fget(self)))
+
+    assert df.labels == {'label': 'foobar'}
+    # views are parsed once and copies are handed out
+    labels = df.labels
+    dict.__setitem__(labels, 'junk', 'value')
+    assert df.labels == {'label': 'foobar'}
+    assert df.baseimage == 'fedora'
+    assert len(parses) == 1
+
+    # changes are written to the Dockerfile
+    df.labels['other'] = 'value'
+    assert df.labels == {'label': 'foobar', 'other': 'value'}
+    assert 'other=value' in tmpdir.join('Dockerfile').read()
+
+    # changes made to the Dockerfile are noticed
+    tmpdir.join('Dockerfile').write(df_content.replace('fedora', 'centos'))
+    assert df.baseimage == 'centos'
+    assert df.labels == {'label': 'foobar'}
+
+
 @pytest.mark.parametrize(('available', 'requested', 'result'), (
     (['spam', 'bacon', 'eggs'], ['spam'], True),
     (['spam', 'bacon', 'eggs'], ['spam', 'bacon'], True),
@@ -899,8 +1216,10 @@ def test_get_primary_images(tag_conf, tag_annotation, expected):
 
 @pytest.mark.parametrize('retry_times', [0, 1, 2, 3])
 @pytest.mark.parametrize('raise_exc', [True, False])
-def test_clone_git_repo_retry(tmpdir, retry_times, raise_exc):
+def test_clone_git_repo_retry(tmpdir, monkeypatch, retry_times, raise_exc):
     tmpdir_path = str(tmpdir.realpath())
+    # failures must not hold off other tests cloning from the same host
+    monkeypatch.setattr(retries, 'breakers', retries.CircuitBreakers())
     (flexmock(time)
         .should_receive('sleep')
         .and_return(None))
@@ -925,3 +1244,34 @@ def test_clone_git_repo_retry(tmpdir, retry_times, raise_exc):
     exception = subprocess.CalledProcessError if raise_exc else CustomTestException
     with pytest.raises(exception):
         clone_git_repo(DOCKERFILE_GIT, tmpdir_path, retry_times=retry_times)
+
+
+def test_get_resource_usage():
+    start = get_resource_usage()
+    count_call('http_requests')
+    count_call('docker_api_calls')
+    count_call('docker_api_calls')
+    delta = get_resource_usage_delta(start, get_resource_usage())
+
+    assert delta['http_requests'] == 1
+    assert delta['docker_api_calls'] == 2
+    assert delta['max_rss_delta'] >= 0
+    assert delta['cpu_user'] >= 0
+    assert delta['cpu_system'] >= 0
+    if os.path.exists('/proc/self/io'):
+        assert 'read_bytes' in delta
+        assert 'write_bytes' in delta
+
+
+def test_get_resource_usage_delta():
+    start = {'cpu_user': 1.5, 'cpu_system': 0.25, 'max_rss': 1000,
+             'http_requests': 3, 'docker_api_calls': 1}
+    end = {'cpu_user': 2.0, 'cpu_system': 0.5, 'max_rss': 1500, 'read_bytes': 10,
+           'http_requests': 5, 'docker_api_calls': 1}
+    assert get_resource_usage_delta(start, end) == {
+        'cpu_user': 0.5,
+        'cpu_system': 0.25,
+        'max_rss_delta': 500,
+        'http_requests': 2,
+        'docker_api_calls': 0,
+    }